@@ -1,22 +1,26 @@
+from dataclasses import replace
+from functools import partial
+
 import streamlit as st
 import pandas as pd
-import duckdb
 import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-from groq import Groq  # ✅ ใช้ Groq สำหรับ AI Insight
+from analytics import metrics
+from analytics.engine import get_engine
+from analytics.filters import Filters
+from analytics.instrumentation import start_trace
+from analytics.sketches import HLL_ERROR
+from analytics.store import append_snapshot, refresh_snapshot
+from ui_components import insight_section, render_engine_panel, render_filters, render_timing_panel, traced_fragment
 
 # ----------------- Page config -----------------
 st.set_page_config(page_title="Customer Analysis", page_icon="📊", layout="wide")
 st.title("📊 การวิเคราะห์ลูกค้า (Customer Analysis)")
+trace = start_trace("customer_analysis")
 
 # ----------------- Groq API Key -----------------
 groq_api_key = "MY_API_KEY"
 
-@st.cache_resource
-def get_groq_client(api_key: str):
-    return Groq(api_key=api_key)
-
 # ----------------- AI Prompt Builders -----------------
 def build_country_demand_insight(country_df: pd.DataFrame) -> str:
     # สรุปยอดรวมรายประเทศ (เฉพาะ top 15 ที่ใช้ในกราฟ)
@@ -114,37 +118,28 @@ def build_aov_group_insight(continent_summary: pd.DataFrame) -> str:
     return prompt
 
 
-def build_kpi_retention_insight(
-    total_purchases,
-    total_customers,
-    total_quantity,
-    cancel_count,
-    cancel_sum,
-    cancel_aov,
-    cancel_ratio,
-    retention_df: pd.DataFrame,
-) -> str:
+def build_kpi_retention_insight(kpi: metrics.KPIRecord) -> str:
     retention_summary = ""
-    if len(retention_df) > 0:
-        avg_months = retention_df["MonthsActive"].mean()
-        max_months = retention_df["MonthsActive"].max()
+    if kpi["retained_customers"] > 0:
         retention_summary = (
-            f"- ลูกค้าที่กลับมาซื้อซ้ำ: {len(retention_df):,} ราย\n"
-            f"- จำนวนเดือนเฉลี่ยที่กลับมาซื้อซ้ำ: {avg_months:.1f} เดือน (สูงสุด {max_months} เดือน)"
+            f"- ลูกค้าที่กลับมาซื้อซ้ำ: {kpi['retained_customers']:,} ราย\n"
+            f"- ลูกค้าที่มีคำสั่งซื้อตั้งแต่ 2 ครั้ง: {kpi['repeat_customers']:,} ราย\n"
+            f"- จำนวนเดือนเฉลี่ยที่กลับมาซื้อซ้ำ: {kpi['avg_months_active']:.1f} เดือน "
+            f"(สูงสุด {kpi['max_months_active']} เดือน)"
         )
 
     prompt = f"""
 สรุปตัวชี้วัดหลักของธุรกิจ:
 
-- คำสั่งซื้อรวม: {total_purchases:,} รายการ
-- ลูกค้ารวม: {total_customers:,} ราย
-- จำนวนสินค้าที่ขายได้: {total_quantity:,.0f} ชิ้น
+- คำสั่งซื้อรวม: {kpi['total_purchases']:,} รายการ
+- ลูกค้ารวม: {kpi['total_customers']:,} ราย
+- จำนวนสินค้าที่ขายได้: {kpi['total_quantity']:,.0f} ชิ้น
 
 สถานะคำสั่งซื้อที่ยกเลิก:
-- จำนวนคำสั่งซื้อที่ยกเลิก: {cancel_count:,} รายการ
-- มูลค่ารวมที่ยกเลิก: £{cancel_sum:,.2f}
-- มูลค่าเฉลี่ยต่อคำสั่งซื้อที่ยกเลิก: £{cancel_aov:,.2f}
-- สัดส่วนคำสั่งซื้อที่ยกเลิก: {cancel_ratio:.2f}%
+- จำนวนคำสั่งซื้อที่ยกเลิก: {kpi['cancel_count']:,} รายการ
+- มูลค่ารวมที่ยกเลิก: £{kpi['cancel_sum']:,.2f}
+- มูลค่าเฉลี่ยต่อคำสั่งซื้อที่ยกเลิก: £{kpi['cancel_aov']:,.2f}
+- สัดส่วนคำสั่งซื้อที่ยกเลิก: {kpi['cancel_ratio']:.2f}%
 
 Retention:
 {retention_summary}
@@ -185,808 +180,506 @@ def build_pareto_insight(summary_df: pd.DataFrame) -> str:
 """
     return prompt
 
-# ----------------- Load data -----------------
-@st.cache_data(ttl=60)
-def load_data():
-    url = 'https://docs.google.com/spreadsheets/d/12vD8wGU1HvXxpdFowsO7pgcXucI30Ei-gN2hRZEkL6s/export?format=csv'
-    df = pd.read_csv(url)
-    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
-    df['YearMonth'] = df['InvoiceDate'].dt.to_period('M').astype(str)
-    df['Month'] = df['InvoiceDate'].dt.month
-    df['MonthName'] = df['InvoiceDate'].dt.strftime('%b')
-    return df
-
-df = load_data()
-
-# ----------------- Country grouping -----------------
-asian_countries = ['Japan', 'Singapore', 'Hong Kong', 'Korea', 'China', 'Thailand',
-                   'Malaysia', 'Indonesia', 'Philippines', 'Vietnam', 'India', 'UAE', 'Saudi Arabia']
-eu_countries = ['United Kingdom', 'Germany', 'France', 'Spain', 'Italy', 'Netherlands',
-                'Belgium', 'Switzerland', 'Portugal', 'Sweden', 'Norway', 'Denmark',
-                'Finland', 'Austria', 'Poland', 'Greece', 'Ireland', 'Czech Republic']
-
-def classify_region(country):
-    if country in asian_countries:
-        return 'Asian Countries'
-    elif country in eu_countries:
-        return 'EU Countries'
-    else:
-        return 'Other Regions'
-
-df['Region'] = df['Country'].apply(classify_region)
-
-# DuckDB base
-con = duckdb.connect(':memory:')
-con.register('df_table', df)
+# ----------------- Load data (engine กลาง) -----------------
+with st.sidebar:
+    if st.button("⏩ ดึงเฉพาะข้อมูลใหม่", key="append_snapshot"):
+        with st.spinner("กำลังดึงข้อมูลที่เพิ่มเข้ามาใหม่จาก Google Sheets..."):
+            append_snapshot()
+    if st.button("🔄 รีเฟรชข้อมูลทั้งหมดจากต้นทาง", key="refresh_snapshot"):
+        with st.spinner("กำลังดึงข้อมูลใหม่จาก Google Sheets..."):
+            refresh_snapshot()
 
-# ====================================================
-# SECTION 1: Individual Countries
-# ====================================================
-st.header("🌍 ความต้องการของลูกค้าแบ่งตามประเทศ")
-
-query_country = """
-SELECT 
-    Country,
-    Month,
-    MonthName,
-    COUNT(DISTINCT InvoiceNo) as Frequency,
-    SUM(Quantity) as TotalQuantity
-FROM df_table
-WHERE Quantity > 0
-GROUP BY Country, Month, MonthName
-ORDER BY Country, Month
-"""
-country_data = con.execute(query_country).df()
+engine = get_engine()
+filters = render_filters(engine)
 
-tab1, tab2 = st.tabs(["ความถี่ในการซื้อสินค้า", "ปริมาณคำสั่งซื้อ"])
+# โหมดให้ AI วิเคราะห์ทุกส่วนพร้อมกัน: ทุก section ส่ง prompt เข้า insight service
+# แบบไม่รอผล จึงเรียก LLM พร้อมกันทั้งหมด และแต่ละ section แสดงผลเมื่อได้คำตอบ
+generate_all_insights = st.sidebar.toggle("🤖 ให้ AI วิเคราะห์ทุกส่วนพร้อมกัน", key="generate_all_insights")
 
-with tab1:
-    st.subheader("ความถี่ในการซื้อสินค้าของแต่ละประเทศแบ่งตามช่วงเวลา")
+# expander / tab ที่ตั้ง on_change="rerun" จะรู้สถานะเปิด-ปิด (.open)
+# จึงคำนวณเฉพาะส่วนที่ผู้ใช้เห็นอยู่ ส่วนที่ปิดอยู่ไม่ต้อง query / สร้างกราฟ
+render_engine_panel(engine)
 
-    top_countries = con.execute("""
-        SELECT Country, SUM(Quantity) as Total
-        FROM df_table
-        WHERE Quantity > 0
-        GROUP BY Country
-        ORDER BY Total DESC
-        LIMIT 15
-    """).df()
+month_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 
-    country_data_filtered = country_data[country_data['Country'].isin(top_countries['Country'])]
-
-    fig_line = px.line(
-        country_data_filtered,
-        x='Month',
-        y='Frequency',
-        color='Country',
-        markers=True,
-        title='Top 15 ประเทศที่มีความถี่ในการซื้อสินค้ามากที่สุดแบ่งตามเดือน',
-        labels={'Frequency': 'จำนวนคำสั่งซื้อ', 'Month': 'เดือน'}
-    )
-    fig_line.update_layout(height=600, hovermode='x unified',
-                           xaxis=dict(tickmode='linear', dtick=1))
-    st.plotly_chart(fig_line, use_container_width=True)
-
-with tab2:
-    st.subheader("Heatmap แสดงปริมาณคำสั่งซื้อของแต่ละประเทศแบ่งตามช่วงเวลา")
-
-    heatmap_data = country_data.pivot_table(
-        index='Country',
-        columns='Month',
-        values='TotalQuantity',
-        fill_value=0
-    )
-
-    top_15_countries = heatmap_data.sum(axis=1).nlargest(15).index
-    heatmap_data_filtered = heatmap_data.loc[top_15_countries]
-
-    month_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-                    'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-
-    fig_heatmap = go.Figure(data=go.Heatmap(
-        z=heatmap_data_filtered.values,
-        x=month_labels,
-        y=heatmap_data_filtered.index,
-        colorscale='YlOrRd',
-        text=heatmap_data_filtered.values,
-        texttemplate='%{text:.0f}',
-        textfont={"size": 12},
-        colorbar=dict(title="Quantity")
-    ))
-    fig_heatmap.update_layout(
-        title='Top 15 ประเทศที่มีปริมาณคำสั่งซื้อมากที่สุดแบ่งตามเดือน',
-        xaxis_title='เดือน',
-        yaxis_title='ประเทศ',
-        height=650,
-        yaxis=dict(autorange='reversed')
-    )
-    st.plotly_chart(fig_heatmap, use_container_width=True)
-
-# ---- AI Insight: Section 1 ----
-st.subheader("🤖 AI Insights: ความต้องการลูกค้าแบ่งตามประเทศ")
-mode_country_ai = st.radio(
-    "โหมดการแสดงผล (ความต้องการรายประเทศ)",
-    ["แสดงกราฟอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
-    horizontal=True,
-    key="mode_country_ai",
-)
-if mode_country_ai == "ให้ AI วิเคราะห์ส่วนนี้":
-    with st.spinner("AI กำลังวิเคราะห์ความต้องการรายประเทศ..."):
-        client = get_groq_client(groq_api_key)
-        prompt = build_country_demand_insight(country_data_filtered)
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            temperature=0.2,
-            messages=[
-                {"role": "system", "content": "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ข้อมูลลูกค้าและ Demand"},
-                {"role": "user", "content": prompt},
-            ],
-        )
-        insight = completion.choices[0].message.content
-    st.markdown(insight)
+# แต่ละ section เป็น fragment: เปลี่ยน tab หรือโหมด AI ของ section ไหน
+# จะ rerun เฉพาะ section นั้น ไม่คำนวณ section อื่นซ้ำ
 
 # ====================================================
-# SECTION 2: Regional Groups
+# SECTION 1: Individual Countries
 # ====================================================
-st.header("🌏 ความต้องการของลูกค้าแบ่งตามภูมิภาค")
-
-query_region = """
-SELECT 
-    Region,
-    Month,
-    MonthName,
-    COUNT(DISTINCT InvoiceNo) as Frequency,
-    SUM(Quantity) as TotalQuantity
-FROM df_table
-WHERE Quantity > 0
-GROUP BY Region, Month, MonthName
-ORDER BY Region, Month
-"""
-region_data = con.execute(query_region).df()
-
-tab3, tab4 = st.tabs(["ความถี่ในการซื้อสินค้า", "ปริมาณคำสั่งซื้อ"])
+@traced_fragment("country")
+def render_country_section(engine, filters: Filters, generate_all_insights: bool):
+    st.header("🌍 ความต้องการของลูกค้าแบ่งตามประเทศ")
 
-with tab3:
-    st.subheader("ความถี่ในการซื้อสินค้าของแต่ละภูมิภาคแบ่งตามช่วงเวลา")
+    country_data = metrics.country_demand(engine, filters)
+    top_countries = metrics.top_countries(engine, limit=15, filters=filters)
+    country_data_filtered = country_data[country_data['Country'].isin(top_countries['Country'])]
 
-    fig_region_line = px.line(
-        region_data,
-        x='Month',
-        y='Frequency',
-        color='Region',
-        markers=True,
-        title='เปรียบเทียบความถี่ในการซื้อสินค้าของแต่ละภูมิภาคแบ่งตามเดือน',
-        labels={'Frequency': 'จำนวนคำสั่งซื้อ', 'Month': 'เดือน'}
-    )
-    fig_region_line.update_layout(
-        height=500, hovermode='x unified',
-        xaxis=dict(tickmode='linear', dtick=1)
+    tab1, tab2 = st.tabs(["ความถี่ในการซื้อสินค้า", "ปริมาณคำสั่งซื้อ"], key="country_tabs", on_change="rerun")
+
+    if tab1.open:
+        with tab1:
+            st.subheader("ความถี่ในการซื้อสินค้าของแต่ละประเทศแบ่งตามช่วงเวลา")
+
+            fig_line = px.line(
+                country_data_filtered,
+                x='Month',
+                y='Frequency',
+                color='Country',
+                markers=True,
+                title='Top 15 ประเทศที่มีความถี่ในการซื้อสินค้ามากที่สุดแบ่งตามเดือน',
+                labels={'Frequency': 'จำนวนคำสั่งซื้อ', 'Month': 'เดือน'}
+            )
+            fig_line.update_layout(height=600, hovermode='x unified',
+                                   xaxis=dict(tickmode='linear', dtick=1))
+            st.plotly_chart(fig_line, use_container_width=True)
+
+    if tab2.open:
+        with tab2:
+            st.subheader("Heatmap แสดงปริมาณคำสั่งซื้อของแต่ละประเทศแบ่งตามช่วงเวลา")
+
+            heatmap_data = country_data.pivot_table(
+                index='Country',
+                columns='Month',
+                values='TotalQuantity',
+                fill_value=0
+            )
+
+            top_15_countries = heatmap_data.sum(axis=1).nlargest(15).index
+            heatmap_data_filtered = heatmap_data.loc[top_15_countries]
+
+            fig_heatmap = go.Figure(data=go.Heatmap(
+                z=heatmap_data_filtered.values,
+                x=[month_labels[m - 1] for m in heatmap_data_filtered.columns],
+                y=heatmap_data_filtered.index,
+                colorscale='YlOrRd',
+                text=heatmap_data_filtered.values,
+                texttemplate='%{text:.0f}',
+                textfont={"size": 12},
+                colorbar=dict(title="Quantity")
+            ))
+            fig_heatmap.update_layout(
+                title='Top 15 ประเทศที่มีปริมาณคำสั่งซื้อมากที่สุดแบ่งตามเดือน',
+                xaxis_title='เดือน',
+                yaxis_title='ประเทศ',
+                height=650,
+                yaxis=dict(autorange='reversed')
+            )
+            st.plotly_chart(fig_heatmap, use_container_width=True)
+
+    insight_section(
+        groq_api_key,
+        "🤖 AI Insights: ความต้องการลูกค้าแบ่งตามประเทศ",
+        "โหมดการแสดงผล (ความต้องการรายประเทศ)",
+        ["แสดงกราฟอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
+        "mode_country_ai",
+        generate_all_insights,
+        "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ข้อมูลลูกค้าและ Demand",
+        partial(build_country_demand_insight, country_data_filtered),
+        engine.version,
+        "AI กำลังวิเคราะห์ความต้องการรายประเทศ...",
     )
-    st.plotly_chart(fig_region_line, use_container_width=True)
-
-    st.subheader("📊 ปริมาณคำสั่งซื้อรวมของแต่ละภูมิภาคแบ่งตามช่วงเวลา")
-    fig_quantity = px.line(
-        region_data,
-        x='Month',
-        y='TotalQuantity',
-        color='Region',
-        markers=True,
-        title='ปริมาณคำสั่งซื้อรวมของแต่ละภูมิภาคแบ่งตามเดือน',
-        labels={'Month': 'เดือน', 'TotalQuantity': 'ปริมาณคำสั่งซื้อรวม'}
-    )
-    fig_quantity.update_layout(
-        height=400,
-        hovermode='x unified',
-        xaxis=dict(tickmode='linear', dtick=1)
-    )
-    st.plotly_chart(fig_quantity, use_container_width=True)
 
-with tab4:
-    st.subheader("Heatmap แสดงปริมาณคำสั่งซื้อรวมของแต่ละภูมิภาคแบ่งตามช่วงเวลา")
 
-    region_heatmap = region_data.pivot_table(
-        index='Region',
-        columns='Month',
-        values='TotalQuantity',
-        fill_value=0
+# ====================================================
+# SECTION 2: Regional Groups
+# ====================================================
+@traced_fragment("region")
+def render_region_section(engine, filters: Filters, generate_all_insights: bool):
+    st.header("🌏 ความต้องการของลูกค้าแบ่งตามภูมิภาค")
+
+    region_data = metrics.region_demand(engine, filters)
+
+    tab3, tab4 = st.tabs(["ความถี่ในการซื้อสินค้า", "ปริมาณคำสั่งซื้อ"], key="region_tabs", on_change="rerun")
+
+    if tab3.open:
+        with tab3:
+            st.subheader("ความถี่ในการซื้อสินค้าของแต่ละภูมิภาคแบ่งตามช่วงเวลา")
+
+            fig_region_line = px.line(
+                region_data,
+                x='Month',
+                y='Frequency',
+                color='Region',
+                markers=True,
+                title='เปรียบเทียบความถี่ในการซื้อสินค้าของแต่ละภูมิภาคแบ่งตามเดือน',
+                labels={'Frequency': 'จำนวนคำสั่งซื้อ', 'Month': 'เดือน'}
+            )
+            fig_region_line.update_layout(
+                height=500, hovermode='x unified',
+                xaxis=dict(tickmode='linear', dtick=1)
+            )
+            st.plotly_chart(fig_region_line, use_container_width=True)
+
+            st.subheader("📊 ปริมาณคำสั่งซื้อรวมของแต่ละภูมิภาคแบ่งตามช่วงเวลา")
+            fig_quantity = px.line(
+                region_data,
+                x='Month',
+                y='TotalQuantity',
+                color='Region',
+                markers=True,
+                title='ปริมาณคำสั่งซื้อรวมของแต่ละภูมิภาคแบ่งตามเดือน',
+                labels={'Month': 'เดือน', 'TotalQuantity': 'ปริมาณคำสั่งซื้อรวม'}
+            )
+            fig_quantity.update_layout(
+                height=400,
+                hovermode='x unified',
+                xaxis=dict(tickmode='linear', dtick=1)
+            )
+            st.plotly_chart(fig_quantity, use_container_width=True)
+
+    if tab4.open:
+        with tab4:
+            st.subheader("Heatmap แสดงปริมาณคำสั่งซื้อรวมของแต่ละภูมิภาคแบ่งตามช่วงเวลา")
+
+            region_heatmap = region_data.pivot_table(
+                index='Region',
+                columns='Month',
+                values='TotalQuantity',
+                fill_value=0
+            )
+
+            fig_region_heatmap = go.Figure(data=go.Heatmap(
+                z=region_heatmap.values,
+                x=[month_labels[m - 1] for m in region_heatmap.columns],
+                y=region_heatmap.index,
+                colorscale='Viridis',
+                text=region_heatmap.values,
+                texttemplate='%{text:.0f}',
+                textfont={"size": 12},
+                colorbar=dict(title="Quantity")
+            ))
+            fig_region_heatmap.update_layout(
+                title='ปริมาณคำสั่งซื้อของแต่ละภูมิภาคแบ่งตามเดือน',
+                xaxis_title='เดือน',
+                yaxis_title='ภูมิภาค',
+                height=400
+            )
+            st.plotly_chart(fig_region_heatmap, use_container_width=True)
+
+    insight_section(
+        groq_api_key,
+        "🤖 AI Insights: ความต้องการลูกค้าแบ่งตามภูมิภาค",
+        "โหมดการแสดงผล (ความต้องการรายภูมิภาค)",
+        ["แสดงกราฟอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
+        "mode_region_ai",
+        generate_all_insights,
+        "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ Demand รายภูมิภาค",
+        partial(build_region_demand_insight, region_data),
+        engine.version,
+        "AI กำลังวิเคราะห์ความต้องการรายภูมิภาค...",
     )
 
-    fig_region_heatmap = go.Figure(data=go.Heatmap(
-        z=region_heatmap.values,
-        x=month_labels,
-        y=region_heatmap.index,
-        colorscale='Viridis',
-        text=region_heatmap.values,
-        texttemplate='%{text:.0f}',
-        textfont={"size": 12},
-        colorbar=dict(title="Quantity")
-    ))
-    fig_region_heatmap.update_layout(
-        title='ปริมาณคำสั่งซื้อของแต่ละภูมิภาคแบ่งตามเดือน',
-        xaxis_title='เดือน',
-        yaxis_title='ภูมิภาค',
-        height=400
-    )
-    st.plotly_chart(fig_region_heatmap, use_container_width=True)
-
-# ---- AI Insight: Section 2 ----
-st.subheader("🤖 AI Insights: ความต้องการลูกค้าแบ่งตามภูมิภาค")
-mode_region_ai = st.radio(
-    "โหมดการแสดงผล (ความต้องการรายภูมิภาค)",
-    ["แสดงกราฟอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
-    horizontal=True,
-    key="mode_region_ai",
-)
-if mode_region_ai == "ให้ AI วิเคราะห์ส่วนนี้":
-    with st.spinner("AI กำลังวิเคราะห์ความต้องการรายภูมิภาค..."):
-        client = get_groq_client(groq_api_key)
-        prompt = build_region_demand_insight(region_data)
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            temperature=0.2,
-            messages=[
-                {"role": "system", "content": "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ Demand รายภูมิภาค"},
-                {"role": "user", "content": prompt},
-            ],
-        )
-    insight = completion.choices[0].message.content
-    st.markdown(insight)
+    st.divider()
 
-st.divider()
 
 # ====================================================
 # SECTION 3: AOV by Country / Continent
 # ====================================================
-aov_query = """
-WITH cleaned AS (
-    SELECT
-        InvoiceNo,
-        Country,
-        SUM(Quantity * UnitPrice) AS InvoiceSales
-    FROM df
-    WHERE InvoiceNo NOT LIKE 'C%'  
-    GROUP BY InvoiceNo, Country
-)
-SELECT
-    Country,
-    AVG(InvoiceSales) AS AOV
-FROM cleaned
-GROUP BY Country
-ORDER BY AOV DESC;
-"""
-st.header("📊 E-commerce Analytics: AOV แบ่งตามประเทศและทวีป")
-
-aov = duckdb.query(aov_query).to_df()
-
-# -----------------------------
-# Continent mapping แบบง่ายสำหรับ Online Retail
-# -----------------------------
-continent_mapping = {
-    # Europe
-    "United Kingdom": "Europe",
-    "EIRE": "Europe",
-    "Netherlands": "Europe",
-    "Germany": "Europe",
-    "France": "Europe",
-    "Spain": "Europe",
-    "Portugal": "Europe",
-    "Belgium": "Europe",
-    "Switzerland": "Europe",
-    "Norway": "Europe",
-    "Sweden": "Europe",
-    "Finland": "Europe",
-    "Italy": "Europe",
-    "Austria": "Europe",
-    "Denmark": "Europe",
-    "Poland": "Europe",
-    "Greece": "Europe",
-    "Cyprus": "Europe",
-    "Channel Islands": "Europe",
-    "Iceland": "Europe",
-    "Malta": "Europe",
-    "Lithuania": "Europe",
-    "Czech Republic": "Europe",
-    "European Community" : "Europe",
-    "Albania": "Europe",
-    "Andorra": "Europe",
-    "Belarus": "Europe",
-    "Bosnia and Herzegovina": "Europe",
-    "Bulgaria": "Europe",
-    "Croatia": "Europe",
-    "Estonia": "Europe",
-    "Faroe Islands": "Europe",
-    "Gibraltar": "Europe",
-    "Guernsey": "Europe",
-    "Holy See": "Europe",
-    "Hungary": "Europe",
-    "Ireland": "Europe",
-    "Isle of Man": "Europe",
-    "Jersey": "Europe",
-    "Latvia": "Europe",
-    "Liechtenstein": "Europe",
-    "Luxembourg": "Europe",
-    "Malta": "Europe",
-    "Monaco": "Europe",
-    "Montenegro": "Europe",
-    "North Macedonia": "Europe",
-    "Republic of Moldova": "Europe",
-    "Romania": "Europe",
-    "San Marino": "Europe",
-    "Serbia": "Europe",
-    "Slovakia": "Europe",
-    "Slovenia": "Europe",
-    "Ukraine": "Europe",
-    "Kosovo": "Europe",
-
-    # Asia / Middle East
-    "Israel": "Asia",
-    "Japan": "Asia",
-    "Singapore": "Asia",
-    "Hong Kong": "Asia",
-    "Thailand": "Asia",
-    "Korea": "Asia",
-    "China": "Asia",
-    "Saudi Arabia": "Asia",
-    "United Arab Emirates": "Asia",
-    "Lebanon": "Asia",
-    "Bahrain" : "Asia",
-    "Afghanistan": "Asia",
-    "Armenia": "Asia",
-    "Azerbaijan": "Asia",
-    "Bangladesh": "Asia",
-    "Bhutan": "Asia",
-    "Brunei Darussalam": "Asia",
-    "Cambodia": "Asia",
-    "Georgia": "Asia",
-    "India": "Asia",
-    "Indonesia": "Asia",
-    "Iran": "Asia",
-    "Iraq": "Asia",
-    "Jordan": "Asia",
-    "Kazakhstan": "Asia",
-    "Kuwait": "Asia",
-    "Kyrgyzstan": "Asia",
-    "Laos": "Asia",
-    "Macao": "Asia",
-    "Malaysia": "Asia",
-    "Maldives": "Asia",
-    "Mongolia": "Asia",
-    "Myanmar": "Asia",
-    "Nepal": "Asia",
-    "Oman": "Asia",
-    "Pakistan": "Asia",
-    "Palestine, State of": "Asia",
-    "Philippines": "Asia",
-    "Qatar": "Asia",
-    "Republic of Korea": "Asia",
-    "Sri Lanka": "Asia",
-    "Syrian Arab Republic": "Asia",
-    "Tajikistan": "Asia",
-    "Timor-Leste": "Asia",
-    "Turkey": "Asia",
-    "Turkmenistan": "Asia",
-    "Uzbekistan": "Asia",
-    "Viet Nam": "Asia",
-    "Yemen": "Asia",
- 
-    # Oceania
-    "Australia": "Oceania",
-    "New Zealand": "Oceania",
-
-    # Americas & Africa
-    "USA": "Americas",
-    "Brazil": "Americas",
-    "Canada": "Americas",
-    "Belize": "Americas",
-    "Costa Rica": "Americas",
-    "El Salvador": "Americas",
-    "Guatemala": "Americas",
-    "Honduras": "Americas",
-    "Mexico": "Americas",
-    "Nicaragua": "Americas",
-    "Panama": "Americas",
-    "Antigua and Barbuda": "Americas",
-    "Bahamas": "Americas",
-    "Barbados": "Americas",
-    "Cuba": "Americas",
-    "Dominica": "Americas",
-    "Dominican Republic": "Americas",
-    "Grenada": "Americas",
-    "Haiti": "Americas",
-    "Jamaica": "Americas",
-    "Saint Kitts and Nevis": "Americas",
-    "Saint Lucia": "Americas",
-    "Saint Vincent and the Grenadines": "Americas",
-    "Trinidad and Tobago": "Americas",
-    "Argentina": "Americas",
-    "Bolivia": "Americas",
-    "Brazil": "Americas",
-    "Chile": "Americas",
-    "Colombia": "Americas",
-    "Ecuador": "Americas",
-    "Guyana": "Americas",
-    "Paraguay": "Americas",
-    "Peru": "Americas",
-    "Suriname": "Americas",
-    "Uruguay (Oriental Republic of)": "Americas",
-    "Venezuela (Bolivarian Republic of)": "Americas",
-
-    # Africa
-    "Algeria": "Africa",
-    "Angola": "Africa",
-    "Benin": "Africa",
-    "Botswana": "Africa",
-    "Burkina Faso": "Africa",
-    "Burundi": "Africa",
-    "Cabo Verde": "Africa",
-    "Cameroon": "Africa",
-    "Central African Republic": " Africa",
-    "Chad": "Africa",
-    "Comoros": "Africa",
-    "Congo": "Africa",
-    "Côte d'Ivoire": "Africa",
-    "Democratic Republic of the Congo": "Africa",
-    "Djibouti": "Africa",
-    "Egypt": "Africa",
-    "Equatorial Guinea": "Africa",
-    "Eritrea": "Africa",
-    "Eswatini": "Africa",
-    "Ethiopia": "Africa",
-    "Gabon": "Africa",
-    "Gambia": "Africa",
-    "Ghana": "Africa",
-    "Guinea": "Africa",
-    "Guinea-Bissau": "Africa",
-    "Kenya": "Africa",
-    "Lesotho": "Africa",
-    "Liberia": "Africa",
-    "Libya": "Africa",
-    "Madagascar": "Africa",
-    "Malawi": "Africa",
-    "Mali": "Africa",
-    "Mauritania": "Africa",
-    "Mauritius": "Africa",
-    "Morocco": "Africa",
-    "Mozambique": "Africa",
-    "Namibia": "Africa",
-    "Niger": "Africa",
-    "Nigeria": "Africa",
-    "Rwanda": "Africa",
-    "Sao Tome and Principe": "Africa",
-    "Senegal": "Africa",
-    "Seychelles": "Africa",
-    "Sierra Leone": "Africa",
-    "Somalia": "Africa",
-    "South Africa": "Africa",
-    "South Sudan": "Africa",
-    "Sudan": "Africa",
-    "Tanzania": "Africa",
-    "Togo": "Africa",
-    "Tunisia": "Africa",
-    "Uganda": "Africa",
-    "Zambia": "Africa",
-    "Zimbabwe": "Africa",
-    "RSA": "Africa"
-}
-
-def assign_group(country: str) -> str:
-    return continent_mapping.get(country)
-
-aov['Group'] = aov['Country'].apply(assign_group)
-aov['AOV'] = aov['AOV'].round(2)
-
-continent_summary = aov.groupby('Group', as_index=False)['AOV'].mean()
-continent_summary = continent_summary.sort_values(by="AOV", ascending=False)
-
-fig_overview = px.bar(
-    continent_summary,
-    x="Group",
-    y="AOV",
-    color="Group",
-    color_discrete_map={"Asia": "orange", "Europe": "blue"}, 
-    title="มูลค่าคำสั่งซื้อโดยเฉลี่ยรายทวีป ( หน่วย : £ )"
-)
-fig_overview.update_layout(
-    xaxis_title="ทวีป",
-    yaxis_title="มูลค่าคำสั่งซื้อโดยเฉลี่ย ( หน่วย : £ )"
-)
-st.plotly_chart(fig_overview, use_container_width=True)
-
-aov_asia = aov[aov['Group'] == "Asia"].sort_values(by="AOV", ascending=False)
-aov_europe = aov[aov['Group'] == "Europe"].sort_values(by="AOV", ascending=False)
-
-for df_aov, title, key in [
-    (aov_asia, "มูลค่าคำสั่งซื้อโดยเฉลี่ยรายประเทศที่อยู่ในทวีปเอเชีย ( หน่วย : £ )", "asia"),
-    (aov_europe, "มูลค่าคำสั่งซื้อโดยเฉลี่ยรายประเทศที่อยู่ในทวีปยุโรป ( หน่วย : £ )", "europe"),
-]:
-    df_aov['AOV'] = df_aov['AOV'].round(2)
-    fig = px.bar(
-        df_aov,
-        x="Country",
+@traced_fragment("aov")
+def render_aov_section(engine, filters: Filters, generate_all_insights: bool):
+    st.header("📊 E-commerce Analytics: AOV แบ่งตามประเทศและทวีป")
+
+    aov = metrics.aov_by_country(engine, filters)
+    continent_summary = metrics.aov_by_continent(aov)
+
+    fig_overview = px.bar(
+        continent_summary,
+        x="Group",
         y="AOV",
-        color="Country",
-        title=title,
+        color="Group",
+        color_discrete_map={"Asia": "orange", "Europe": "blue"}, 
+        title="มูลค่าคำสั่งซื้อโดยเฉลี่ยรายทวีป ( หน่วย : £ )"
     )
-    fig.update_layout(
-        xaxis_title="ประเทศ",
+    fig_overview.update_layout(
+        xaxis_title="ทวีป",
         yaxis_title="มูลค่าคำสั่งซื้อโดยเฉลี่ย ( หน่วย : £ )"
     )
-    st.plotly_chart(fig, use_container_width=True)
-
-# ---- AI Insight: AOV ----
-st.subheader("🤖 AI Insights: AOV แบ่งตามทวีป")
-mode_aov_ai = st.radio(
-    "โหมดการแสดงผล (AOV รายทวีป)",
-    ["แสดงกราฟอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
-    horizontal=True,
-    key="mode_aov_ai",
-)
-if mode_aov_ai == "ให้ AI วิเคราะห์ส่วนนี้":
-    with st.spinner("AI กำลังวิเคราะห์ AOV รายทวีป..."):
-        client = get_groq_client(groq_api_key)
-        prompt = build_aov_group_insight(continent_summary)
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            temperature=0.2,
-            messages=[
-                {"role": "system", "content": "คุณเป็นผู้เชี่ยวชาญด้าน Pricing และ AOV"},
-                {"role": "user", "content": prompt},
-            ],
+    st.plotly_chart(fig_overview, use_container_width=True)
+
+    aov_asia = aov[aov['Group'] == "Asia"].sort_values(by="AOV", ascending=False)
+    aov_europe = aov[aov['Group'] == "Europe"].sort_values(by="AOV", ascending=False)
+
+    for df_aov, title, key in [
+        (aov_asia, "มูลค่าคำสั่งซื้อโดยเฉลี่ยรายประเทศที่อยู่ในทวีปเอเชีย ( หน่วย : £ )", "asia"),
+        (aov_europe, "มูลค่าคำสั่งซื้อโดยเฉลี่ยรายประเทศที่อยู่ในทวีปยุโรป ( หน่วย : £ )", "europe"),
+    ]:
+        df_aov['AOV'] = df_aov['AOV'].round(2)
+        fig = px.bar(
+            df_aov,
+            x="Country",
+            y="AOV",
+            color="Country",
+            title=title,
         )
-        insight = completion.choices[0].message.content
-    st.markdown(insight)
+        fig.update_layout(
+            xaxis_title="ประเทศ",
+            yaxis_title="มูลค่าคำสั่งซื้อโดยเฉลี่ย ( หน่วย : £ )"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    insight_section(
+        groq_api_key,
+        "🤖 AI Insights: AOV แบ่งตามทวีป",
+        "โหมดการแสดงผล (AOV รายทวีป)",
+        ["แสดงกราฟอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
+        "mode_aov_ai",
+        generate_all_insights,
+        "คุณเป็นผู้เชี่ยวชาญด้าน Pricing และ AOV",
+        partial(build_aov_group_insight, continent_summary),
+        engine.version,
+        "AI กำลังวิเคราะห์ AOV รายทวีป...",
+    )
+
+    st.divider()
 
-st.divider()
 
 # ====================================================
 # SECTION 4: KPI + Cancel + Retention
 # ====================================================
-cancel_query = """
-    WITH InvoiceNoC as ( 
-        SELECT * 
-        FROM df
-        WHERE InvoiceNo LIKE 'C%' )
-
-    , InvoiceNoCount as (
-        SELECT 
-            InvoiceNo,
-            SUM(-1*(Quantity * UnitPrice)) AS InvoiceSalesPerInvoiceNo
-        FROM InvoiceNoC
-        GROUP BY InvoiceNo )
-    
-    SELECT count(InvoiceNo) as total_cancel_invoices ,
-           ROUND(SUM(InvoiceSalesPerInvoiceNo), 2) as sum ,
-           ROUND(AVG(InvoiceSalesPerInvoiceNo), 2) AS AOV 
-    FROM InvoiceNoCount
-""" 
-
-Cancel_all = duckdb.query(cancel_query).to_df()
-
-st.header("💡 Key Insights")
-
-col1, col2, col3 = st.columns(3)
-with col1:
-    total_purchases = con.execute(
-        "SELECT COUNT(DISTINCT InvoiceNo) FROM df_table WHERE Quantity > 0"
-    ).fetchone()[0]
-    st.metric("คำสั่งซื้อรวม", f"{total_purchases:,} รายการ")
-with col2:
-    total_customers = con.execute(
-        "SELECT COUNT(DISTINCT CustomerID) FROM df_table WHERE CustomerID IS NOT NULL"
-    ).fetchone()[0]
-    st.metric("จำนวนลูกค้ารวม", f"{total_customers:,} ราย")
-with col3:
-    total_quantity = con.execute(
-        "SELECT SUM(Quantity) FROM df_table WHERE Quantity > 0"
-    ).fetchone()[0]
-    st.metric("จำนวนสินค้าที่ขายได้", f"{total_quantity:,.0f} ชิ้น")
-
-col4, col5, col6 = st.columns(3)
-with col4:
-    cancel_count = Cancel_all['total_cancel_invoices'].iloc[0] if len(Cancel_all) > 0 else 0
-    st.metric("คำสั่งซื้อที่ยกเลิก", f"{int(cancel_count):,} รายการ")
-with col5:
-    cancel_sum = Cancel_all['sum'].iloc[0] if len(Cancel_all) > 0 else 0
-    st.metric("มูลค่ารวมที่ยกเลิก", f"£{cancel_sum:,.2f}")
-with col6:
-    cancel_aov = Cancel_all['AOV'].iloc[0] if len(Cancel_all) > 0 else 0
-    st.metric("มูลค่าเฉลี่ยต่อคำสั่งซื้อที่ยกเลิก", f"£{cancel_aov:,.2f}")
-
-col7, _, _ = st.columns(3)
-with col7:
-    cancel_ratio = (
-        cancel_count / (total_purchases + cancel_count) * 100
-        if total_purchases > 0 else 0
+@traced_fragment("kpi")
+def render_kpi_section(engine, filters: Filters, generate_all_insights: bool):
+    kpi = metrics.kpi_summary(engine, filters)
+
+    st.header("💡 Key Insights")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("คำสั่งซื้อรวม", f"{kpi['total_purchases']:,} รายการ")
+    with col2:
+        if kpi["customers_approximate"]:
+            st.metric(
+                "จำนวนลูกค้ารวม (ค่าประมาณ)", f"≈{kpi['total_customers']:,} ราย",
+                help=f"ประมาณจาก HyperLogLog sketch ความคลาดเคลื่อนมาตรฐาน ±{HLL_ERROR:.1%}",
+            )
+        else:
+            st.metric("จำนวนลูกค้ารวม", f"{kpi['total_customers']:,} ราย")
+    with col3:
+        st.metric("จำนวนสินค้าที่ขายได้", f"{kpi['total_quantity']:,.0f} ชิ้น")
+
+    col4, col5, col6 = st.columns(3)
+    with col4:
+        st.metric("คำสั่งซื้อที่ยกเลิก", f"{kpi['cancel_count']:,} รายการ")
+    with col5:
+        st.metric("มูลค่ารวมที่ยกเลิก", f"£{kpi['cancel_sum']:,.2f}")
+    with col6:
+        st.metric("มูลค่าเฉลี่ยต่อคำสั่งซื้อที่ยกเลิก", f"£{kpi['cancel_aov']:,.2f}")
+
+    col7, _, _ = st.columns(3)
+    with col7:
+        st.metric("สัดส่วนคำสั่งซื้อที่ยกเลิก", f"{kpi['cancel_ratio']:.2f}%")
+
+    st.header("🔄 Customer Retention Pattern Analysis")
+
+    if kpi["retained_customers"] > 0:
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            st.metric("ลูกค้ากลับมาซื้อซ้ำ", f"{kpi['retained_customers']:,} ราย")
+        with c2:
+            st.metric("ช่วงเวลาเฉลี่ยที่ลูกค้ากลับมาซื้อซ้ำ", f"{kpi['avg_months_active']:.1f} เดือน")
+        with c3:
+            st.metric("ลูกค้าที่มีคำสั่งซื้อตั้งแต่ 2 ครั้ง", f"{kpi['repeat_customers']:,} ราย")
+
+    retention_buckets = pd.DataFrame(
+        list(kpi["retention_buckets"].items()), columns=["MonthsActive", "Customers"]
     )
-    st.metric("สัดส่วนคำสั่งซื้อที่ยกเลิก", f"{cancel_ratio:.2f}%")
-
-st.header("🔄 Customer Retention Pattern Analysis")
-query_retention = """
-SELECT 
-    CustomerID,
-    COUNT(DISTINCT Month) as MonthsActive,
-    MIN(Month) as FirstPurchaseMonth,
-    MAX(Month) as LastPurchaseMonth
-FROM df_table
-WHERE Quantity > 0 AND CustomerID IS NOT NULL
-GROUP BY CustomerID
-HAVING COUNT(DISTINCT Month) >= 2
-"""
-retention_data = con.execute(query_retention).df()
+    fig_dist = px.bar(
+        retention_buckets,
+        x='MonthsActive',
+        y='Customers',
+        title='การแจงแจกแสดงจำนวนเดือนที่ลูกค้ากลับมาซื้อซ้ำ',
+        labels={'MonthsActive': 'จำนวนเดือนที่ลูกค้ากลับมาซื้อซ้ำ'}
+    )
+    fig_dist.update_layout(height=450, yaxis_title='จำนวนลูกค้า')
+    st.plotly_chart(fig_dist, use_container_width=True)
+
+    # Cohort Retention: ลูกค้าแบ่งตามเดือนที่ซื้อครั้งแรก กลับมาซื้อในเดือนถัด ๆ ไปกี่ % (ตามตัวกรอง)
+    cohort_panel = st.expander("📅 Cohort Retention (ตามเดือนที่ซื้อครั้งแรก)", key="cohort_panel", on_change="rerun")
+    if cohort_panel.open:
+        with cohort_panel:
+            cohorts = metrics.cohort_retention(engine, filters)
+            retention_matrix = cohorts.pivot(index='Cohort', columns='MonthOffset', values='RetentionPercent')
+            customer_matrix = cohorts.pivot(index='Cohort', columns='MonthOffset', values='Customers')
+            fig_cohort = go.Figure(data=go.Heatmap(
+                z=retention_matrix.values,
+                x=[f"+{m}" for m in retention_matrix.columns],
+                y=retention_matrix.index,
+                colorscale='Blues',
+                customdata=customer_matrix.values,
+                text=retention_matrix.values,
+                texttemplate='%{text:.0f}%',
+                hovertemplate='Cohort %{y} เดือน %{x}: %{z:.1f}% (%{customdata:,} ราย)<extra></extra>',
+                colorbar=dict(title="%")
+            ))
+            fig_cohort.update_layout(
+                title='สัดส่วนลูกค้าของแต่ละ cohort ที่กลับมาซื้อในเดือนถัดไป',
+                xaxis_title='จำนวนเดือนหลังซื้อครั้งแรก',
+                yaxis_title='Cohort (เดือนที่ซื้อครั้งแรก)',
+                height=550,
+                yaxis=dict(autorange='reversed')
+            )
+            st.plotly_chart(fig_cohort, use_container_width=True)
+
+    insight_section(
+        groq_api_key,
+        "🤖 AI Insights: KPI, Cancellation และ Retention",
+        "โหมดการแสดงผล (KPI & Retention)",
+        ["แสดงตัวเลขอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
+        "mode_kpi_ai",
+        generate_all_insights,
+        "คุณเป็นผู้เชี่ยวชาญด้าน Business Analytics และ CRM",
+        partial(build_kpi_retention_insight, kpi),
+        engine.version,
+        "AI กำลังวิเคราะห์ KPI และ Retention...",
+    )
+
+    st.divider()
+
+
+# ====================================================
+# SECTION 5: Pareto Analysis
+# ====================================================
+@traced_fragment("pareto")
+def render_pareto_section(engine, filters: Filters, generate_all_insights: bool):
+    st.header("🔑 Pareto Analysis ")
+    st.markdown("Pareto Analysis คือกลุ่มสินค้า 20% แรก ที่สร้างยอดขาย 80% จากยอดขายทั้งหมด")
+
+    # เจาะดูรายประเทศ / รายไตรมาส ภายในตัวกรองของหน้า (rerun เฉพาะ section นี้)
+    months = [
+        m for m in metrics.filter_options(engine)["months"]
+        if (filters.start_month or m) <= m <= (filters.end_month or m)
+    ]
+    quarters = {}
+    for m in months:
+        quarters.setdefault(str(pd.Period(m, "M").asfreq("Q")), []).append(m)
+    d1, d2 = st.columns(2)
+    with d1:
+        country = st.selectbox(
+            "เจาะดูประเทศ",
+            ["ทุกประเทศ", *metrics.country_value(engine, filters)["country"]],
+            key="pareto_country",
+        )
+    with d2:
+        quarter = st.selectbox("เจาะดูไตรมาส", ["ทั้งช่วง", *quarters], key="pareto_quarter")
+    if country != "ทุกประเทศ":
+        filters = replace(filters, countries=(country,))
+    if quarter in quarters:
+        filters = replace(filters, start_month=quarters[quarter][0], end_month=quarters[quarter][-1])
+
+    pareto = metrics.pareto_summary(engine, filters)
+    pareto_cut = metrics.pareto_products(engine, filters)
+    product_percent = pareto["product_percent"]
 
-if len(retention_data) > 0:
     c1, c2 = st.columns(2)
     with c1:
-        st.metric("ลูกค้ากลับมาซื้อซ้ำ", f"{len(retention_data):,} ราย")
+        st.metric("จำนวนสินค้า", f"{pareto['product_count']:,} รายการ")
+        st.markdown(f"คิดเป็น {product_percent:.2f}% จากทั้งหมด {pareto['total_products']:,} รายการ")
     with c2:
-        avg_months = retention_data['MonthsActive'].mean()
-        st.metric("ช่วงเวลาเฉลี่ยที่ลูกค้ากลับมาซื้อซ้ำ", f"{avg_months:.1f} เดือน")
-
-fig_dist = px.histogram(
-    retention_data,
-    x='MonthsActive',
-    title='การแจงแจกแสดงจำนวนเดือนที่ลูกค้ากลับมาซื้อซ้ำ',
-    labels={'MonthsActive': 'จำนวนเดือนที่ลูกค้ากลับมาซื้อซ้ำ'}
-)
-fig_dist.update_layout(height=450, yaxis_title='จำนวนลูกค้า')
-st.plotly_chart(fig_dist, use_container_width=True)
-
-# ---- AI Insight: KPI + Retention ----
-st.subheader("🤖 AI Insights: KPI, Cancellation และ Retention")
-mode_kpi_ai = st.radio(
-    "โหมดการแสดงผล (KPI & Retention)",
-    ["แสดงตัวเลขอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
-    horizontal=True,
-    key="mode_kpi_ai",
-)
-if mode_kpi_ai == "ให้ AI วิเคราะห์ส่วนนี้":
-    with st.spinner("AI กำลังวิเคราะห์ KPI และ Retention..."):
-        client = get_groq_client(groq_api_key)
-        prompt = build_kpi_retention_insight(
-            total_purchases,
-            total_customers,
-            total_quantity,
-            cancel_count,
-            cancel_sum,
-            cancel_aov,
-            cancel_ratio,
-            retention_data,
-        )
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            temperature=0.2,
-            messages=[
-                {"role": "system", "content": "คุณเป็นผู้เชี่ยวชาญด้าน Business Analytics และ CRM"},
-                {"role": "user", "content": prompt},
-            ],
-        )
-        insight = completion.choices[0].message.content
-    st.markdown(insight)
+        st.metric("ยอดขายรวม", f"£{pareto['pareto_sales']:,.2f}")
+        st.markdown(f"คิดเป็น {pareto['cumulative_percent']:.2f}% ของยอดขายทั้งหมด")
+
+    summary = metrics.category_summary(engine, pareto_cut)
+    summary.index = range(1, len(summary) + 1)
+
+    st.subheader("สรุปยอดขายตามหมวดสินค้า")
+    st.markdown(f"รายการสินค้า {product_percent:.2f}% สามารถจำแนกหมวดสินค้าได้ดังนี้ ")
+    st.dataframe(
+        summary.style.format({
+            "TotalSales": "{:.2f}",
+            "ProductCount": "{:,.0f}",
+            "SalesPercent": "{:.2f}",
+            "ProductPercent": "{:.2f}"
+        })
+    )
+
+    # หมวดสินค้าของสินค้าทุกรายการ (ไม่เฉพาะกลุ่ม 80%) เทียบกับตารางด้านบน
+    catalog_panel = st.expander("📦 หมวดสินค้าของสินค้าทั้งหมด", key="catalog_category_panel", on_change="rerun")
+    if catalog_panel.open:
+        with catalog_panel:
+            catalog_summary = metrics.category_summary(engine, metrics.stock_pareto(engine, filters))
+            catalog_summary.index = range(1, len(catalog_summary) + 1)
+            st.dataframe(
+                catalog_summary.style.format({
+                    "TotalSales": "{:.2f}",
+                    "ProductCount": "{:,.0f}",
+                    "SalesPercent": "{:.2f}",
+                    "ProductPercent": "{:.2f}"
+                })
+            )
+
+    insight_section(
+        groq_api_key,
+        "🤖 AI Insights: Pareto และ หมวดสินค้า",
+        "โหมดการแสดงผล (Pareto Analysis)",
+        ["แสดงตารางอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
+        "mode_pareto_ai",
+        generate_all_insights,
+        "คุณเป็นผู้เชี่ยวชาญด้าน Category Management และ Merchandising",
+        partial(build_pareto_insight, summary),
+        engine.version,
+        "AI กำลังวิเคราะห์ Pareto และหมวดสินค้า...",
+    )
 
-con.close()
 
-st.divider()
 
 # ====================================================
-# SECTION 5: Pareto Analysis
+# SECTION 6: Market Basket (สินค้าที่มักซื้อด้วยกัน)
 # ====================================================
-st.header("🔑 Pareto Analysis ")
-st.markdown("Pareto Analysis คือกลุ่มสินค้า 20% แรก ที่สร้างยอดขาย 80% จากยอดขายทั้งหมด")
-
-pareto_query = """
-WITH cleaned AS (
-    SELECT
-        StockCode,
-        Description,
-        SUM(Quantity) AS TotalQty,                      
-        SUM(Quantity * UnitPrice) AS TotalSales         
-    FROM df
-    WHERE InvoiceNo NOT LIKE 'C%'  
-    GROUP BY StockCode, Description
-)
-SELECT *
-FROM cleaned
-ORDER BY TotalSales DESC;
-"""
-stock_sales = duckdb.query(pareto_query).to_df()
-
-stock_sales['CumulativeSales'] = stock_sales['TotalSales'].cumsum()
-total_sales = stock_sales['TotalSales'].sum()
-stock_sales['CumulativePercent'] = 100 * stock_sales['CumulativeSales'] / total_sales
-
-pareto_cut = stock_sales[stock_sales['CumulativePercent'] <= 80]
-
-c1, c2 = st.columns(2)
-with c1:
-    product_count = len(pareto_cut)
-    total_products = len(stock_sales)
-    product_percent = (product_count * 100 / total_products)
-    st.metric("จำนวนสินค้า", f"{product_count:,} รายการ")
-    st.markdown(f"คิดเป็น {product_percent:.2f}% จากทั้งหมด {total_products:,} รายการ")
-with c2:
-    total_sales_80 = pareto_cut['TotalSales'].sum()
-    cumulative_percent = pareto_cut['CumulativePercent'].max()
-    st.metric("ยอดขายรวม", f"£{total_sales_80:,.2f}")
-    st.markdown(f"คิดเป็น {cumulative_percent:.2f}% ของยอดขายทั้งหมด")
-
-def categorize(description):
-    d = description.lower()
-    categories = {
-        "ของตกแต่งบ้าน": ["metal", "wood", "frame", "sign", "plaque", "heart", "garland", "wreath", "wall", "hanging", "cushion"],
-        "ของใช้ในครัว": ["mug", "cup", "plate", "bowl", "jar", "jug", "tin", "kitchen", "baking", "cake", "teapot", "cutlery"],
-        "แฟชั่น": ["mirror", "cosmetic", "purse", "wallet", "keyring", "scarf", "jewellery"],
-        "งานฝีมือ": ["craft", "felt", "notebook", "pencil", "pen", "stamp", "colouring", "paper", "card"],
-        "ของเล่น": ["toy", "doll", "jigsaw", "game", "puzzle", "child", "kids"],
-        "ของปาร์ตี้": ["party", "gift bag", "gift", "wrapping", "ribbon", "balloon", "birthday"],
-        "เซ็ตของขวัญ": ["lunch", "box set", "tin set", "food box", "snack box", "storage box"],
-        "ของตกแต่งเทศกาล": ["christmas", "easter", "halloween", "advent", "festive", "snow", "santa"],
-        "เครื่องหอม": ["candle", "incense", "aroma", "scent"],
-        "ของตกแต่งสวน": ["garden", "planter", "flower pot", "watering can"],
-        "อุปกรณ์ไฟฟ้า": ["lamp", "light", "lantern", "torch"]
-    }
-    for category, keywords in categories.items():
-        if any(keyword in d for keyword in keywords):
-            return category
-    return "อื่นๆ"
-
-pareto_cut["Category"] = pareto_cut["Description"].apply(categorize)
-duckdb.register("pareto_cut", pareto_cut)
-
-summary = duckdb.query("""
-    SELECT
-        Category,
-        SUM(TotalSales) AS TotalSales,
-        SUM(TotalQty) AS ProductCount
-    FROM pareto_cut
-    GROUP BY Category
-""").to_df()
-
-total_sales_pareto = summary["TotalSales"].sum()
-total_products_pareto = summary["ProductCount"].sum()
-
-summary["SalesPercent"] = 100 * summary["TotalSales"] / total_sales_pareto
-summary["ProductPercent"] = 100 * summary["ProductCount"] / total_products_pareto
-summary["is_other"] = (summary["Category"] == "อื่นๆ").astype(int)
-summary = summary.sort_values(
-    by=["is_other", "SalesPercent"],
-    ascending=[True, False]
-).drop(columns="is_other").reset_index(drop=True)
-
-summary.index = range(1, len(summary) + 1)
-
-st.subheader("สรุปยอดขายตามหมวดสินค้า")
-st.markdown(f"รายการสินค้า {product_percent:.2f}% สามารถจำแนกหมวดสินค้าได้ดังนี้ ")
-st.dataframe(
-    summary.style.format({
-        "TotalSales": "{:.2f}",
-        "ProductCount": "{:,.0f}",
-        "SalesPercent": "{:.2f}",
-        "ProductPercent": "{:.2f}"
-    })
-)
-
-# ---- AI Insight: Pareto ----
-st.subheader("🤖 AI Insights: Pareto และ หมวดสินค้า")
-mode_pareto_ai = st.radio(
-    "โหมดการแสดงผล (Pareto Analysis)",
-    ["แสดงตารางอย่างเดียว", "ให้ AI วิเคราะห์ส่วนนี้"],
-    horizontal=True,
-    key="mode_pareto_ai",
-)
-if mode_pareto_ai == "ให้ AI วิเคราะห์ส่วนนี้":
-    with st.spinner("AI กำลังวิเคราะห์ Pareto และหมวดสินค้า..."):
-        client = get_groq_client(groq_api_key)
-        prompt = build_pareto_insight(summary)
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            temperature=0.2,
-            messages=[
-                {"role": "system", "content": "คุณเป็นผู้เชี่ยวชาญด้าน Category Management และ Merchandising"},
-                {"role": "user", "content": prompt},
-            ],
+@traced_fragment("basket")
+def render_basket_section(engine, filters: Filters):
+    st.header("🛒 สินค้าที่มักซื้อด้วยกัน (Market Basket)")
+    st.markdown(
+        "สินค้าที่อยู่ในใบเสร็จเดียวกับสินค้าที่เลือกบ่อยที่สุด (คำนวณจากใบเสร็จขายตามตัวกรองที่เลือก) "
+        "— Confidence คือโอกาสที่ลูกค้าซื้อสินค้านี้ด้วย และ Lift > 1 แปลว่าซื้อด้วยกันบ่อยกว่าที่ควรเป็นโดยบังเอิญ"
+    )
+
+    if not engine.basket_index_ready:
+        st.info("ยังไม่ได้สร้าง index ของสินค้าที่ซื้อด้วยกัน (ตั้งค่า RETAIL_BASKET_INDEX=on เพื่อเปิดใช้)")
+        return
+
+    c1, c2 = st.columns([1, 2])
+    with c1:
+        country = st.selectbox(
+            "ประเทศ",
+            ["ทุกประเทศ", *metrics.country_value(engine, filters)["country"]],
+            key="basket_country",
         )
-        insight = completion.choices[0].message.content
-    st.markdown(insight)
+    # เลือกประเทศ = drill-down ภายในตัวกรองของหน้า (ช่วงเดือน / ภูมิภาค ยังมีผลเหมือนเดิม)
+    basket_filters = filters if country == "ทุกประเทศ" else replace(filters, countries=(country,))
+    products = metrics.basket_products(engine, basket_filters)
+    if products.empty:
+        st.info("ยังไม่มีสินค้าที่ซื้อด้วยกันบ่อยพอตามตัวกรองนี้")
+        return
+    labels = dict(zip(products["StockCode"], products["StockCode"] + " — " + products["Description"].fillna("")))
+    with c2:
+        stock_code = st.selectbox("สินค้า", list(labels), format_func=labels.get, key="basket_product")
+
+    together = metrics.frequently_bought_together(engine, stock_code, basket_filters)
+    together.index = range(1, len(together) + 1)
+    st.dataframe(
+        together.style.format({
+            "pair_invoices": "{:,.0f}",
+            "support": "{:.2%}",
+            "confidence": "{:.2%}",
+            "lift": "{:.2f}"
+        })
+    )
+
+# ----------------- Render -----------------
+st.caption(f"🔎 ตัวกรอง: {filters.describe()}")
+if metrics.kpi_summary(engine, filters)["total_purchases"] == 0:
+    st.warning("⚠️ ไม่มีข้อมูลตามตัวกรองที่เลือก")
+else:
+    render_country_section(engine, filters, generate_all_insights)
+    render_region_section(engine, filters, generate_all_insights)
+    render_aov_section(engine, filters, generate_all_insights)
+    render_kpi_section(engine, filters, generate_all_insights)
+    render_pareto_section(engine, filters, generate_all_insights)
+    render_basket_section(engine, filters)
+
+render_timing_panel(trace)
 
 # Footer
 st.divider()
@@ -1,10 +1,14 @@
+from functools import partial
+
 import streamlit as st
 import pandas as pd
-import duckdb
 import plotly.express as px
 import plotly.graph_objects as go
-from groq import Groq   # ใช้ Groq สำหรับ AI Insight
-from streamlit_gsheets import GSheetsConnection
+from analytics import metrics
+from analytics.engine import get_engine
+from analytics.instrumentation import start_trace
+from analytics.store import append_snapshot, refresh_snapshot
+from ui_components import insight_section, render_engine_panel, render_filters, render_timing_panel   # AI Insight (Groq) แบบ cache + background, แผงสถานะ engine
 
 # ---------------------------------------------------
 # Page config
@@ -12,6 +16,7 @@ from streamlit_gsheets import GSheetsConnection
 st.set_page_config(page_title="Customer Overview", page_icon="🌍", layout="wide")
 st.title("💻 E-commerce Analysis")
 st.title("🌍 ภาพรวมลูกค้า (Customer Overview)")
+trace = start_trace("customer_overview")
 
 # ---------------------------------------------------
 # API Key สำหรับ AI Insight
@@ -21,11 +26,6 @@ groq_api_key = "MY_API_KEY"
 # ---------------------------------------------------
 # AI Helper Functions
 # ---------------------------------------------------
-@st.cache_resource
-def get_groq_client(api_key: str):
-    return Groq(api_key=api_key)
-
-
 def build_country_value_insight_prompt(top10_df: pd.DataFrame, all_df: pd.DataFrame) -> str:
     """
     ใช้สร้าง prompt ให้ AI วิเคราะห์ Top 10 ประเทศตามมูลค่าคำสั่งซื้อรวม
@@ -94,32 +94,49 @@ def build_aov_insight_prompt(df_aov: pd.DataFrame) -> str:
 
 
 # ---------------------------------------------------
-# Load data
+# Load data (engine กลางที่โหลดตารางจาก snapshot ไว้แล้ว)
 # ---------------------------------------------------
-@st.cache_data(ttl=60)
-def load_data():
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    return conn.read()
+with st.sidebar:
+    if st.button("⏩ ดึงเฉพาะข้อมูลใหม่", key="append_snapshot"):
+        with st.spinner("กำลังดึงข้อมูลที่เพิ่มเข้ามาใหม่จาก Google Sheets..."):
+            append_snapshot()
+    if st.button("🔄 รีเฟรชข้อมูลทั้งหมดจากต้นทาง", key="refresh_snapshot"):
+        with st.spinner("กำลังดึงข้อมูลใหม่จาก Google Sheets..."):
+            refresh_snapshot()
 
 # ---------------------------------------------------
 # Main logic
 # ---------------------------------------------------
 try:
-    df = load_data()
+    engine = get_engine()
+    filters = render_filters(engine)
+    render_engine_panel(engine)
+
+    row_count = engine.scalar("SELECT COUNT(*) FROM transactions")
+    columns = engine.columns()
     st.success(
-        f"✅ โหลดข้อมูลสำเร็จ: {len(df):,} รายการ "
+        f"✅ โหลดข้อมูลสำเร็จ: {row_count:,} รายการ "
         "(ข้อมูลจาก: UCI Machine Learning Repository https://doi.org/10.24432/C5BW33)"
     )
-
-    # Preview
-    with st.expander("🔍 ดูข้อมูลตัวอย่าง"):
-        st.dataframe(df.head(10))
-        st.write(f"**Columns:** {', '.join(df.columns.tolist())}")
-
-    # DuckDB connection
-    con = duckdb.connect(':memory:')
-
-    con.register('df', df)
+    st.caption(f"🔎 ตัวกรอง: {filters.describe()}")
+
+    # Preview (expander ที่ตั้ง on_change="rerun" จะ query เฉพาะตอนที่ผู้ใช้เปิดดู)
+    preview = st.expander("🔍 ดูข้อมูลตัวอย่าง", key="preview_panel", on_change="rerun")
+    if preview.open:
+        with preview:
+            st.dataframe(engine.query("SELECT * FROM transactions LIMIT 10"))
+            st.write(f"**Columns:** {', '.join(columns)}")
+
+    # ผลของ cleaning stage: จำนวนแถวแต่ละประเภท และจำนวนแถวที่แต่ละกฎตัดออก (ตามตัวกรอง)
+    cleaning = st.expander("🧹 การคัดแยกข้อมูล", key="cleaning_panel", on_change="rerun")
+    if cleaning.open:
+        with cleaning:
+            st.dataframe(metrics.cleaning_report(engine, filters), hide_index=True)
+            st.caption(
+                "sale = รายการขาย | cancellation = ใบเสร็จที่ยกเลิก (InvoiceNo ขึ้นต้นด้วย C) | "
+                "adjustment = รายการที่ Quantity ≤ 0 แต่ไม่ใช่ใบเสร็จยกเลิก | "
+                "missing_* = แถวที่ไม่นับใน metric ของลูกค้า / ยอดเงิน / สินค้า"
+            )
 
     # Column names
     selected_country_col = 'Country'
@@ -129,46 +146,14 @@ try:
 
     # Required columns check
     required_columns = [selected_country_col, selected_quantity_col, selected_price_col]
-    missing_columns = [col for col in required_columns if col not in df.columns]
-
-    if not missing_columns:
-        # ---------- Date handling ----------
-        if selected_date_col in df.columns:
-            try:
-                con.execute(f"""
-                    CREATE OR REPLACE TABLE df_with_date AS
-                    SELECT *,
-                           TRY_CAST("{selected_date_col}" AS DATE) as parsed_date,
-                           EXTRACT(YEAR FROM TRY_CAST("{selected_date_col}" AS DATE)) as year,
-                           EXTRACT(MONTH FROM TRY_CAST("{selected_date_col}" AS DATE)) as month
-                    FROM df
-                """)
-                date_filter = ""
-                table_name = "df_with_date"
-            except Exception as e:
-                st.warning(f"⚠️ ไม่สามารถแปลงวันที่ได้: {str(e)}")
-                date_filter = ""
-                table_name = "df"
-        else:
-            date_filter = ""
-            table_name = "df"
-
-        # ---------- Aggregate by country ----------
-        query = f"""
-        SELECT 
-            "{selected_country_col}" as country,
-            SUM("{selected_quantity_col}" * "{selected_price_col}") as value_by_country,
-            COUNT(*) as transaction_count,
-            SUM("{selected_quantity_col}") as total_quantity
-        FROM {table_name}
-        WHERE "{selected_country_col}" IS NOT NULL
-          AND "{selected_quantity_col}" IS NOT NULL
-          AND "{selected_price_col}" IS NOT NULL
-          {date_filter}
-        GROUP BY "{selected_country_col}"
-        ORDER BY value_by_country DESC
-        """
-        country_data = con.execute(query).df()
+    missing_columns = [col for col in required_columns if col not in columns]
+
+    # ---------- Aggregate by country (อ่านจาก aggregate cube ตามตัวกรอง) ----------
+    country_data = metrics.country_value(engine, filters) if not missing_columns else None
+
+    if country_data is not None and country_data.empty:
+        st.warning("⚠️ ไม่มีข้อมูลตามตัวกรองที่เลือก")
+    elif not missing_columns:
 
         # Top 10 + others
         top_10 = country_data.head(10).copy()
@@ -299,64 +284,27 @@ try:
 
 
         # ---------- AI Insight: Top 10 Country Value ----------
-        st.subheader("🤖 AI Insights: Top 10 ประเทศตามมูลค่าคำสั่งซื้อรวม")
-
-        mode_country = st.radio(
+        insight_section(
+            groq_api_key,
+            "🤖 AI Insights: Top 10 ประเทศตามมูลค่าคำสั่งซื้อรวม",
             "โหมดการแสดงผล (มูลค่าคำสั่งซื้อตามประเทศ)",
             ["แสดงข้อมูลอย่างเดียว", "ให้ AI วิเคราะห์ข้อมูลนี้"],
-            horizontal=True,
-            key="mode_country_insight",
+            "mode_country_insight",
+            False,
+            "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ข้อมูลลูกค้าและธุรกิจอีคอมเมิร์ซ",
+            partial(build_country_value_insight_prompt, top_10, country_data),
+            engine.version,
+            "AI กำลังวิเคราะห์ Top 10 ประเทศตามมูลค่าคำสั่งซื้อรวม...",
         )
 
-        if mode_country == "ให้ AI วิเคราะห์ข้อมูลนี้":
-            with st.spinner("AI กำลังวิเคราะห์ Top 10 ประเทศตามมูลค่าคำสั่งซื้อรวม..."):
-                client = get_groq_client(groq_api_key)
-                prompt_country = build_country_value_insight_prompt(top_10, country_data)
-                completion_country = client.chat.completions.create(
-                    model="llama-3.3-70b-versatile",
-                    temperature=0.2,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ข้อมูลลูกค้าและธุรกิจอีคอมเมิร์ซ",
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt_country,
-                        },
-                    ],
-                )
-                insight_country = completion_country.choices[0].message.content
-
-            st.markdown(insight_country)
-
         # ---------------------------------------------------
         # AOV BY COUNTRY (Top 15)
         # ---------------------------------------------------
         st.divider()
         st.subheader("📊 มูลค่าคำสั่งซื้อโดยเฉลี่ยแบ่งตามประเทศ (Average Order Value: AOV)")
 
-        aov_query = """
-        WITH cleaned AS (
-            SELECT
-                InvoiceNo,
-                Country,
-                SUM(Quantity * UnitPrice) AS InvoiceSales
-            FROM df
-            WHERE InvoiceNo NOT LIKE 'C%'  
-            GROUP BY InvoiceNo, Country
-        )
-        SELECT
-            Country,
-            AVG(InvoiceSales) AS AOV
-        FROM cleaned
-        GROUP BY Country
-        ORDER BY AOV DESC;
-        """
-
-        aov_all = con.execute(aov_query).df()
-        top15_countries = aov_all.sort_values(by="AOV", ascending=False).head(15).copy()
-        top15_countries["AOV"] = top15_countries["AOV"].round(2)
+        aov_all = metrics.aov_by_country(engine, filters)
+        top15_countries = aov_all.head(15)
         
         fig_bar_aov = px.bar(
             top15_countries,
@@ -373,40 +321,22 @@ try:
         st.plotly_chart(fig_bar_aov, use_container_width=True)
 
         # ---------- AI Insight: AOV ----------
-        st.subheader("🤖 AI Insights: AOV แบ่งตามประเทศ")
-
-        mode_aov = st.radio(
+        insight_section(
+            groq_api_key,
+            "🤖 AI Insights: AOV แบ่งตามประเทศ",
             "โหมดการแสดงผล (AOV ต่อประเทศ)",
             ["แสดงกราฟอย่างเดียว", "ให้ AI วิเคราะห์กราฟนี้"],
-            horizontal=True,
-            key="mode_aov_insight",
+            "mode_aov_insight",
+            False,
+            "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ข้อมูลลูกค้าและธุรกิจอีคอมเมิร์ซ",
+            partial(build_aov_insight_prompt, top15_countries),
+            engine.version,
+            "AI กำลังวิเคราะห์ข้อมูล AOV ตามประเทศ...",
         )
 
-        if mode_aov == "ให้ AI วิเคราะห์กราฟนี้":
-            with st.spinner("AI กำลังวิเคราะห์ข้อมูล AOV ตามประเทศ..."):
-                client = get_groq_client(groq_api_key)
-                prompt_aov = build_aov_insight_prompt(top15_countries)
-                completion_aov = client.chat.completions.create(
-                    model="llama-3.3-70b-versatile",
-                    temperature=0.2,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "คุณเป็นผู้เชี่ยวชาญด้านการวิเคราะห์ข้อมูลลูกค้าและธุรกิจอีคอมเมิร์ซ",
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt_aov,
-                        },
-                    ],
-                )
-                insight_aov = completion_aov.choices[0].message.content
-
-            st.markdown(insight_aov)
-
     else:
         st.error("❌ ไม่พบ column ที่จำเป็นในข้อมูล")
-        st.write("**Columns ที่มี:**", df.columns.tolist())
+        st.write("**Columns ที่มี:**", columns)
         st.write("**Columns ที่ขาด:**", missing_columns)
         st.info("💡 กรุณาตรวจสอบว่าข้อมูลมี column: Country, Quantity, และ UnitPrice")
 
@@ -415,6 +345,8 @@ except Exception as e:
     import traceback
     st.code(traceback.format_exc())
 
+render_timing_panel(trace)
+
 # ---------------------------------------------------
 # Footer
 # ---------------------------------------------------
@@ -0,0 +1,3 @@
+from .store import append_snapshot, refresh_snapshot, snapshot_version
+
+__all__ = ["append_snapshot", "refresh_snapshot", "snapshot_version"]
@@ -0,0 +1,106 @@
+import os
+
+from .cube import BASKET_AGGREGATES, BASKET_ITEMS_TABLE, BASKET_PAIRS_TABLE, CUBE_TABLE, build_tables, merge_tables
+
+# ---------------------------------------------------
+# Market Basket: index ของสินค้าที่มักซื้อด้วยกัน
+# ---------------------------------------------------
+# basket_items / basket_pairs (analytics.cube) คือจำนวนใบเสร็จต่อสินค้า และต่อคู่สินค้า
+# ต่อ Country x YearMonth รวมข้ามเซลล์ได้ตรง ๆ (ดูหมายเหตุใน analytics.cube)
+#
+# ตาราง product_associations เก็บกฎ antecedent -> consequent ที่ดีที่สุด TOP_ASSOCIATIONS อันดับต่อสินค้า
+# ของทุกประเทศรวมกัน (Country = NULL) และของแต่ละประเทศ
+#   support    = ใบเสร็จที่มีทั้งคู่ / ใบเสร็จขายทั้งหมด
+#   confidence = ใบเสร็จที่มีทั้งคู่ / ใบเสร็จที่มี antecedent
+#   lift       = confidence / (ใบเสร็จที่มี consequent / ใบเสร็จขายทั้งหมด)
+# ตัดคู่ที่พบด้วยกันน้อยกว่า MIN_PAIR_INVOICES ใบเสร็จ (บังเอิญ ไม่ใช่รูปแบบการซื้อ)
+# สร้างใหม่จาก basket_* ทุกครั้งที่ engine โหลด/append (ไม่ scan transactions)
+#
+# คู่สินค้ามีจำนวนราว (สินค้าต่อใบเสร็จ)^2 / 2 ต่อใบเสร็จ จึงเป็นงานที่หนักที่สุดตอนโหลด
+# engine สร้าง index นี้ตามการตั้งค่า RETAIL_BASKET_INDEX (analytics.engine)
+
+ASSOCIATIONS_TABLE = "product_associations"
+TOP_ASSOCIATIONS = 10
+MIN_PAIR_INVOICES = int(os.environ.get("RETAIL_BASKET_MIN_PAIR", "3"))
+
+
+def update_basket_index(cur, delta: str | None = None) -> None:
+    """
+    สร้าง basket_items / basket_pairs ใหม่ทั้งหมด (delta=None) หรือ merge ด้วยตาราง delta
+    แล้วสร้าง product_associations ใหม่
+    """
+    if delta is None:
+        build_tables(cur, BASKET_AGGREGATES)
+    else:
+        merge_tables(cur, BASKET_AGGREGATES, delta)
+    build_associations(cur)
+
+
+def drop_basket_index(cur) -> None:
+    for table in [*BASKET_AGGREGATES, ASSOCIATIONS_TABLE]:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def build_associations(cur) -> None:
+    """
+    สร้างตาราง product_associations ใหม่จาก basket_items / basket_pairs
+    """
+    # คู่ที่ผ่านเกณฑ์ของแต่ละประเทศ และของทุกประเทศรวมกัน (Country = '') ตัดด้วย HAVING ก่อน join
+    cur.execute(f"""
+        CREATE OR REPLACE TABLE {ASSOCIATIONS_TABLE} AS
+        WITH baskets AS (
+            SELECT Country, SUM(sales_invoices) AS baskets
+            FROM {CUBE_TABLE}
+            WHERE Country IS NOT NULL
+            GROUP BY Country
+            UNION ALL
+            SELECT '', SUM(sales_invoices) FROM {CUBE_TABLE}
+        ),
+        items AS (
+            SELECT Country, StockCode, SUM(invoices) AS invoices
+            FROM {BASKET_ITEMS_TABLE}
+            WHERE Country IS NOT NULL
+            GROUP BY Country, StockCode
+            UNION ALL
+            SELECT '', StockCode, SUM(invoices) FROM {BASKET_ITEMS_TABLE} GROUP BY StockCode
+        ),
+        pairs AS (
+            SELECT Country, item_a, item_b, SUM(invoices) AS invoices
+            FROM {BASKET_PAIRS_TABLE}
+            WHERE Country IS NOT NULL
+            GROUP BY Country, item_a, item_b
+            HAVING SUM(invoices) >= {MIN_PAIR_INVOICES}
+            UNION ALL
+            SELECT '', item_a, item_b, SUM(invoices)
+            FROM {BASKET_PAIRS_TABLE}
+            GROUP BY item_a, item_b
+            HAVING SUM(invoices) >= {MIN_PAIR_INVOICES}
+        ),
+        rules AS (
+            SELECT Country, item_a AS antecedent, item_b AS consequent, invoices FROM pairs
+            UNION ALL
+            SELECT Country, item_b, item_a, invoices FROM pairs
+        ),
+        scored AS (
+            SELECT
+                NULLIF(r.Country, '') AS Country,
+                r.antecedent,
+                r.consequent,
+                r.invoices::BIGINT AS pair_invoices,
+                r.invoices / b.baskets AS support,
+                r.invoices / a.invoices AS confidence,
+                (r.invoices / a.invoices) / (c.invoices / b.baskets) AS lift
+            FROM rules r
+            JOIN baskets b ON b.Country = r.Country
+            JOIN items a ON a.Country = r.Country AND a.StockCode = r.antecedent
+            JOIN items c ON c.Country = r.Country AND c.StockCode = r.consequent
+        )
+        SELECT
+            *,
+            ROW_NUMBER() OVER (
+                PARTITION BY Country, antecedent ORDER BY confidence DESC, lift DESC, consequent
+            ) AS rank
+        FROM scored
+        QUALIFY rank <= {TOP_ASSOCIATIONS}
+        ORDER BY Country, antecedent, rank
+    """)
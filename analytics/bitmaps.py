@@ -0,0 +1,29 @@
+# ---------------------------------------------------
+# Bitmap ของ CustomerID (แบบ chunk คล้าย Roaring bitmap) ใน DuckDB
+# ---------------------------------------------------
+# CustomerID ถูกแบ่งเป็น chunk ละ BITMAP_CHUNK_BITS ค่า (chunk = CustomerID >> BITMAP_CHUNK_SHIFT)
+# แต่ละ chunk เก็บเป็น BIT ความยาวคงที่ (bitstring_agg ของบิตล่าง) และเก็บเฉพาะ chunk ที่มีลูกค้า
+# - union (merge หลายเซลล์ / append ข้อมูลใหม่) = bit_or ต่อ chunk
+# - intersection / difference = & / & ~ ต่อ chunk แล้วนับด้วย bit_count
+# bitmap ทุกตัวยาวเท่ากัน จึงต่อกันได้เสมอ และเพิ่ม CustomerID ใหม่ได้โดยไม่ต้องสร้างใหม่
+
+BITMAP_CHUNK_SHIFT = 12
+BITMAP_CHUNK_BITS = 2 ** BITMAP_CHUNK_SHIFT
+
+
+def chunk_sql(column: str) -> str:
+    """
+    chunk ของค่าใน column (บิตบน)
+    """
+    return f"({column} >> {BITMAP_CHUNK_SHIFT})::INTEGER"
+
+
+def bitmap_agg_sql(column: str) -> str:
+    """
+    aggregate ค่าใน column (ภายใน chunk เดียวกัน) เป็น bitmap ยาว BITMAP_CHUNK_BITS บิต
+    """
+    return f"bitstring_agg(({column} & {BITMAP_CHUNK_BITS - 1})::INTEGER, 0, {BITMAP_CHUNK_BITS - 1})"
+
+
+def empty_bitmap_sql() -> str:
+    return f"bitstring('0', {BITMAP_CHUNK_BITS})"
@@ -0,0 +1,78 @@
+import re
+
+import pandas as pd
+
+# ---------------------------------------------------
+# หมวดสินค้าจากคำใน Description (ใช้ใน Pareto Analysis)
+# ---------------------------------------------------
+# หมวดเรียงตามลำดับความสำคัญ: Description ที่มีคำของหลายหมวดจะได้หมวดที่อยู่ก่อน
+# คำทั้งหมดถูก compile เป็น regex เดียว (lookahead จึงเจอคำที่ซ้อนกันได้ทุกตำแหน่ง)
+# แล้วเลือกหมวดลำดับแรกสุดที่เจอ -- ผลตรงกับการไล่เช็กทีละหมวดทีละคำ
+#
+# engine เก็บผลไว้ในตาราง dim_product (StockCode, Description, Category)
+# จัดหมวดครั้งเดียวต่อสินค้า (เฉพาะสินค้าใหม่ตอน append) และ join ใน SQL ได้
+
+DIM_PRODUCT_TABLE = "dim_product"
+OTHER_CATEGORY = "อื่นๆ"
+
+CATEGORIES = {
+    "ของตกแต่งบ้าน": ["metal", "wood", "frame", "sign", "plaque", "heart", "garland", "wreath", "wall", "hanging", "cushion"],
+    "ของใช้ในครัว": ["mug", "cup", "plate", "bowl", "jar", "jug", "tin", "kitchen", "baking", "cake", "teapot", "cutlery"],
+    "แฟชั่น": ["mirror", "cosmetic", "purse", "wallet", "keyring", "scarf", "jewellery"],
+    "งานฝีมือ": ["craft", "felt", "notebook", "pencil", "pen", "stamp", "colouring", "paper", "card"],
+    "ของเล่น": ["toy", "doll", "jigsaw", "game", "puzzle", "child", "kids"],
+    "ของปาร์ตี้": ["party", "gift bag", "gift", "wrapping", "ribbon", "balloon", "birthday"],
+    "เซ็ตของขวัญ": ["lunch", "box set", "tin set", "food box", "snack box", "storage box"],
+    "ของตกแต่งเทศกาล": ["christmas", "easter", "halloween", "advent", "festive", "snow", "santa"],
+    "เครื่องหอม": ["candle", "incense", "aroma", "scent"],
+    "ของตกแต่งสวน": ["garden", "planter", "flower pot", "watering can"],
+    "อุปกรณ์ไฟฟ้า": ["lamp", "light", "lantern", "torch"],
+}
+
+_CATEGORY_NAMES = list(CATEGORIES)
+# keyword -> ลำดับของหมวด (ถ้าคำซ้ำกันหลายหมวด ใช้หมวดแรก)
+_PRIORITY = {}
+for _index, _keywords in enumerate(CATEGORIES.values()):
+    for _keyword in _keywords:
+        _PRIORITY.setdefault(_keyword, _index)
+# ที่ตำแหน่งเดียวกัน alternation เลือกคำที่อยู่ก่อน จึงเรียงคำตามลำดับหมวด
+_PATTERN = re.compile("(?=(" + "|".join(re.escape(k) for k in _PRIORITY) + "))")
+
+
+def categorize_many(descriptions: pd.Series) -> pd.Series:
+    """
+    จัดหมวดทั้ง Series ในรอบเดียว (ค่าว่างได้ "อื่นๆ") index ตรงกับ descriptions
+    """
+    positions = pd.RangeIndex(len(descriptions))
+    matches = descriptions.astype("string").str.lower().str.findall(_PATTERN).set_axis(positions)
+    priority = matches.explode().map(_PRIORITY).groupby(level=0).min().reindex(positions)
+    names = pd.Series([*_CATEGORY_NAMES, OTHER_CATEGORY], dtype="string")
+    category = names.iloc[priority.fillna(len(_CATEGORY_NAMES)).astype(int)]
+    return category.set_axis(descriptions.index)
+
+
+def update_product_dimension(cur, source: str, full_load: bool) -> None:
+    """
+    เพิ่มหมวดของสินค้า (StockCode, Description) ใน source ที่ยังไม่มีใน dim_product
+    full_load=True จะล้างตารางแล้วจัดหมวดใหม่ทั้งหมด
+    """
+    if full_load:
+        cur.execute(f"DROP TABLE IF EXISTS {DIM_PRODUCT_TABLE}")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DIM_PRODUCT_TABLE} (StockCode VARCHAR, Description VARCHAR, Category VARCHAR)
+    """)
+    products = cur.execute(f"""
+        SELECT DISTINCT StockCode, Description
+        FROM {source} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {DIM_PRODUCT_TABLE} p
+            WHERE p.StockCode IS NOT DISTINCT FROM s.StockCode
+              AND p.Description IS NOT DISTINCT FROM s.Description
+        )
+    """).df()
+    if products.empty:
+        return
+    products["Category"] = categorize_many(products["Description"])
+    cur.register("new_products_df", products)
+    cur.execute(f"INSERT INTO {DIM_PRODUCT_TABLE} SELECT StockCode, Description, Category FROM new_products_df")
+    cur.unregister("new_products_df")
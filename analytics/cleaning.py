@@ -0,0 +1,88 @@
+# ---------------------------------------------------
+# Cleaning stage: จัดประเภทแถวครั้งเดียวตอนโหลดเข้า engine
+# ---------------------------------------------------
+# ทุกแถวได้ RowStatus (ENUM row_status) ตั้งแต่ตอนอ่าน snapshot
+#   - sale         : รายการขาย (InvoiceNo ไม่ขึ้นต้นด้วย C และ Quantity > 0)
+#   - cancellation : ใบเสร็จที่ยกเลิก (InvoiceNo ขึ้นต้นด้วย C)
+#   - adjustment   : รายการปรับสต็อก / ของเสีย (Quantity <= 0 หรือไม่มี Quantity โดยไม่ใช่ใบเสร็จยกเลิก)
+# แล้วแยกเก็บเป็นตาราง sales / cancellations / adjustments (โหมด memory)
+# transactions เป็น VIEW ที่ต่อทั้งสามตารางเข้าด้วยกัน
+#
+# query ที่กรองด้วย status_sql(...) (ค่าคงที่ชนิด row_status) จะให้ DuckDB ตัดตารางที่ไม่เกี่ยวออก
+# จาก statistics ได้ทั้งตาราง -- ไม่ต้อง LIKE 'C%' ซ้ำทุกแถวในทุก aggregate
+# (ถ้าเทียบกับ string ธรรมดา DuckDB จะ cast RowStatus เป็น VARCHAR ทีละแถวและตัดตารางไม่ได้)
+#
+# จำนวนแถวที่แต่ละกฎตัดออกจาก metric เก็บในตาราง cleaning_stats (analytics.cube)
+
+ROW_STATUS_TYPE = "row_status"
+SALE = "sale"
+CANCELLATION = "cancellation"
+ADJUSTMENT = "adjustment"
+
+# status -> ตารางที่เก็บแถวของ status นั้น
+STATUS_TABLES = {
+    SALE: "sales",
+    CANCELLATION: "cancellations",
+    ADJUSTMENT: "adjustments",
+}
+
+ROW_STATUS_SQL = f"""(
+    CASE
+        WHEN InvoiceNo LIKE 'C%' THEN '{CANCELLATION}'
+        WHEN Quantity > 0 THEN '{SALE}'
+        ELSE '{ADJUSTMENT}'
+    END
+)::{ROW_STATUS_TYPE}"""
+
+# กฎที่ทำให้แถวถูกตัดออกจาก metric บางตัว (นับแยกตาม RowStatus): ชื่อคอลัมน์ใน cleaning_stats -> predicate
+CLEANING_RULES = {
+    "missing_customer": "CustomerID IS NULL",                       # ไม่นับใน metric ของลูกค้า
+    "missing_price": "Quantity IS NULL OR UnitPrice IS NULL",       # ไม่นับในยอดเงิน / จำนวนรายการ
+    "missing_stockcode": "StockCode IS NULL",                       # ไม่นับใน Pareto / Market Basket
+}
+
+
+def status_sql(*statuses: str, column: str = "RowStatus") -> str:
+    """
+    predicate ว่า column เป็นหนึ่งใน statuses (เทียบกับค่าชนิด row_status ไม่ใช่ string)
+    """
+    values = ", ".join(f"'{status}'::{ROW_STATUS_TYPE}" for status in statuses)
+    return f"{column} IN ({values})" if len(statuses) > 1 else f"{column} = {values}"
+
+
+def create_row_status_type(cur) -> None:
+    values = ", ".join(f"'{status}'" for status in STATUS_TABLES)
+    cur.execute(f"CREATE TYPE IF NOT EXISTS {ROW_STATUS_TYPE} AS ENUM ({values})")
+
+
+def create_status_tables(cur, source: str) -> None:
+    """
+    แยกแถวใน source (ที่มี RowStatus แล้ว) ลงตาราง sales / cancellations / adjustments
+    แล้วสร้าง VIEW transactions ที่ต่อทั้งสามตาราง
+    """
+    for status, table in STATUS_TABLES.items():
+        cur.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {source} WHERE {status_sql(status)}")
+    union = " UNION ALL BY NAME ".join(f"SELECT * FROM {table}" for table in STATUS_TABLES.values())
+    cur.execute(f"CREATE OR REPLACE VIEW transactions AS {union}")
+
+
+def insert_status_rows(cur, source: str) -> None:
+    """
+    เพิ่มแถวใน source (delta) ลงตารางตาม status
+    """
+    for status, table in STATUS_TABLES.items():
+        cur.execute(f"INSERT INTO {table} BY NAME SELECT * FROM {source} WHERE {status_sql(status)}")
+
+
+def create_status_views(cur) -> None:
+    """
+    โหมด out_of_core: sales / cancellations / adjustments เป็น VIEW ที่กรอง transactions (Parquet)
+    """
+    for status, table in STATUS_TABLES.items():
+        cur.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM transactions WHERE {status_sql(status)}")
+
+
+def drop_status_tables(cur, views: bool) -> None:
+    cur.execute("DROP VIEW IF EXISTS transactions")
+    for table in STATUS_TABLES.values():
+        cur.execute(f"DROP {'VIEW' if views else 'TABLE'} IF EXISTS {table}")
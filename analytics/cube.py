@@ -0,0 +1,317 @@
+from .bitmaps import bitmap_agg_sql, chunk_sql
+from .cleaning import ADJUSTMENT, CANCELLATION, CLEANING_RULES, SALE, status_sql
+from .sketches import rank_sql, register_sql
+
+# ---------------------------------------------------
+# Aggregate tables ที่ดูแลไว้ใน engine
+# ---------------------------------------------------
+# - agg_country_month : Country x YearMonth x Region (กราฟประเทศ/ภูมิภาค/เดือน และ KPI)
+# - invoice_totals    : ยอดขายต่อใบเสร็จ (AOV)
+# - stock_totals      : ยอดขายต่อ StockCode x Country x YearMonth (Pareto)
+# - customer_months   : ลูกค้า x เดือน (Period = YYYYMM): ใบเสร็จ ยอดขาย และใบเสร็จที่ยกเลิก
+# - customer_features : feature ต่อลูกค้า (เดือนแรก/ล่าสุด จำนวนเดือนที่ซื้อ ใบเสร็จ ยอดขาย การยกเลิก)
+#                       สรุปจาก customer_months ใช้กับ Retention / ลูกค้าซื้อซ้ำ เมื่อไม่มีตัวกรอง
+# - customer_sketches : HyperLogLog sketch ของ CustomerID ต่อ Country x YearMonth (นับลูกค้าแบบประมาณ)
+# - customer_bitmaps  : bitmap ของ CustomerID ที่มีรายการขาย ต่อ Country x YearMonth (Cohort Retention)
+# - basket_items      : จำนวนใบเสร็จขายที่มีสินค้าแต่ละตัว ต่อ Country x YearMonth (Market Basket)
+# - basket_pairs      : จำนวนใบเสร็จขายที่มีสินค้าคู่ (item_a < item_b) อยู่ด้วยกัน ต่อ Country x YearMonth
+# - cleaning_stats    : จำนวนแถวต่อ RowStatus และจำนวนแถวที่แต่ละกฎใน CLEANING_RULES ตัดออก
+#
+# รายการขาย / ยกเลิก กรองด้วย RowStatus ที่จัดไว้ตอนโหลด (analytics.cleaning) ไม่ใช่ LIKE 'C%' ซ้ำทุกตาราง
+#
+# ทุกตารางมี YearMonth / Country / Region เป็น key เพื่อให้ตัวกรองของ dashboard
+# (analytics.filters) กรองบน aggregate ได้เลยโดยไม่ต้องกลับไป scan transactions
+#
+# ทุกตารางสร้างครั้งเดียวตอนโหลด snapshot และเมื่อมีการ append ข้อมูลใหม่
+# จะอัปเดตเฉพาะส่วนที่ delta แตะ (ไม่ scan transactions ทั้งหมดซ้ำ)
+#   - invoice_totals / stock_totals / cleaning_stats : measure เป็นผลรวม จึงบวก aggregate ของ delta เข้าไปได้เลย
+#   - customer_sketches : merge ด้วย MAX ของ rank ต่อ register
+#   - customer_bitmaps : merge ด้วย bit_or ต่อ chunk
+#   - agg_country_month / customer_months / basket_* : มี COUNT(DISTINCT ...) จึงคำนวณใหม่เฉพาะเซลล์
+#     (Country x YearMonth / CustomerID x YearMonth) ที่ delta แตะ
+#   - customer_features : คำนวณใหม่เฉพาะลูกค้าที่อยู่ใน delta
+#
+# หมายเหตุ: 1 InvoiceNo อยู่ในประเทศเดียวและเดือนเดียว จึงรวมจำนวนใบเสร็จต่อเซลล์
+# (sales_invoices, basket_items / basket_pairs) ข้ามเดือน/ประเทศได้ตรง ๆ
+# ส่วนลูกค้านับซ้ำข้ามเซลล์ได้ จึงเก็บเป็น list ของ CustomerID
+# (merge ด้วย list_distinct ตอน query, ค่าตรง) และ HyperLogLog sketch (ค่าประมาณ, merge ได้ถูกกว่า)
+
+CUBE_TABLE = "agg_country_month"
+INVOICE_TOTALS_TABLE = "invoice_totals"
+STOCK_TOTALS_TABLE = "stock_totals"
+CUSTOMER_MONTHS_TABLE = "customer_months"
+CUSTOMER_SKETCH_TABLE = "customer_sketches"
+CUSTOMER_FEATURES_TABLE = "customer_features"
+CUSTOMER_BITMAP_TABLE = "customer_bitmaps"
+CLEANING_STATS_TABLE = "cleaning_stats"
+BASKET_ITEMS_TABLE = "basket_items"
+BASKET_PAIRS_TABLE = "basket_pairs"
+
+# เดือนแบบจำนวนเต็ม YYYYMM (เช่น 201012) -- แยกปีได้ ต่างจาก Month ที่มีแค่ 1-12
+PERIOD_SQL = "(YEAR(InvoiceDate) * 100 + MONTH(InvoiceDate))::INTEGER"
+
+# ตะกร้าสินค้า: (ใบเสร็จขาย, StockCode) ที่ไม่ซ้ำ
+BASKET_LINES_SQL = f"""(
+    SELECT DISTINCT InvoiceNo, Country, Region, YearMonth, StockCode
+    FROM {{source}}
+    WHERE {status_sql(SALE)} AND StockCode IS NOT NULL
+)"""
+
+
+def _sum(col: str) -> str:
+    return f"COALESCE(a.{col}, 0) + COALESCE(d.{col}, 0)"
+
+
+# table -> (key columns, SELECT ที่ใช้สร้างจาก {source}, วิธี merge ของแต่ละ measure)
+# ถ้าวิธี merge เป็น None จะคำนวณใหม่เฉพาะเซลล์ตาม RECOMPUTE_KEYS
+AGGREGATES = {
+    CUBE_TABLE: (
+        ["Country", "Region", "YearMonth", "Year", "Month", "MonthName"],
+        f"""
+        SELECT
+            Country,
+            Region,
+            YearMonth,
+            YEAR(InvoiceDate) AS Year,
+            Month,
+            MonthName,
+            -- ทุกแถว (ใช้ในหน้า Overview)
+            COUNT(*) FILTER (WHERE Quantity IS NOT NULL AND UnitPrice IS NOT NULL) AS line_count,
+            SUM(Quantity) FILTER (WHERE UnitPrice IS NOT NULL) AS quantity,
+            SUM(Quantity * UnitPrice) AS revenue,
+            -- เฉพาะรายการขาย (ใช้ในหน้า Analysis)
+            COUNT(DISTINCT InvoiceNo) FILTER (WHERE {status_sql(SALE)}) AS sales_invoices,
+            COALESCE(SUM(Quantity) FILTER (WHERE {status_sql(SALE)}), 0) AS sales_quantity,
+            -- ใบเสร็จที่ยกเลิก (InvoiceNo ขึ้นต้นด้วย C) และมูลค่าที่ยกเลิก (ค่าบวก)
+            COUNT(DISTINCT InvoiceNo) FILTER (WHERE {status_sql(CANCELLATION)}) AS cancel_invoices,
+            COALESCE(SUM(-1 * (Quantity * UnitPrice)) FILTER (WHERE {status_sql(CANCELLATION)}), 0) AS cancel_value,
+            -- customer sketch
+            LIST(DISTINCT CustomerID) FILTER (WHERE CustomerID IS NOT NULL) AS customers
+        FROM {{source}}
+        GROUP BY Country, Region, YearMonth, YEAR(InvoiceDate), Month, MonthName
+        """,
+        None,
+    ),
+    INVOICE_TOTALS_TABLE: (
+        ["InvoiceNo", "Country", "Region", "YearMonth"],
+        f"""
+        SELECT
+            InvoiceNo,
+            Country,
+            Region,
+            YearMonth,
+            SUM(Quantity * UnitPrice) AS InvoiceSales
+        FROM {{source}}
+        WHERE {status_sql(SALE, ADJUSTMENT)}
+        GROUP BY InvoiceNo, Country, Region, YearMonth
+        """,
+        {"InvoiceSales": _sum("InvoiceSales")},
+    ),
+    STOCK_TOTALS_TABLE: (
+        ["StockCode", "Description", "Country", "Region", "YearMonth"],
+        f"""
+        SELECT
+            StockCode,
+            Description,
+            Country,
+            Region,
+            YearMonth,
+            SUM(Quantity) AS TotalQty,
+            SUM(Quantity * UnitPrice) AS TotalSales
+        FROM {{source}}
+        WHERE {status_sql(SALE, ADJUSTMENT)}
+        GROUP BY StockCode, Description, Country, Region, YearMonth
+        """,
+        {"TotalQty": _sum("TotalQty"), "TotalSales": _sum("TotalSales")},
+    ),
+    CUSTOMER_MONTHS_TABLE: (
+        ["CustomerID", "Country", "Region", "YearMonth", "Period"],
+        f"""
+        SELECT
+            CustomerID,
+            Country,
+            Region,
+            YearMonth,
+            {PERIOD_SQL} AS Period,
+            COUNT(*) FILTER (WHERE {status_sql(SALE)}) AS sales_lines,
+            COUNT(DISTINCT InvoiceNo) FILTER (WHERE {status_sql(SALE)}) AS sales_invoices,
+            COALESCE(SUM(Quantity * UnitPrice) FILTER (WHERE {status_sql(SALE)}), 0) AS revenue,
+            COUNT(DISTINCT InvoiceNo) FILTER (WHERE {status_sql(CANCELLATION)}) AS cancel_invoices
+        FROM {{source}}
+        WHERE CustomerID IS NOT NULL
+        GROUP BY CustomerID, Country, Region, YearMonth, Period
+        """,
+        None,
+    ),
+    CUSTOMER_SKETCH_TABLE: (
+        ["Country", "Region", "YearMonth", "Month", "register"],
+        f"""
+        SELECT
+            Country,
+            Region,
+            YearMonth,
+            Month,
+            {register_sql("CustomerID")} AS register,
+            MAX({rank_sql("CustomerID")}) AS rank
+        FROM {{source}}
+        WHERE CustomerID IS NOT NULL
+        GROUP BY Country, Region, YearMonth, Month, register
+        """,
+        {"rank": "GREATEST(COALESCE(a.rank, 0), COALESCE(d.rank, 0))"},
+    ),
+    CUSTOMER_BITMAP_TABLE: (
+        ["Country", "Region", "YearMonth", "Period", "chunk"],
+        f"""
+        SELECT
+            Country,
+            Region,
+            YearMonth,
+            {PERIOD_SQL} AS Period,
+            {chunk_sql("CustomerID")} AS chunk,
+            {bitmap_agg_sql("CustomerID")} AS bitmap
+        FROM {{source}}
+        WHERE {status_sql(SALE)} AND CustomerID IS NOT NULL
+        GROUP BY Country, Region, YearMonth, Period, chunk
+        """,
+        {"bitmap": "COALESCE(a.bitmap, d.bitmap) | COALESCE(d.bitmap, a.bitmap)"},
+    ),
+    CLEANING_STATS_TABLE: (
+        ["Country", "Region", "YearMonth", "RowStatus"],
+        f"""
+        SELECT
+            Country,
+            Region,
+            YearMonth,
+            RowStatus,
+            COUNT(*) AS row_count,
+            {", ".join(f"COUNT(*) FILTER (WHERE {predicate}) AS {rule}" for rule, predicate in CLEANING_RULES.items())}
+        FROM {{source}}
+        GROUP BY Country, Region, YearMonth, RowStatus
+        """,
+        {column: _sum(column) for column in ["row_count", *CLEANING_RULES]},
+    ),
+}
+
+# ตาราง Market Basket (analytics.baskets) แยกไว้ต่างหาก engine สร้างเมื่อเปิด basket index เท่านั้น
+BASKET_AGGREGATES = {
+    BASKET_ITEMS_TABLE: (
+        ["Country", "Region", "YearMonth", "StockCode"],
+        f"""
+        SELECT Country, Region, YearMonth, StockCode, COUNT(*) AS invoices
+        FROM {BASKET_LINES_SQL}
+        GROUP BY Country, Region, YearMonth, StockCode
+        """,
+        None,
+    ),
+    # matrix ใบเสร็จ x สินค้าแบบ sparse (1 แถวต่อคู่ที่มีจริง) คูณกับตัวเอง = hash join บน InvoiceNo
+    # เก็บเฉพาะครึ่งบน (item_a < item_b) และ DuckDB spill ลงดิสก์ได้ถ้าคู่สินค้าเยอะเกินหน่วยความจำ
+    BASKET_PAIRS_TABLE: (
+        ["Country", "Region", "YearMonth", "item_a", "item_b"],
+        f"""
+        SELECT
+            a.Country,
+            a.Region,
+            a.YearMonth,
+            a.StockCode AS item_a,
+            b.StockCode AS item_b,
+            COUNT(*) AS invoices
+        FROM {BASKET_LINES_SQL} a
+        JOIN {BASKET_LINES_SQL} b ON b.InvoiceNo = a.InvoiceNo AND b.StockCode > a.StockCode
+        GROUP BY a.Country, a.Region, a.YearMonth, a.StockCode, b.StockCode
+        """,
+        None,
+    ),
+}
+
+RECOMPUTE_KEYS = {
+    CUBE_TABLE: ["Country", "YearMonth"],
+    CUSTOMER_MONTHS_TABLE: ["CustomerID", "YearMonth"],
+    BASKET_ITEMS_TABLE: ["Country", "YearMonth"],
+    BASKET_PAIRS_TABLE: ["Country", "YearMonth"],
+}
+
+# feature ต่อลูกค้า (ไม่มีตัวกรอง) สรุปจาก customer_months -- อัปเดตเฉพาะลูกค้าที่ delta แตะ
+CUSTOMER_FEATURES_SQL = f"""
+    SELECT
+        CustomerID,
+        MIN(Period) FILTER (WHERE sales_lines > 0) AS first_period,
+        MAX(Period) FILTER (WHERE sales_lines > 0) AS last_period,
+        COUNT(DISTINCT Period) FILTER (WHERE sales_lines > 0) AS active_periods,
+        SUM(sales_invoices) AS invoice_count,
+        SUM(revenue) AS revenue,
+        SUM(cancel_invoices) AS cancel_count
+    FROM {CUSTOMER_MONTHS_TABLE}
+    WHERE {{where}}
+    GROUP BY CustomerID
+"""
+
+
+def build_aggregates(cur, source: str = "transactions") -> None:
+    """
+    สร้าง (หรือสร้างใหม่) aggregate ทุกตารางจากตาราง transactions
+    """
+    build_tables(cur, AGGREGATES, source)
+    cur.execute(f"CREATE OR REPLACE TABLE {CUSTOMER_FEATURES_TABLE} AS {CUSTOMER_FEATURES_SQL.format(where='TRUE')}")
+
+
+def merge_aggregates(cur, delta: str, source: str = "transactions") -> None:
+    """
+    อัปเดต aggregate ด้วยตาราง delta (ต้อง insert delta ลง transactions แล้ว)
+    """
+    merge_tables(cur, AGGREGATES, delta, source)
+    # feature ของลูกค้าที่ delta แตะ คำนวณใหม่จาก customer_months ทั้งประวัติ (ไม่ scan transactions)
+    touched = f"CustomerID IN (SELECT DISTINCT CustomerID FROM {delta} WHERE CustomerID IS NOT NULL)"
+    cur.execute(f"DELETE FROM {CUSTOMER_FEATURES_TABLE} WHERE {touched}")
+    cur.execute(f"INSERT INTO {CUSTOMER_FEATURES_TABLE} {CUSTOMER_FEATURES_SQL.format(where=touched)}")
+
+
+def build_tables(cur, tables: dict, source: str = "transactions") -> None:
+    """
+    สร้างตาราง aggregate ใน tables (รูปแบบเดียวกับ AGGREGATES) จาก source
+    """
+    for table, (_, select_sql, _) in tables.items():
+        cur.execute(f"CREATE OR REPLACE TABLE {table} AS {select_sql.format(source=source)}")
+
+
+def merge_tables(cur, tables: dict, delta: str, source: str = "transactions") -> None:
+    """
+    อัปเดตตาราง aggregate ใน tables ด้วยตาราง delta
+    - measure แบบผลรวม: key ที่ตรงกันจะบวกกัน (UPDATE) key ใหม่จะถูกเพิ่มเข้าไป (INSERT)
+    - measure แบบ distinct: ลบเซลล์ที่ delta แตะ แล้วคำนวณเซลล์นั้นใหม่จาก transactions
+    """
+    for table, (keys, select_sql, merges) in tables.items():
+        if merges is None:
+            cell_keys = RECOMPUTE_KEYS[table]
+            touched = " AND ".join(f"d.{k} IS NOT DISTINCT FROM t.{k}" for k in cell_keys)
+            cur.execute(f"""
+                DELETE FROM {table} t
+                WHERE EXISTS (SELECT 1 FROM {delta} d WHERE {touched})
+            """)
+            # จำกัดช่วงวันที่ก่อน เพื่อให้ DuckDB ข้าม row group เก่าด้วย zone map
+            cells = f"""(
+                SELECT * FROM {source} t
+                WHERE InvoiceDate >= (SELECT date_trunc('month', MIN(InvoiceDate)) FROM {delta})
+                  AND EXISTS (SELECT 1 FROM {delta} d WHERE {touched})
+            )"""
+            cur.execute(f"INSERT INTO {table} {select_sql.format(source=cells)}")
+            continue
+
+        # aggregate ของ delta ครั้งเดียว แล้ว UPDATE เฉพาะ key ที่มีอยู่ + INSERT เฉพาะ key ใหม่
+        # (ไม่เขียนทั้งตารางใหม่ งานต่อการ append จึงเป็นสัดส่วนกับขนาด delta)
+        # ใช้ IS NOT DISTINCT FROM แทน primary key เพราะ key บางตัวเป็น NULL ได้ (เช่น Description)
+        join_on = " AND ".join(f"a.{k} IS NOT DISTINCT FROM d.{k}" for k in keys)
+        # ทุกตารางมี YearMonth เป็น key และ delta ต่อท้ายตามเวลา: จำกัด YearMonth ก่อน ให้ข้าม row group ของเดือนเก่าด้วย zone map
+        join_on += " AND a.YearMonth >= (SELECT MIN(YearMonth) FROM merge_delta)"
+        cur.execute(f"CREATE OR REPLACE TEMP TABLE merge_delta AS {select_sql.format(source=delta)}")
+        cur.execute(f"""
+            UPDATE {table} AS a
+            SET {", ".join(f"{col} = {expr}" for col, expr in merges.items())}
+            FROM merge_delta d
+            WHERE {join_on}
+        """)
+        cur.execute(f"""
+            INSERT INTO {table} BY NAME
+            SELECT * FROM merge_delta d
+            WHERE NOT EXISTS (SELECT 1 FROM {table} a WHERE {join_on})
+        """)
+        cur.execute("DROP TABLE merge_delta")
@@ -0,0 +1,244 @@
+import pandas as pd
+
+# ---------------------------------------------------
+# Country dimension: Country -> Region, Continent, ISO code
+# ---------------------------------------------------
+# ใช้ join ครั้งเดียวใน engine (ต้นทุน O(จำนวนประเทศ) แทนการ .apply ทีละแถว)
+# ชื่อประเทศใช้ตามที่ปรากฏในชุดข้อมูล Online Retail (เช่น EIRE, RSA, USA)
+# และรวมชื่อเรียกอื่นของประเทศเดียวกันไว้ด้วย (เช่น UAE / United Arab Emirates)
+
+DIM_COUNTRY_TABLE = "dim_country"
+
+# Region ของ dashboard อ้างอิงจากทวีป
+REGION_BY_CONTINENT = {
+    "Asia": "Asian Countries",
+    "Europe": "EU Countries",
+}
+DEFAULT_REGION = "Other Regions"
+
+# (Country, Continent, ISO 3166-1 alpha-3) -- None = ไม่มีรหัสประเทศ
+COUNTRIES = [
+    # Europe
+    ("United Kingdom", "Europe", "GBR"),
+    ("EIRE", "Europe", "IRL"),
+    ("Ireland", "Europe", "IRL"),
+    ("Netherlands", "Europe", "NLD"),
+    ("Germany", "Europe", "DEU"),
+    ("France", "Europe", "FRA"),
+    ("Spain", "Europe", "ESP"),
+    ("Portugal", "Europe", "PRT"),
+    ("Belgium", "Europe", "BEL"),
+    ("Switzerland", "Europe", "CHE"),
+    ("Norway", "Europe", "NOR"),
+    ("Sweden", "Europe", "SWE"),
+    ("Finland", "Europe", "FIN"),
+    ("Italy", "Europe", "ITA"),
+    ("Austria", "Europe", "AUT"),
+    ("Denmark", "Europe", "DNK"),
+    ("Poland", "Europe", "POL"),
+    ("Greece", "Europe", "GRC"),
+    ("Cyprus", "Europe", "CYP"),
+    ("Channel Islands", "Europe", None),
+    ("Iceland", "Europe", "ISL"),
+    ("Malta", "Europe", "MLT"),
+    ("Lithuania", "Europe", "LTU"),
+    ("Czech Republic", "Europe", "CZE"),
+    ("European Community", "Europe", None),
+    ("Albania", "Europe", "ALB"),
+    ("Andorra", "Europe", "AND"),
+    ("Belarus", "Europe", "BLR"),
+    ("Bosnia and Herzegovina", "Europe", "BIH"),
+    ("Bulgaria", "Europe", "BGR"),
+    ("Croatia", "Europe", "HRV"),
+    ("Estonia", "Europe", "EST"),
+    ("Faroe Islands", "Europe", "FRO"),
+    ("Gibraltar", "Europe", "GIB"),
+    ("Guernsey", "Europe", "GGY"),
+    ("Holy See", "Europe", "VAT"),
+    ("Hungary", "Europe", "HUN"),
+    ("Isle of Man", "Europe", "IMN"),
+    ("Jersey", "Europe", "JEY"),
+    ("Latvia", "Europe", "LVA"),
+    ("Liechtenstein", "Europe", "LIE"),
+    ("Luxembourg", "Europe", "LUX"),
+    ("Monaco", "Europe", "MCO"),
+    ("Montenegro", "Europe", "MNE"),
+    ("North Macedonia", "Europe", "MKD"),
+    ("Republic of Moldova", "Europe", "MDA"),
+    ("Romania", "Europe", "ROU"),
+    ("San Marino", "Europe", "SMR"),
+    ("Serbia", "Europe", "SRB"),
+    ("Slovakia", "Europe", "SVK"),
+    ("Slovenia", "Europe", "SVN"),
+    ("Ukraine", "Europe", "UKR"),
+    ("Kosovo", "Europe", "XKX"),
+
+    # Asia / Middle East
+    ("Israel", "Asia", "ISR"),
+    ("Japan", "Asia", "JPN"),
+    ("Singapore", "Asia", "SGP"),
+    ("Hong Kong", "Asia", "HKG"),
+    ("Thailand", "Asia", "THA"),
+    ("Korea", "Asia", "KOR"),
+    ("Republic of Korea", "Asia", "KOR"),
+    ("China", "Asia", "CHN"),
+    ("Saudi Arabia", "Asia", "SAU"),
+    ("United Arab Emirates", "Asia", "ARE"),
+    ("UAE", "Asia", "ARE"),
+    ("Lebanon", "Asia", "LBN"),
+    ("Bahrain", "Asia", "BHR"),
+    ("Afghanistan", "Asia", "AFG"),
+    ("Armenia", "Asia", "ARM"),
+    ("Azerbaijan", "Asia", "AZE"),
+    ("Bangladesh", "Asia", "BGD"),
+    ("Bhutan", "Asia", "BTN"),
+    ("Brunei Darussalam", "Asia", "BRN"),
+    ("Cambodia", "Asia", "KHM"),
+    ("Georgia", "Asia", "GEO"),
+    ("India", "Asia", "IND"),
+    ("Indonesia", "Asia", "IDN"),
+    ("Iran", "Asia", "IRN"),
+    ("Iraq", "Asia", "IRQ"),
+    ("Jordan", "Asia", "JOR"),
+    ("Kazakhstan", "Asia", "KAZ"),
+    ("Kuwait", "Asia", "KWT"),
+    ("Kyrgyzstan", "Asia", "KGZ"),
+    ("Laos", "Asia", "LAO"),
+    ("Macao", "Asia", "MAC"),
+    ("Malaysia", "Asia", "MYS"),
+    ("Maldives", "Asia", "MDV"),
+    ("Mongolia", "Asia", "MNG"),
+    ("Myanmar", "Asia", "MMR"),
+    ("Nepal", "Asia", "NPL"),
+    ("Oman", "Asia", "OMN"),
+    ("Pakistan", "Asia", "PAK"),
+    ("Palestine, State of", "Asia", "PSE"),
+    ("Philippines", "Asia", "PHL"),
+    ("Qatar", "Asia", "QAT"),
+    ("Sri Lanka", "Asia", "LKA"),
+    ("Syrian Arab Republic", "Asia", "SYR"),
+    ("Tajikistan", "Asia", "TJK"),
+    ("Timor-Leste", "Asia", "TLS"),
+    ("Turkey", "Asia", "TUR"),
+    ("Turkmenistan", "Asia", "TKM"),
+    ("Uzbekistan", "Asia", "UZB"),
+    ("Viet Nam", "Asia", "VNM"),
+    ("Vietnam", "Asia", "VNM"),
+    ("Yemen", "Asia", "YEM"),
+
+    # Oceania
+    ("Australia", "Oceania", "AUS"),
+    ("New Zealand", "Oceania", "NZL"),
+
+    # Americas
+    ("USA", "Americas", "USA"),
+    ("Canada", "Americas", "CAN"),
+    ("Belize", "Americas", "BLZ"),
+    ("Costa Rica", "Americas", "CRI"),
+    ("El Salvador", "Americas", "SLV"),
+    ("Guatemala", "Americas", "GTM"),
+    ("Honduras", "Americas", "HND"),
+    ("Mexico", "Americas", "MEX"),
+    ("Nicaragua", "Americas", "NIC"),
+    ("Panama", "Americas", "PAN"),
+    ("Antigua and Barbuda", "Americas", "ATG"),
+    ("Bahamas", "Americas", "BHS"),
+    ("Barbados", "Americas", "BRB"),
+    ("Cuba", "Americas", "CUB"),
+    ("Dominica", "Americas", "DMA"),
+    ("Dominican Republic", "Americas", "DOM"),
+    ("Grenada", "Americas", "GRD"),
+    ("Haiti", "Americas", "HTI"),
+    ("Jamaica", "Americas", "JAM"),
+    ("Saint Kitts and Nevis", "Americas", "KNA"),
+    ("Saint Lucia", "Americas", "LCA"),
+    ("Saint Vincent and the Grenadines", "Americas", "VCT"),
+    ("Trinidad and Tobago", "Americas", "TTO"),
+    ("Argentina", "Americas", "ARG"),
+    ("Bolivia", "Americas", "BOL"),
+    ("Brazil", "Americas", "BRA"),
+    ("Chile", "Americas", "CHL"),
+    ("Colombia", "Americas", "COL"),
+    ("Ecuador", "Americas", "ECU"),
+    ("Guyana", "Americas", "GUY"),
+    ("Paraguay", "Americas", "PRY"),
+    ("Peru", "Americas", "PER"),
+    ("Suriname", "Americas", "SUR"),
+    ("Uruguay (Oriental Republic of)", "Americas", "URY"),
+    ("Venezuela (Bolivarian Republic of)", "Americas", "VEN"),
+
+    # Africa
+    ("RSA", "Africa", "ZAF"),
+    ("South Africa", "Africa", "ZAF"),
+    ("Algeria", "Africa", "DZA"),
+    ("Angola", "Africa", "AGO"),
+    ("Benin", "Africa", "BEN"),
+    ("Botswana", "Africa", "BWA"),
+    ("Burkina Faso", "Africa", "BFA"),
+    ("Burundi", "Africa", "BDI"),
+    ("Cabo Verde", "Africa", "CPV"),
+    ("Cameroon", "Africa", "CMR"),
+    ("Central African Republic", "Africa", "CAF"),
+    ("Chad", "Africa", "TCD"),
+    ("Comoros", "Africa", "COM"),
+    ("Congo", "Africa", "COG"),
+    ("Côte d'Ivoire", "Africa", "CIV"),
+    ("Democratic Republic of the Congo", "Africa", "COD"),
+    ("Djibouti", "Africa", "DJI"),
+    ("Egypt", "Africa", "EGY"),
+    ("Equatorial Guinea", "Africa", "GNQ"),
+    ("Eritrea", "Africa", "ERI"),
+    ("Eswatini", "Africa", "SWZ"),
+    ("Ethiopia", "Africa", "ETH"),
+    ("Gabon", "Africa", "GAB"),
+    ("Gambia", "Africa", "GMB"),
+    ("Ghana", "Africa", "GHA"),
+    ("Guinea", "Africa", "GIN"),
+    ("Guinea-Bissau", "Africa", "GNB"),
+    ("Kenya", "Africa", "KEN"),
+    ("Lesotho", "Africa", "LSO"),
+    ("Liberia", "Africa", "LBR"),
+    ("Libya", "Africa", "LBY"),
+    ("Madagascar", "Africa", "MDG"),
+    ("Malawi", "Africa", "MWI"),
+    ("Mali", "Africa", "MLI"),
+    ("Mauritania", "Africa", "MRT"),
+    ("Mauritius", "Africa", "MUS"),
+    ("Morocco", "Africa", "MAR"),
+    ("Mozambique", "Africa", "MOZ"),
+    ("Namibia", "Africa", "NAM"),
+    ("Niger", "Africa", "NER"),
+    ("Nigeria", "Africa", "NGA"),
+    ("Rwanda", "Africa", "RWA"),
+    ("Sao Tome and Principe", "Africa", "STP"),
+    ("Senegal", "Africa", "SEN"),
+    ("Seychelles", "Africa", "SYC"),
+    ("Sierra Leone", "Africa", "SLE"),
+    ("Somalia", "Africa", "SOM"),
+    ("South Sudan", "Africa", "SSD"),
+    ("Sudan", "Africa", "SDN"),
+    ("Tanzania", "Africa", "TZA"),
+    ("Togo", "Africa", "TGO"),
+    ("Tunisia", "Africa", "TUN"),
+    ("Uganda", "Africa", "UGA"),
+    ("Zambia", "Africa", "ZMB"),
+    ("Zimbabwe", "Africa", "ZWE"),
+]
+
+
+def country_dimension() -> pd.DataFrame:
+    """
+    คืนตาราง dimension ของประเทศ (1 แถวต่อ 1 ชื่อประเทศ)
+    """
+    dim = pd.DataFrame(COUNTRIES, columns=["Country", "Continent", "ISOCode"])
+    dim["Region"] = dim["Continent"].map(REGION_BY_CONTINENT).fillna(DEFAULT_REGION)
+    return dim[["Country", "Region", "Continent", "ISOCode"]]
+
+
+def build_country_dimension(cur) -> None:
+    """
+    สร้างตาราง dim_country ใน engine
+    """
+    cur.register("country_dimension_df", country_dimension())
+    cur.execute(f"CREATE OR REPLACE TABLE {DIM_COUNTRY_TABLE} AS SELECT * FROM country_dimension_df")
+    cur.unregister("country_dimension_df")
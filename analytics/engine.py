@@ -0,0 +1,317 @@
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import duckdb
+import pandas as pd
+
+from .baskets import drop_basket_index, update_basket_index
+from .categories import update_product_dimension
+from .cleaning import (
+    ADJUSTMENT,
+    ROW_STATUS_SQL,
+    SALE,
+    create_row_status_type,
+    create_status_tables,
+    create_status_views,
+    drop_status_tables,
+    insert_status_rows,
+    status_sql,
+)
+from .cube import STOCK_TOTALS_TABLE, build_aggregates, merge_aggregates
+from .dimensions import build_country_dimension
+from .instrumentation import stage
+from .query_cache import QueryCache, cache_key, normalize_sql
+from .store import parquet_scan, read_manifest, snapshot_files
+
+# ---------------------------------------------------
+# Execution mode
+# ---------------------------------------------------
+# - memory      : โหลดแถวเป็นตาราง sales / cancellations / adjustments ใน DuckDB (analytics.cleaning)
+#                 และ transactions เป็น VIEW ที่ต่อทั้งสามตาราง (เร็วที่สุดเมื่อข้อมูลพอดีกับ RAM)
+# - out_of_core : transactions เป็น VIEW ที่ scan Parquet snapshot บนดิสก์โดยตรง
+#                 (sales / cancellations / adjustments เป็น VIEW ที่กรอง RowStatus)
+#                 เก็บเฉพาะตาราง aggregate ไว้ในหน่วยความจำ และให้ DuckDB spill ลงดิสก์เมื่อเกิน memory_limit
+# - auto        : ใช้ out_of_core เมื่อ snapshot มีแถวเกิน OUT_OF_CORE_ROWS
+# ทั้งสองโหมดมีแค่ผล query เท่านั้นที่ถูกแปลงเป็น pandas
+ENGINE_MODE = os.environ.get("RETAIL_ENGINE_MODE", "auto")
+OUT_OF_CORE_ROWS = int(os.environ.get("RETAIL_OUT_OF_CORE_ROWS", "5000000"))
+MEMORY_LIMIT = os.environ.get("RETAIL_DUCKDB_MEMORY_LIMIT")  # เช่น "2GB" (None = ค่าเริ่มต้นของ DuckDB, 80% ของ RAM)
+TEMP_DIRECTORY = os.environ.get(
+    "RETAIL_DUCKDB_TEMP_DIR", os.path.join(tempfile.gettempdir(), "retail_duckdb_spill")
+)
+MODES = ("auto", "memory", "out_of_core")
+
+# นับลูกค้าแบบประมาณด้วย HyperLogLog sketch (analytics.sketches): on / off / auto (= เมื่อเป็น out_of_core)
+APPROX_DISTINCT = os.environ.get("RETAIL_APPROX_DISTINCT", "auto")
+
+# index สินค้าที่มักซื้อด้วยกัน (analytics.baskets): on / off / auto (= เมื่อไม่ใช่ out_of_core)
+BASKET_INDEX = os.environ.get("RETAIL_BASKET_INDEX", "auto")
+
+logger = logging.getLogger(__name__)
+
+
+class AnalyticsEngine:
+    """
+    DuckDB engine ตัวเดียวที่ใช้ร่วมกันทุก session และทุกหน้า
+    ถือตาราง aggregate ที่สร้างจาก snapshot ไว้แล้ว (และตาราง sales / cancellations / adjustments ในโหมด memory)
+    และแจก cursor แยกต่อการ query
+    ผลของ query เก็บใน query_cache (key ผูกกับ snapshot version) จึงไม่ต้องรัน SQL เดิมซ้ำทุก rerun
+    """
+
+    def __init__(
+        self,
+        database: str = ":memory:",
+        query_cache: QueryCache | None = None,
+        mode: str = ENGINE_MODE,
+        memory_limit: str | None = MEMORY_LIMIT,
+        temp_directory: str = TEMP_DIRECTORY,
+        approx_distinct: str = APPROX_DISTINCT,
+        basket_index: str = BASKET_INDEX,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"mode ต้องเป็นหนึ่งใน {MODES} (ได้ {mode!r})")
+        self._con = duckdb.connect(database)
+        self._con.execute("SET temp_directory = ?", [temp_directory])
+        if memory_limit:
+            self._con.execute("SET memory_limit = ?", [memory_limit])
+        self.query_cache = query_cache or QueryCache()
+        self.mode = mode
+        self.out_of_core = False
+        self.approx_distinct = approx_distinct
+        self.basket_index = basket_index
+        self._basket_version = None  # version ของ snapshot ที่ basket index ตรงด้วย (None = ยังไม่มี index)
+        self._basket_failed_version = None  # version ล่าสุดที่สร้าง basket index ไม่สำเร็จ
+        self._lock = threading.RLock()
+        self.version = None
+        self._base = None
+        self._parts = set()
+
+    # ---------- Table setup ----------
+    def _select_transactions(self, files, ordered: bool = True) -> str:
+        # Region มาจาก partition ของ snapshot (กำหนดจาก dim_country ตอนเขียนไฟล์)
+        # ORDER BY path เพื่อเรียงแถวตาม partition (เดือน -> ภูมิภาค) zone map ของทั้ง
+        # InvoiceDate และ Region จึงข้าม row group ที่ไม่เกี่ยวกับตัวกรองได้
+        # UnitPrice เก็บเป็น float32 ใน snapshot จึงปัดกลับเป็น DECIMAL ให้คำนวณยอดเงินได้แม่นยำ
+        # RowStatus จัดประเภทแถวครั้งเดียวตรงนี้ (analytics.cleaning)
+        return f"""
+            SELECT t.* EXCLUDE (filename, file_row_number, year_month, region)
+                       REPLACE (CAST(t.UnitPrice AS DECIMAL(12, 3)) AS UnitPrice),
+                   t.region AS Region,
+                   {ROW_STATUS_SQL} AS RowStatus
+            FROM {parquet_scan(files)} t
+            {"ORDER BY t.filename, t.file_row_number" if ordered else ""}
+        """
+
+    def sync(self, manifest: dict) -> None:
+        """
+        ทำให้ตารางใน engine ตรงกับ snapshot ล่าสุด
+        - snapshot ชุดใหม่ (full refresh): สร้าง transactions และ aggregate ใหม่ทั้งหมด
+        - มี part ใหม่ต่อท้าย (incremental append): insert เฉพาะ delta แล้ว merge aggregate
+        basket index ที่ยังไม่ตรงกับ version ปัจจุบันจะถูกสร้างใหม่ (ถ้าสร้างไม่สำเร็จจะลองใหม่เมื่อมี version ใหม่เท่านั้น)
+        """
+        with self._lock:
+            if self.version == manifest["version"]:
+                if (
+                    self._basket_index_enabled()
+                    and self._basket_version != self.version
+                    and self._basket_failed_version != self.version
+                ):
+                    self._sync_basket_index(incremental=False)
+                return
+            previous_version = self.version
+            parts = {part["name"] for part in manifest["parts"]}
+            full_load = self._base != manifest["base"]
+            files = snapshot_files(manifest)
+            new_files = files if full_load else snapshot_files(manifest, parts=parts - self._parts)
+            out_of_core = self.mode == "out_of_core" or (
+                self.mode == "auto" and sum(part["rows"] for part in manifest["parts"]) > OUT_OF_CORE_ROWS
+            )
+
+            with stage("engine_sync", section_name="engine") as s:
+                s.extra["mode"] = "full" if full_load else "append"
+                s.extra["out_of_core"] = out_of_core
+                s.extra["files"] = len(new_files)
+                self._load(files, new_files, full_load, out_of_core)
+                with self.cursor() as cur:
+                    s.rows_out = cur.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+            self._base = manifest["base"]
+            self._parts = parts
+            self.version = manifest["version"]
+            self.query_cache.clear()
+            # merge ด้วย delta ได้เฉพาะเมื่อ index ตรงกับ version ก่อน append นี้
+            self._sync_basket_index(incremental=not full_load and self._basket_version == previous_version)
+
+    def _load(self, files, new_files, full_load: bool, out_of_core: bool) -> None:
+        # โหมดเปลี่ยนได้เฉพาะตอน full load (append ต่อในโหมดเดิม)
+        out_of_core = out_of_core if full_load else self.out_of_core
+        self._con.begin()
+        try:
+            if full_load:
+                # out_of_core: ไม่ต้องคงลำดับแถวของผลที่ไม่มี ORDER BY ลดหน่วยความจำที่ DuckDB ต้องถือไว้
+                self._con.execute(f"SET preserve_insertion_order = {not out_of_core}")
+                build_country_dimension(self._con)
+                create_row_status_type(self._con)
+                drop_status_tables(self._con, views=self.out_of_core)
+                if out_of_core:
+                    self._create_transactions_view(files)
+                else:
+                    self._con.execute(
+                        f"CREATE TEMP TABLE transactions_stage AS {self._select_transactions(files)}"
+                    )
+                    create_status_tables(self._con, "transactions_stage")
+                    self._con.execute("DROP TABLE transactions_stage")
+                build_aggregates(self._con)
+                update_product_dimension(self._con, STOCK_TOTALS_TABLE, full_load=True)
+            else:
+                self._con.execute(
+                    f"CREATE OR REPLACE TEMP TABLE transactions_delta AS {self._select_transactions(new_files)}"
+                )
+                if out_of_core:
+                    self._create_transactions_view(files)
+                else:
+                    insert_status_rows(self._con, "transactions_delta")
+                merge_aggregates(self._con, "transactions_delta")
+                # สินค้าชุดเดียวกับ stock_totals ตอน full load (ไม่นับสินค้าที่มีแต่ใบเสร็จยกเลิก)
+                update_product_dimension(
+                    self._con,
+                    f"(SELECT * FROM transactions_delta WHERE {status_sql(SALE, ADJUSTMENT)})",
+                    full_load=False,
+                )
+            self._con.commit()
+        except Exception:
+            self._con.rollback()
+            raise
+        self.out_of_core = out_of_core
+
+    def _sync_basket_index(self, incremental: bool) -> None:
+        """
+        สร้าง / merge index ของ Market Basket หลัง commit ข้อมูลหลักแล้ว (แยก statement ไม่อยู่ใน transaction เดียวกัน)
+        DuckDB อ่านตารางขนาดใหญ่ที่เพิ่งสร้างใน transaction เดียวกันได้ช้ามาก (basket_pairs -> product_associations)
+        index เป็นส่วนเสริม: ถ้าล้มเหลวจะลบ index และบันทึก log (ไม่ raise)
+        แล้วสร้างใหม่ทั้งหมดเมื่อ sync กับ snapshot version ใหม่ (ไม่ลองซ้ำทุกครั้งที่เรียก get_engine)
+        """
+        try:
+            if not self._basket_index_enabled():
+                drop_basket_index(self._con)
+                self._basket_version = None
+                return
+            with stage("basket_index", section_name="engine") as s:
+                delta = "transactions_delta" if incremental else None
+                s.extra["mode"] = "full" if delta is None else "append"
+                self._basket_version = None
+                update_basket_index(self._con, delta)
+                self._basket_version = self.version
+        except Exception:
+            logger.exception("สร้าง basket index ไม่สำเร็จ (version %s)", self.version)
+            self._basket_failed_version = self.version
+            drop_basket_index(self._con)
+        finally:
+            self._con.execute("DROP TABLE IF EXISTS transactions_delta")
+
+    def _create_transactions_view(self, files) -> None:
+        # ไม่ ORDER BY ใน view: query จะ stream ผ่านไฟล์ได้โดยไม่ต้อง sort ทั้งชุด
+        # ตัวกรอง Region ถูก push ลงไปเป็น partition pruning และ InvoiceDate ใช้ row-group statistics
+        self._con.execute(
+            f"CREATE OR REPLACE VIEW transactions AS {self._select_transactions(files, ordered=False)}"
+        )
+        create_status_views(self._con)
+
+    @property
+    def approximate_distinct(self) -> bool:
+        """
+        True = metrics ที่นับลูกค้าไม่ซ้ำจะใช้ค่าประมาณจาก sketch แทนการ merge list ของ CustomerID
+        """
+        if self.approx_distinct == "auto":
+            return self.out_of_core
+        return self.approx_distinct == "on"
+
+    @property
+    def basket_index_ready(self) -> bool:
+        """
+        True = มีตาราง basket_* / product_associations (Market Basket) ให้ query
+        """
+        return self._basket_version is not None and self._basket_version == self.version
+
+    def _basket_index_enabled(self) -> bool:
+        if self.basket_index == "auto":
+            return not self.out_of_core
+        return self.basket_index == "on"
+
+    # ---------- Query API ----------
+    @contextmanager
+    def cursor(self):
+        """
+        คืน cursor ของ DuckDB (connection แยกต่อ thread แต่เห็นฐานข้อมูลเดียวกัน)
+        """
+        cur = self._con.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    def query(self, sql: str, params=None, frames: dict | None = None, cache: bool = True) -> pd.DataFrame:
+        """
+        รัน SQL แล้วคืนผลเป็น DataFrame (ผ่าน query_cache)
+        frames: DataFrame ชั่วคราวที่ต้องการ register ให้ query นี้เห็น (เฉพาะใน cursor นี้)
+                query ที่ใช้ frames ไม่ถูก cache เพราะผลขึ้นกับข้อมูลใน frame
+        cache: False = รันจริงทุกครั้ง (เช่น ข้อมูลที่เปลี่ยนตลอดอย่าง duckdb_memory())
+        """
+        with stage("sql") as s:
+            s.extra["sql"] = normalize_sql(sql)[:160]
+            key = cache_key(sql, params, self.version) if cache and not frames else None
+            if key is not None:
+                cached = self.query_cache.get(key)
+                if cached is not None:
+                    s.extra["cache"] = "hit"
+                    s.rows_out = len(cached)
+                    return cached
+
+            with self.cursor() as cur:
+                for name, frame in (frames or {}).items():
+                    cur.register(name, frame)
+                df = cur.execute(sql, params).df()
+
+            s.extra["cache"] = "miss" if key is not None else "bypass"
+            s.rows_out = len(df)
+            if key is not None:
+                self.query_cache.put(key, df)
+            return df
+
+    def scalar(self, sql: str, params=None):
+        return self.query(sql, params).iat[0, 0]
+
+    def memory_report(self) -> pd.DataFrame:
+        """
+        หน่วยความจำที่ DuckDB ใช้อยู่ แยกตามประเภท (bytes)
+        """
+        return self.query("""
+            SELECT tag AS component, memory_usage_bytes AS bytes
+            FROM duckdb_memory()
+            WHERE memory_usage_bytes > 0
+            ORDER BY bytes DESC
+        """, cache=False)
+
+    def columns(self, table: str = "transactions") -> list[str]:
+        with self.cursor() as cur:
+            return [row[0] for row in cur.execute(f"DESCRIBE {table}").fetchall()]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> AnalyticsEngine:
+    """
+    คืน engine ระดับ process (สร้างครั้งแรกเมื่อถูกเรียก)
+    ถ้า snapshot ถูก refresh หรือ append ไปแล้วจะ sync ตารางให้อัตโนมัติ
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AnalyticsEngine()
+    _engine.sync(read_manifest())
+    return _engine
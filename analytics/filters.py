@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+
+# ---------------------------------------------------
+# ตัวกรองของ dashboard: ช่วงเดือน / ประเทศ / ภูมิภาค
+# ---------------------------------------------------
+# ทุกฟังก์ชันใน analytics.metrics รับ Filters แล้วต่อ predicate เข้าไปใน WHERE ของ SQL
+# (ไม่กรองใน pandas) DuckDB จึงอ่านเฉพาะแถวที่เกี่ยวข้อง
+# ทั้งตาราง aggregate และตาราง transactions มี YearMonth / Country / Region เป็นคอลัมน์
+# จึงใช้ predicate ชุดเดียวกัน
+#
+# ช่วงวันที่ละเอียดระดับเดือน (YYYY-MM) ให้ตรงกับตาราง aggregate และรวมเดือนปลายทางด้วย
+
+
+@dataclass(frozen=True)
+class Filters:
+    start_month: str | None = None
+    end_month: str | None = None
+    countries: tuple[str, ...] = ()
+    regions: tuple[str, ...] = ()
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.start_month or self.end_month or self.countries or self.regions)
+
+    def sql(self, alias: str | None = None) -> tuple[str, list]:
+        """
+        คืน (predicate, params) สำหรับต่อท้าย WHERE ... AND {predicate}
+        alias: ชื่อย่อตารางที่มีคอลัมน์ YearMonth / Country / Region (เช่น "t")
+        """
+        prefix = f"{alias}." if alias else ""
+        clauses, params = [], []
+
+        if self.start_month:
+            clauses.append(f"{prefix}YearMonth >= ?")
+            params.append(self.start_month)
+        if self.end_month:
+            clauses.append(f"{prefix}YearMonth <= ?")
+            params.append(self.end_month)
+
+        for column, values in (("Country", self.countries), ("Region", self.regions)):
+            if values:
+                clauses.append(f"{prefix}{column} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+
+        return " AND ".join(clauses) or "TRUE", params
+
+    def describe(self) -> str:
+        """
+        ข้อความสั้น ๆ อธิบายตัวกรองที่ใช้อยู่ (แสดงใต้หัวข้อ / ใส่ใน prompt ของ AI)
+        """
+        if self.is_empty:
+            return "ข้อมูลทั้งหมด"
+        parts = []
+        if self.start_month or self.end_month:
+            parts.append(f"ช่วง {self.start_month or 'เริ่มต้น'} ถึง {self.end_month or 'ล่าสุด'}")
+        if self.regions:
+            parts.append(f"ภูมิภาค: {', '.join(self.regions)}")
+        if self.countries:
+            parts.append(f"ประเทศ: {', '.join(self.countries)}")
+        return " | ".join(parts)
+
+
+NO_FILTERS = Filters()
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+from .instrumentation import stage
+from .store import SNAPSHOT_DIR
+
+# ---------------------------------------------------
+# AI Insight service
+# ---------------------------------------------------
+# - cache ผลลัพธ์ลงดิสก์ (SQLite) โดยใช้ hash ของ (model, system prompt, user prompt, data version)
+#   เป็น key -> prompt เดิมกับข้อมูลเดิมไม่ต้องเรียก API ซ้ำ
+# - เรียก LLM ใน background thread pool เพื่อให้หน้าแสดงผลได้ทันที
+#   หลาย section ส่งงานพร้อมกันได้ (จำกัดจำนวน worker) และ retry แบบ backoff เมื่อโดน rate limit
+# - รับคำตอบแบบ streaming: ข้อความที่ได้มาแล้วอยู่ใน InsightFuture.partial ให้หน้าเว็บแสดงทีละส่วน
+#   เมื่อได้ครบจึงเขียนลง cache
+# - request ที่ล้มเหลวจะจำ error ไว้สั้น ๆ (FAILURE_TTL_SECONDS) ไม่ส่งซ้ำทุกครั้งที่หน้า rerun
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_TEMPERATURE = 0.2
+CACHE_PATH = SNAPSHOT_DIR / "insight_cache.sqlite"
+MAX_WORKERS = int(os.environ.get("RETAIL_INSIGHT_WORKERS", "5"))
+MAX_RETRIES = 4
+FAILURE_TTL_SECONDS = 60
+
+
+def insight_key(model: str, system_prompt: str, prompt: str, data_version: str) -> str:
+    payload = json.dumps([model, system_prompt, prompt, data_version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InsightCache:
+    """
+    cache ของ insight บนดิสก์ (ใช้ร่วมกันได้หลาย process)
+    ลบรายการที่เกิน TTL และรายการที่ใช้ล่าสุดนานที่สุดเมื่อเกิน max_entries (LRU)
+    """
+
+    def __init__(self, path: Path = CACHE_PATH, ttl_seconds: float = 24 * 3600, max_entries: int = 500):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS insights (
+                    key TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            row = db.execute(
+                "SELECT content FROM insights WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE insights SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, content: str) -> None:
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO insights (key, content, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, content, now, now),
+            )
+            db.execute("DELETE FROM insights WHERE created_at < ?", (now - self.ttl_seconds,))
+            db.execute(
+                """
+                DELETE FROM insights WHERE key NOT IN (
+                    SELECT key FROM insights ORDER BY accessed_at DESC LIMIT ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+
+class RateLimitError(Exception):
+    """
+    error แบบเดียวกับ HTTP 429 (ใช้กับ StubClient)
+    """
+
+    status_code = 429
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """
+    เวลารอก่อน retry: ใช้ header retry-after ถ้ามี ไม่งั้นใช้ exponential backoff + jitter
+    """
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(2 ** attempt, 30) + random.uniform(0, 0.5)
+
+
+class InsightFuture(Future):
+    """
+    Future ของ insight ที่มีข้อความบางส่วน (partial) ระหว่างรับ stream
+    """
+
+    def __init__(self, partial: str = ""):
+        super().__init__()
+        self.partial = partial
+
+
+class StubClient:
+    """
+    client จำลองที่มีหน้าตาเหมือน Groq (client.chat.completions.create)
+    ใช้แทน Groq ตอนทดสอบ/พัฒนา โดยไม่เรียก API จริง
+    """
+
+    def __init__(self, reply: str = "- (stub) ตัวอย่าง insight จาก AI", delay: float = 0.0, rate_limited: int = 0):
+        self.reply = reply
+        self.delay = delay
+        self.rate_limited = rate_limited  # จำนวนครั้งแรกที่จะตอบกลับเป็น 429
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        self.calls.append({"model": model, "messages": messages, "stream": stream, **kwargs})
+        if len(self.calls) <= self.rate_limited:
+            raise RateLimitError("rate limit exceeded")
+        if stream:
+            return self._stream()
+        if self.delay:
+            time.sleep(self.delay)
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def _stream(self):
+        # แบ่งคำตอบเป็นทีละคำ กระจาย delay ให้เท่า ๆ กันทุก chunk
+        tokens = self.reply.split(" ")
+        for i, token in enumerate(tokens):
+            if self.delay:
+                time.sleep(self.delay / len(tokens))
+            content = token if i == 0 else " " + token
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class InsightService:
+    """
+    ส่ง prompt ไปให้ LLM ใน background และคืน Future ของข้อความ insight
+    request ที่ key ซ้ำกับงานที่กำลังรันอยู่จะได้ Future เดียวกัน (ไม่เรียก API ซ้ำ)
+    request ที่ล้มเหลวจะได้ Future ที่มี error เดิมจนกว่าจะพ้น failure_ttl แล้วจึงลองใหม่
+    """
+
+    def __init__(
+        self,
+        client,
+        cache: InsightCache | None = None,
+        max_workers: int = MAX_WORKERS,
+        max_retries: int = MAX_RETRIES,
+        stream: bool = True,
+        failure_ttl: float = FAILURE_TTL_SECONDS,
+    ):
+        self.client = client
+        self.cache = cache or InsightCache()
+        self.max_retries = max_retries
+        self.stream = stream
+        self.failure_ttl = failure_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="insight")
+        self._inflight = {}
+        self._failures = {}  # key -> (เวลาที่ล้มเหลว, Future ที่มี error)
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        system_prompt: str,
+        prompt: str,
+        data_version: str,
+        model: str = DEFAULT_MODEL,
+    ) -> InsightFuture:
+        key = insight_key(model, system_prompt, prompt, data_version)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            future = InsightFuture(cached)
+            future.set_result(cached)
+            return future
+
+        with self._lock:
+            failed = self._failures.get(key)
+            if failed is not None and time.time() - failed[0] < self.failure_ttl:
+                return failed[1]
+            future = self._inflight.get(key)
+            if future is None:
+                future = InsightFuture()
+                self._inflight[key] = future
+                self._executor.submit(self._complete, future, key, model, system_prompt, prompt)
+            return future
+
+    def submit_many(self, requests: list[tuple[str, str]], data_version: str, model: str = DEFAULT_MODEL) -> list[InsightFuture]:
+        """
+        ส่ง (system prompt, prompt) หลายชุดพร้อมกัน คืน Future ตามลำดับเดิม
+        เวลารวมจึงใกล้เคียง request ที่ช้าที่สุด แทนที่จะเป็นผลรวมของทุก request
+        """
+        return [self.submit(system_prompt, prompt, data_version, model) for system_prompt, prompt in requests]
+
+    def _create_with_backoff(self, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.chat.completions.create(**kwargs)
+            except Exception as error:
+                if attempt == self.max_retries or not is_rate_limited(error):
+                    raise
+                time.sleep(retry_delay(error, attempt))
+
+    def _complete(self, future: InsightFuture, key: str, model: str, system_prompt: str, prompt: str) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with stage("llm", section_name="insight") as s:
+                s.extra["model"] = model
+                response = self._create_with_backoff(
+                    model=model,
+                    temperature=DEFAULT_TEMPERATURE,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt},
+                    ],
+                    stream=self.stream,
+                )
+                if self.stream:
+                    for chunk in response:
+                        future.partial += chunk.choices[0].delta.content or ""
+                    content = future.partial
+                else:
+                    content = response.choices[0].message.content
+                    future.partial = content
+                s.extra["chars_out"] = len(content)
+            self.cache.put(key, content)
+            future.set_result(content)
+        except Exception as error:
+            now = time.time()
+            with self._lock:
+                self._failures = {k: v for k, v in self._failures.items() if now - v[0] < self.failure_ttl}
+                self._failures[key] = (now, future)
+            future.set_exception(error)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def make_client(api_key: str):
+    """
+    สร้าง Groq client (ตั้ง RETAIL_INSIGHT_CLIENT=stub เพื่อใช้ StubClient แทน)
+    """
+    if os.environ.get("RETAIL_INSIGHT_CLIENT") == "stub":
+        return StubClient()
+    from groq import Groq
+    return Groq(api_key=api_key)
+
+
+def get_insight_service(api_key: str) -> InsightService:
+    """
+    คืน InsightService ระดับ process (1 ตัวต่อ API key) ที่ใช้ร่วมกันทุก session และทุกหน้า
+    """
+    with _services_lock:
+        if api_key not in _services:
+            _services[api_key] = InsightService(make_client(api_key))
+        return _services[api_key]
@@ -0,0 +1,228 @@
+import contextvars
+import functools
+import json
+import logging
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pandas as pd
+
+# ---------------------------------------------------
+# Instrumentation: เวลา / จำนวนแถว / หน่วยความจำ ของแต่ละขั้นตอน
+# ---------------------------------------------------
+# - stage(): จับเวลาขั้นตอนหนึ่ง (ซ้อนกันได้) บันทึก rows in/out และ RSS ที่เปลี่ยนไป
+#   self_s = เวลาของขั้นตอนนั้นเองหลังหักขั้นตอนย่อย (เช่น section หัก SQL ออกเหลือเวลา pandas/Plotly)
+# - section(): ตั้งชื่อ section ให้ทุก stage ที่อยู่ข้างใน
+# - ทุก record ถูกส่งไปที่ logger "analytics.instrumentation" เป็น JSON (structured log)
+#   เก็บไว้ใน Trace ของ run ปัจจุบัน (ถ้ามี) และสะสมเป็นตัวเลขรวมระดับ process สำหรับ Prometheus
+#
+# หมายเหตุ: RSS เป็นของทั้ง process ถ้ามีหลาย session ทำงานพร้อมกัน memory delta จะรวมของ session อื่นด้วย
+
+logger = logging.getLogger("analytics.instrumentation")
+
+_section = contextvars.ContextVar("instrumentation_section", default=None)
+_trace = contextvars.ContextVar("instrumentation_trace", default=None)
+_parent = contextvars.ContextVar("instrumentation_parent", default=None)
+
+_totals_lock = threading.Lock()
+_totals = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "rows_out": 0, "memory_delta_bytes": 0})
+
+
+def rss_bytes() -> int:
+    """
+    RSS ปัจจุบันของ process (Linux อ่านจาก /proc, ระบบอื่นใช้ peak RSS แทน)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Trace:
+    """
+    record ทั้งหมดของการรันหน้าเว็บหนึ่งครั้ง
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.records = []
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records)
+
+    def to_json_lines(self) -> str:
+        return "".join(json.dumps(record, default=str) + "\n" for record in self.records)
+
+
+def start_trace(name: str) -> Trace:
+    """
+    เริ่ม Trace ใหม่ให้การรันปัจจุบัน (record ของ stage หลังจากนี้จะถูกเก็บลงใน Trace นี้)
+    stage ที่ไม่ได้อยู่ใน section ใดจะใช้ชื่อ trace เป็นชื่อ section
+    """
+    trace = Trace(name)
+    _trace.set(trace)
+    _section.set(name)
+    return trace
+
+
+@contextmanager
+def trace_scope(name: str):
+    """
+    ใช้ Trace ใหม่เฉพาะภายใน block แล้วคืน Trace เดิม
+    (เช่น rerun เฉพาะ fragment ของ Streamlit: record ไม่ปนกับ Trace ของการรันทั้งหน้าครั้งก่อน)
+    """
+    trace = Trace(name)
+    trace_token = _trace.set(trace)
+    section_token = _section.set(name)
+    try:
+        yield trace
+    finally:
+        _section.reset(section_token)
+        _trace.reset(trace_token)
+
+
+class Stage:
+    """
+    ข้อมูลของ stage ที่กำลังจับเวลาอยู่ ผู้เรียกตั้ง rows_in / rows_out / ข้อมูลเพิ่มเติม (extra) ได้
+    """
+
+    def __init__(self, section: str | None, name: str, rows_in: int | None):
+        self.section = section
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.extra = {}
+        self.child_seconds = 0.0
+
+
+@contextmanager
+def section(name: str):
+    token = _section.set(name)
+    try:
+        yield
+    finally:
+        _section.reset(token)
+
+
+@contextmanager
+def stage(name: str, rows_in: int | None = None, section_name: str | None = None):
+    """
+    จับเวลา stage หนึ่ง ใช้แบบ
+
+        with stage("pivot", rows_in=len(df)) as s:
+            out = df.pivot_table(...)
+            s.rows_out = len(out)
+    """
+    current = Stage(section_name or _section.get(), name, rows_in)
+    parent = _parent.get()
+    token = _parent.set(current)
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _parent.reset(token)
+        if parent is not None:
+            parent.child_seconds += duration
+        _emit({
+            "ts": time.time(),
+            "section": current.section,
+            "stage": name,
+            "duration_s": duration,
+            "self_s": max(duration - current.child_seconds, 0.0),
+            "rows_in": current.rows_in,
+            "rows_out": current.rows_out,
+            "memory_delta_bytes": rss_bytes() - rss_before,
+            "error": error,
+            **current.extra,
+        })
+
+
+def timed(name: str | None = None):
+    """
+    decorator: จับเวลาทั้งฟังก์ชันเป็น stage เดียว (ชื่อ stage = ชื่อฟังก์ชัน)
+    ถ้าผลลัพธ์เป็น DataFrame จะบันทึกจำนวนแถวเป็น rows_out
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name or fn.__name__) as s:
+                result = fn(*args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    s.rows_out = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def timed_section(name: str):
+    """
+    decorator สำหรับฟังก์ชันที่ render ทั้ง section: ตั้งชื่อ section และจับเวลารวมเป็น stage "section"
+    self_s ของ stage นี้คือเวลาที่ไม่ได้อยู่ใน stage ย่อย (pandas post-processing, Plotly, Streamlit)
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with section(name), stage("section"):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _emit(record: dict) -> None:
+    trace = _trace.get()
+    if trace is not None:
+        trace.records.append(record)
+    with _totals_lock:
+        totals = _totals[(record["section"] or "", record["stage"])]
+        totals["calls"] += 1
+        totals["seconds"] += record["duration_s"]
+        totals["rows_out"] += record["rows_out"] or 0
+        totals["memory_delta_bytes"] += record["memory_delta_bytes"]
+    logger.info(json.dumps(record, default=str))
+
+
+# ---------- Export ----------
+def totals() -> pd.DataFrame:
+    """
+    ตัวเลขสะสมระดับ process ต่อ (section, stage)
+    """
+    with _totals_lock:
+        rows = [{"section": s, "stage": n, **values} for (s, n), values in _totals.items()]
+    return pd.DataFrame(rows, columns=["section", "stage", "calls", "seconds", "rows_out", "memory_delta_bytes"])
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(prefix: str = "retail_dashboard") -> str:
+    """
+    ตัวเลขสะสมในรูปแบบ Prometheus text exposition format
+    """
+    metrics = [
+        ("stage_calls_total", "counter", "calls", "Number of times the stage ran"),
+        ("stage_seconds_total", "counter", "seconds", "Total wall time spent in the stage"),
+        ("stage_rows_out_total", "counter", "rows_out", "Total rows produced by the stage"),
+        ("stage_memory_delta_bytes", "gauge", "memory_delta_bytes", "Sum of RSS changes across stage runs"),
+    ]
+    with _totals_lock:
+        items = sorted(_totals.items())
+    lines = []
+    for metric, metric_type, field, help_text in metrics:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {metric_type}")
+        for (section_name, stage_name), values in items:
+            labels = f'section="{_label(section_name)}",stage="{_label(stage_name)}"'
+            lines.append(f"{prefix}_{metric}{{{labels}}} {values[field]}")
+    return "\n".join(lines) + "\n"
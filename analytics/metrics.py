@@ -0,0 +1,575 @@
+from typing import TypedDict
+
+import pandas as pd
+
+from .baskets import ASSOCIATIONS_TABLE, MIN_PAIR_INVOICES, TOP_ASSOCIATIONS
+from .bitmaps import empty_bitmap_sql
+from .categories import DIM_PRODUCT_TABLE, OTHER_CATEGORY
+from .cleaning import CLEANING_RULES, ROW_STATUS_TYPE, STATUS_TABLES
+from .cube import (
+    BASKET_ITEMS_TABLE,
+    BASKET_PAIRS_TABLE,
+    CLEANING_STATS_TABLE,
+    CUBE_TABLE,
+    CUSTOMER_BITMAP_TABLE,
+    CUSTOMER_FEATURES_TABLE,
+    CUSTOMER_MONTHS_TABLE,
+    CUSTOMER_SKETCH_TABLE,
+    INVOICE_TOTALS_TABLE,
+    STOCK_TOTALS_TABLE,
+)
+from .dimensions import DIM_COUNTRY_TABLE
+from .engine import AnalyticsEngine
+from .filters import NO_FILTERS, Filters
+from .instrumentation import timed
+from .sketches import estimate_sql
+
+# ---------------------------------------------------
+# Headless analytics (ไม่พึ่ง Streamlit)
+# ---------------------------------------------------
+# ทุกฟังก์ชันรับ engine แล้วคืน DataFrame / dict ของตัวเลขที่หน้า dashboard ใช้
+# หน้าเว็บจึงเหลือแค่ส่วนแสดงผล และ batch job / API / benchmark เรียกใช้ตัวเลขชุดเดียวกันได้
+# ฟังก์ชันที่ query engine ถูกจับเวลาเป็น stage (ชื่อเดียวกับฟังก์ชัน) ผ่าน analytics.instrumentation
+# filters (analytics.filters) ถูกต่อเข้า WHERE ของ SQL ทุกตัว ผลของแต่ละชุดตัวกรองจึงถูก cache แยกกัน
+
+PARETO_CUTOFF = 80.0
+
+
+# ---------- Filter options ----------
+@timed()
+def filter_options(engine: AnalyticsEngine) -> dict:
+    """
+    ค่าที่เลือกได้ในตัวกรอง: months (YYYY-MM เรียงตามเวลา), countries, regions
+    """
+    options = {}
+    for name, column in (("months", "YearMonth"), ("countries", "Country"), ("regions", "Region")):
+        options[name] = engine.query(f"""
+            SELECT DISTINCT {column} AS value
+            FROM {CUBE_TABLE}
+            WHERE {column} IS NOT NULL
+            ORDER BY value
+        """)["value"].tolist()
+    return options
+
+
+# ---------- Data cleaning ----------
+@timed()
+def cleaning_report(engine: AnalyticsEngine, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    จำนวนแถวของแต่ละ RowStatus (analytics.cleaning) และจำนวนแถวที่แต่ละกฎใน CLEANING_RULES ตัดออก
+    คอลัมน์: RowStatus, table, row_count, <กฎใน CLEANING_RULES ...> (เรียงตามลำดับของ row_status)
+    """
+    # ทุก status อยู่ในผลเสมอ (status ที่ไม่มีแถวตามตัวกรองได้ 0)
+    where, params = filters.sql("c")
+    report = engine.query(f"""
+        SELECT
+            s.RowStatus,
+            COALESCE(SUM(c.row_count), 0)::BIGINT AS row_count,
+            {", ".join(f"COALESCE(SUM(c.{rule}), 0)::BIGINT AS {rule}" for rule in CLEANING_RULES)}
+        FROM (SELECT UNNEST(enum_range(NULL::{ROW_STATUS_TYPE}))::{ROW_STATUS_TYPE} AS RowStatus) s
+        LEFT JOIN {CLEANING_STATS_TABLE} c ON c.RowStatus = s.RowStatus AND {where}
+        GROUP BY s.RowStatus
+        ORDER BY s.RowStatus
+    """, params)
+    # ENUM กลับมาเป็น Categorical ใน pandas
+    report["RowStatus"] = report["RowStatus"].astype(str)
+    report.insert(1, "table", report["RowStatus"].map(STATUS_TABLES))
+    return report
+
+
+# ---------- Country / Region ----------
+@timed()
+def country_value(engine: AnalyticsEngine, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    มูลค่าคำสั่งซื้อรวม จำนวนธุรกรรม และปริมาณรวมต่อประเทศ (ทุกแถว รวมใบเสร็จที่ยกเลิก)
+    คอลัมน์: country, value_by_country, transaction_count, total_quantity (เรียงจากมากไปน้อย)
+    """
+    where, params = filters.sql()
+    return engine.query(f"""
+        SELECT
+            Country AS country,
+            SUM(revenue) AS value_by_country,
+            SUM(line_count)::BIGINT AS transaction_count,
+            SUM(quantity)::BIGINT AS total_quantity
+        FROM {CUBE_TABLE}
+        WHERE Country IS NOT NULL AND {where}
+        GROUP BY Country
+        HAVING SUM(line_count) > 0
+        ORDER BY value_by_country DESC
+    """, params)
+
+
+@timed()
+def country_demand(engine: AnalyticsEngine, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    จำนวนใบเสร็จ (Frequency) และปริมาณ (TotalQuantity) ต่อประเทศต่อเดือน เฉพาะรายการขาย
+    คอลัมน์: Country, Month, MonthName, Frequency, TotalQuantity
+    """
+    where, params = filters.sql()
+    return engine.query(f"""
+        SELECT
+            Country,
+            Month,
+            MonthName,
+            SUM(sales_invoices)::BIGINT AS Frequency,
+            SUM(sales_quantity)::BIGINT AS TotalQuantity
+        FROM {CUBE_TABLE}
+        WHERE {where}
+        GROUP BY Country, Month, MonthName
+        HAVING SUM(sales_invoices) > 0
+        ORDER BY Country, Month
+    """, params)
+
+
+@timed()
+def top_countries(engine: AnalyticsEngine, limit: int = 15, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    ประเทศที่มีปริมาณขายรวมสูงสุด limit อันดับแรก
+    คอลัมน์: Country, Total
+    """
+    where, params = filters.sql()
+    return engine.query(f"""
+        SELECT Country, SUM(sales_quantity) AS Total
+        FROM {CUBE_TABLE}
+        WHERE {where}
+        GROUP BY Country
+        HAVING SUM(sales_invoices) > 0
+        ORDER BY Total DESC
+        LIMIT ?
+    """, [*params, limit])
+
+
+@timed()
+def region_demand(engine: AnalyticsEngine, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    เหมือน country_demand แต่รวมตามภูมิภาค
+    คอลัมน์: Region, Month, MonthName, Frequency, TotalQuantity
+    """
+    where, params = filters.sql()
+    return engine.query(f"""
+        SELECT
+            Region,
+            Month,
+            MonthName,
+            SUM(sales_invoices)::BIGINT AS Frequency,
+            SUM(sales_quantity)::BIGINT AS TotalQuantity
+        FROM {CUBE_TABLE}
+        WHERE {where}
+        GROUP BY Region, Month, MonthName
+        HAVING SUM(sales_invoices) > 0
+        ORDER BY Region, Month
+    """, params)
+
+
+# ---------- Average Order Value ----------
+@timed()
+def aov_by_country(engine: AnalyticsEngine, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    มูลค่าคำสั่งซื้อเฉลี่ยต่อใบเสร็จของแต่ละประเทศ (ปัดทศนิยม 2 ตำแหน่ง)
+    คอลัมน์: Country, Group (ทวีปจาก dim_country), AOV (เรียงจากมากไปน้อย)
+    """
+    where, params = filters.sql(alias="i")
+    aov = engine.query(f"""
+        SELECT
+            i.Country,
+            d.Continent AS "Group",
+            AVG(i.InvoiceSales) AS AOV
+        FROM {INVOICE_TOTALS_TABLE} i
+        LEFT JOIN {DIM_COUNTRY_TABLE} d ON i.Country = d.Country
+        WHERE {where}
+        GROUP BY i.Country, d.Continent
+        ORDER BY AOV DESC
+    """, params)
+    aov["AOV"] = aov["AOV"].round(2)
+    return aov
+
+
+def aov_by_continent(aov: pd.DataFrame) -> pd.DataFrame:
+    """
+    ค่าเฉลี่ยของ AOV รายประเทศในแต่ละทวีป (รับผลจาก aov_by_country)
+    คอลัมน์: Group, AOV (เรียงจากมากไปน้อย)
+    """
+    summary = aov.groupby("Group", as_index=False)["AOV"].mean()
+    return summary.sort_values(by="AOV", ascending=False)
+
+
+# ---------- KPI / Cancellation / Retention ----------
+class KPIRecord(TypedDict):
+    """
+    KPI ของ section Key Insights (1 record ต่อชุดตัวกรอง)
+    """
+    total_purchases: int                 # จำนวนใบเสร็จขาย (RowStatus = sale)
+    total_customers: int                 # จำนวนลูกค้าที่มี CustomerID (ทุกแถว)
+    customers_approximate: bool          # True = total_customers ประมาณจาก HyperLogLog (± sketches.HLL_ERROR)
+    total_quantity: int                  # ปริมาณสินค้าที่ขาย (RowStatus = sale)
+    cancel_count: int                    # จำนวนใบเสร็จที่ยกเลิก (InvoiceNo ขึ้นต้นด้วย C)
+    cancel_sum: float                    # มูลค่ารวมที่ยกเลิก (£, ปัด 2 ตำแหน่ง)
+    cancel_aov: float                    # มูลค่าเฉลี่ยต่อใบเสร็จที่ยกเลิก (£, ปัด 2 ตำแหน่ง)
+    cancel_ratio: float                  # ใบเสร็จที่ยกเลิก / ใบเสร็จทั้งหมด (%)
+    retained_customers: int              # ลูกค้าที่มีรายการขายอย่างน้อย 2 เดือน (นับแยกปี YYYYMM)
+    repeat_customers: int                # ลูกค้าที่มีใบเสร็จขายอย่างน้อย 2 ใบ
+    avg_months_active: float             # จำนวนเดือนเฉลี่ยของลูกค้ากลุ่มนี้ (0 ถ้าไม่มี)
+    max_months_active: int               # จำนวนเดือนสูงสุด (0 ถ้าไม่มี)
+    retention_buckets: dict[int, int]    # จำนวนเดือนที่ซื้อ -> จำนวนลูกค้า (เฉพาะ >= 2 เดือน)
+
+
+@timed()
+def kpi_summary(
+    engine: AnalyticsEngine, filters: Filters = NO_FILTERS, approximate: bool | None = None
+) -> KPIRecord:
+    """
+    KPI ทั้งหมดของ section Key Insights ใน query เดียว
+    อ่านจากตาราง aggregate (agg_country_month, customer_features / customer_months) ไม่ scan transactions
+    approximate: นับลูกค้าด้วย HyperLogLog sketch (None = ตามการตั้งค่าของ engine)
+    """
+    if approximate is None:
+        approximate = engine.approximate_distinct
+    where, params = filters.sql()
+    if approximate:
+        customers_sql = f"(SELECT COALESCE(ROUND(MAX(estimate)), 0)::BIGINT FROM ({estimate_sql(CUSTOMER_SKETCH_TABLE, where)}))"
+        all_params = [*params, *params]
+    else:
+        customers_sql = "COALESCE(len(list_distinct(flatten(list(customers)))), 0)"
+        all_params = [*params]
+    # ไม่มีตัวกรอง: อ่าน customer_features ที่สรุปไว้แล้ว / มีตัวกรอง: สรุปจาก customer_months ตามตัวกรอง
+    if filters.is_empty:
+        customers_cte = f"""
+            SELECT CustomerID, active_periods AS MonthsActive, invoice_count AS Invoices
+            FROM {CUSTOMER_FEATURES_TABLE}
+        """
+    else:
+        customers_cte = f"""
+            SELECT
+                CustomerID,
+                COUNT(DISTINCT Period) FILTER (WHERE sales_lines > 0) AS MonthsActive,
+                SUM(sales_invoices) AS Invoices
+            FROM {CUSTOMER_MONTHS_TABLE}
+            WHERE {where}
+            GROUP BY CustomerID
+        """
+        all_params.extend(params)
+    row = engine.query(f"""
+        WITH totals AS (
+            SELECT
+                COALESCE(SUM(sales_invoices), 0)::BIGINT AS total_purchases,
+                {customers_sql} AS total_customers,
+                COALESCE(SUM(sales_quantity), 0)::BIGINT AS total_quantity,
+                COALESCE(SUM(cancel_invoices), 0)::BIGINT AS cancel_count,
+                COALESCE(SUM(cancel_value), 0) AS cancel_value
+            FROM {CUBE_TABLE}
+            WHERE {where}
+        ),
+        customer_stats AS ({customers_cte}),
+        retention AS (
+            SELECT
+                COUNT(*) FILTER (WHERE MonthsActive >= 2) AS retained_customers,
+                COUNT(*) FILTER (WHERE Invoices >= 2) AS repeat_customers,
+                COALESCE(AVG(MonthsActive) FILTER (WHERE MonthsActive >= 2), 0) AS avg_months_active,
+                COALESCE(MAX(MonthsActive) FILTER (WHERE MonthsActive >= 2), 0) AS max_months_active,
+                COALESCE(histogram(MonthsActive) FILTER (WHERE MonthsActive >= 2), MAP {{}}) AS retention_buckets
+            FROM customer_stats
+        )
+        SELECT
+            t.total_purchases,
+            t.total_customers,
+            t.total_quantity,
+            t.cancel_count,
+            ROUND(t.cancel_value, 2) AS cancel_sum,
+            COALESCE(ROUND(t.cancel_value / NULLIF(t.cancel_count, 0), 2), 0) AS cancel_aov,
+            CASE WHEN t.total_purchases > 0
+                 THEN 100.0 * t.cancel_count / (t.total_purchases + t.cancel_count)
+                 ELSE 0 END AS cancel_ratio,
+            r.*
+        FROM totals t, retention r
+    """, all_params).iloc[0]
+    return {
+        "total_purchases": int(row["total_purchases"]),
+        "total_customers": int(row["total_customers"]),
+        "customers_approximate": approximate,
+        "total_quantity": int(row["total_quantity"]),
+        "cancel_count": int(row["cancel_count"]),
+        "cancel_sum": float(row["cancel_sum"]),
+        "cancel_aov": float(row["cancel_aov"]),
+        "cancel_ratio": float(row["cancel_ratio"]),
+        "retained_customers": int(row["retained_customers"]),
+        "repeat_customers": int(row["repeat_customers"]),
+        "avg_months_active": float(row["avg_months_active"]),
+        "max_months_active": int(row["max_months_active"]),
+        "retention_buckets": {int(k): int(v) for k, v in sorted(row["retention_buckets"].items())},
+    }
+
+
+# ---------- Cohort Retention ----------
+@timed()
+def cohort_retention(engine: AnalyticsEngine, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    ตาราง cohort x เดือน: ลูกค้าที่ซื้อครั้งแรกในเดือน Cohort (ตามตัวกรอง) ยังกลับมาซื้อในอีก MonthOffset เดือนกี่ราย
+    คำนวณจาก bitmap ของ customer_bitmaps ทั้งหมด (ไม่ self-join transactions)
+    - active ของแต่ละเดือน = bit_or ของเซลล์ที่ผ่านตัวกรอง
+    - cohort = active ของเดือนนั้น & ~ (bit_or ของทุกเดือนก่อนหน้า)
+    - จำนวนลูกค้า = bit_count(cohort & active ของเดือนถัด ๆ ไป)
+    คอลัมน์: Cohort (YYYY-MM), MonthOffset, Customers, CohortSize, RetentionPercent
+    """
+    where, params = filters.sql()
+    return engine.query(f"""
+        WITH active AS (
+            SELECT Period, chunk, bit_or(bitmap) AS bitmap
+            FROM {CUSTOMER_BITMAP_TABLE}
+            WHERE {where}
+            GROUP BY Period, chunk
+        ),
+        cohorts AS (
+            SELECT
+                Period AS Cohort,
+                chunk,
+                bitmap & ~COALESCE(
+                    bit_or(bitmap) OVER (PARTITION BY chunk ORDER BY Period ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING),
+                    {empty_bitmap_sql()}
+                ) AS bitmap
+            FROM active
+        ),
+        matrix AS (
+            SELECT
+                c.Cohort,
+                (a.Period // 100 * 12 + a.Period % 100) - (c.Cohort // 100 * 12 + c.Cohort % 100) AS MonthOffset,
+                SUM(bit_count(c.bitmap & a.bitmap))::BIGINT AS Customers
+            FROM cohorts c
+            JOIN active a ON a.chunk = c.chunk AND a.Period >= c.Cohort
+            GROUP BY c.Cohort, a.Period
+        )
+        SELECT
+            printf('%04d-%02d', Cohort // 100, Cohort % 100) AS Cohort,
+            MonthOffset,
+            Customers,
+            CohortSize,
+            100.0 * Customers / CohortSize AS RetentionPercent
+        FROM (
+            SELECT *, MAX(Customers) FILTER (WHERE MonthOffset = 0) OVER (PARTITION BY Cohort) AS CohortSize
+            FROM matrix
+        )
+        WHERE CohortSize > 0
+        ORDER BY Cohort, MonthOffset
+    """, params)
+
+
+# ---------- Pareto ----------
+def _pareto_sql(filters: Filters) -> tuple[str, list]:
+    """
+    SELECT ยอดขายต่อสินค้าพร้อมยอดสะสมด้วย window function (คำนวณใน DuckDB ทั้งหมด)
+    เรียงตาม TotalSales มากไปน้อย (เสมอกันเรียงตาม StockCode, Description) ลำดับสะสมจึงคงที่ทุกครั้ง
+    """
+    where, params = filters.sql(alias="s")
+    return f"""
+        SELECT
+            *,
+            SUM(TotalSales) OVER ranked AS CumulativeSales,
+            100 * SUM(TotalSales) OVER ranked / SUM(TotalSales) OVER () AS CumulativePercent,
+            ROW_NUMBER() OVER ranked AS ProductRank,
+            COUNT(*) OVER () AS TotalProducts
+        FROM (
+            SELECT
+                s.StockCode,
+                s.Description,
+                COALESCE(p.Category, '{OTHER_CATEGORY}') AS Category,
+                SUM(s.TotalQty) AS TotalQty,
+                SUM(s.TotalSales) AS TotalSales
+            FROM {STOCK_TOTALS_TABLE} s
+            LEFT JOIN {DIM_PRODUCT_TABLE} p
+              ON p.StockCode IS NOT DISTINCT FROM s.StockCode AND p.Description IS NOT DISTINCT FROM s.Description
+            WHERE {where}
+            GROUP BY s.StockCode, s.Description, p.Category
+        )
+        WINDOW ranked AS (ORDER BY TotalSales DESC, StockCode, Description ROWS UNBOUNDED PRECEDING)
+    """, params
+
+
+@timed()
+def stock_pareto(engine: AnalyticsEngine, filters: Filters = NO_FILTERS) -> pd.DataFrame:
+    """
+    ยอดขายต่อสินค้าเรียงจากมากไปน้อย พร้อมหมวดสินค้า (จาก dim_product) และยอดสะสม
+    คอลัมน์: StockCode, Description, Category, TotalQty, TotalSales,
+            CumulativeSales, CumulativePercent, ProductRank, TotalProducts
+    """
+    sql, params = _pareto_sql(filters)
+    return engine.query(f"{sql} ORDER BY ProductRank", params)
+
+
+@timed()
+def pareto_products(
+    engine: AnalyticsEngine,
+    filters: Filters = NO_FILTERS,
+    cutoff: float = PARETO_CUTOFF,
+) -> pd.DataFrame:
+    """
+    สินค้ากลุ่มแรกที่สร้างยอดขายสะสมไม่เกิน cutoff % (ตัดใน SQL ส่งกลับเฉพาะแถวที่ผ่าน)
+    คอลัมน์เดียวกับ stock_pareto -- TotalProducts คือจำนวนสินค้าทั้งหมดตามตัวกรอง
+    ผลถูก cache แยกตาม (filters, cutoff) เช่น Germany ไตรมาส 4 เรียกซ้ำจึงไม่ query ใหม่
+    """
+    sql, params = _pareto_sql(filters)
+    return engine.query(f"""
+        SELECT * FROM ({sql})
+        WHERE CumulativePercent <= ?
+        ORDER BY ProductRank
+    """, [*params, cutoff])
+
+
+@timed()
+def pareto_summary(engine: AnalyticsEngine, filters: Filters = NO_FILTERS, cutoff: float = PARETO_CUTOFF) -> dict:
+    """
+    ตัวเลขสรุปของกลุ่ม Pareto ใน query เดียว:
+    product_count, total_products, product_percent, pareto_sales, cumulative_percent
+    """
+    sql, params = _pareto_sql(filters)
+    row = engine.query(f"""
+        SELECT
+            COUNT(*) FILTER (WHERE CumulativePercent <= ?) AS product_count,
+            COUNT(*) AS total_products,
+            COALESCE(SUM(TotalSales) FILTER (WHERE CumulativePercent <= ?), 0) AS pareto_sales,
+            COALESCE(MAX(CumulativePercent) FILTER (WHERE CumulativePercent <= ?), 0) AS cumulative_percent
+        FROM ({sql})
+    """, [cutoff, cutoff, cutoff, *params]).iloc[0]
+    total_products = int(row["total_products"])
+    return {
+        "product_count": int(row["product_count"]),
+        "total_products": total_products,
+        "product_percent": 100 * int(row["product_count"]) / total_products if total_products else 0.0,
+        "pareto_sales": float(row["pareto_sales"]),
+        "cumulative_percent": float(row["cumulative_percent"]),
+    }
+
+
+@timed()
+def category_summary(engine: AnalyticsEngine, products: pd.DataFrame) -> pd.DataFrame:
+    """
+    ยอดขายและปริมาณรวมตามหมวดสินค้า ของสินค้าที่ส่งเข้ามา (ผลของ stock_pareto ทั้งหมด หรือ pareto_products)
+    คอลัมน์: Category, TotalSales, ProductCount, SalesPercent, ProductPercent
+    เรียงตาม SalesPercent โดยให้ "อื่นๆ" อยู่ท้ายสุด
+    """
+    summary = engine.query("""
+        SELECT
+            Category,
+            SUM(TotalSales) AS TotalSales,
+            SUM(TotalQty) AS ProductCount
+        FROM products
+        GROUP BY Category
+    """, frames={"products": products})
+
+    summary["SalesPercent"] = 100 * summary["TotalSales"] / summary["TotalSales"].sum()
+    summary["ProductPercent"] = 100 * summary["ProductCount"] / summary["ProductCount"].sum()
+    summary["is_other"] = (summary["Category"] == OTHER_CATEGORY).astype(int)
+    return summary.sort_values(
+        by=["is_other", "SalesPercent"],
+        ascending=[True, False]
+    ).drop(columns="is_other").reset_index(drop=True)
+
+
+# ---------- Market Basket ----------
+# product_associations (analytics.baskets) คำนวณไว้ล่วงหน้าเฉพาะทุกเดือน x (ทุกประเทศ / ทีละประเทศ)
+# ตัวกรองอื่น (ช่วงเดือน / ภูมิภาค / หลายประเทศ) คำนวณกฎจาก basket_items / basket_pairs ที่กรองแล้ว ตอน query
+
+
+def _uses_association_index(filters: Filters) -> bool:
+    return not (filters.start_month or filters.end_month or filters.regions or len(filters.countries) > 1)
+
+
+@timed()
+def basket_products(engine: AnalyticsEngine, filters: Filters = NO_FILTERS, limit: int = 200) -> pd.DataFrame:
+    """
+    สินค้าที่มีสินค้าซื้อด้วยกันตามตัวกรอง เรียงตามจำนวนใบเสร็จที่มีสินค้านั้น (ใช้เป็นตัวเลือกของหน้าเว็บ)
+    คอลัมน์: StockCode, Description, invoices
+    """
+    item_where, params = filters.sql(alias="i")
+    if _uses_association_index(filters):
+        antecedents = f"SELECT antecedent FROM {ASSOCIATIONS_TABLE} WHERE Country IS NOT DISTINCT FROM ?"
+        antecedent_params = [filters.countries[0] if filters.countries else None]
+    else:
+        where, antecedent_params = filters.sql()
+        antecedents = f"""
+            SELECT UNNEST([item_a, item_b])
+            FROM {BASKET_PAIRS_TABLE}
+            WHERE {where}
+            GROUP BY item_a, item_b
+            HAVING SUM(invoices) >= {MIN_PAIR_INVOICES}
+        """
+    return engine.query(f"""
+        SELECT
+            i.StockCode,
+            (SELECT MIN(Description) FROM {DIM_PRODUCT_TABLE} p WHERE p.StockCode = i.StockCode) AS Description,
+            SUM(i.invoices)::BIGINT AS invoices
+        FROM {BASKET_ITEMS_TABLE} i
+        WHERE {item_where}
+          AND i.StockCode IN ({antecedents})
+        GROUP BY i.StockCode
+        ORDER BY invoices DESC, i.StockCode
+        LIMIT ?
+    """, [*params, *antecedent_params, limit])
+
+
+@timed()
+def frequently_bought_together(
+    engine: AnalyticsEngine, stock_code: str, filters: Filters = NO_FILTERS
+) -> pd.DataFrame:
+    """
+    สินค้าที่มักซื้อพร้อม stock_code ตามตัวกรอง (สูงสุด TOP_ASSOCIATIONS อันดับ เรียงตาม confidence)
+    คอลัมน์: StockCode, Description, Category, pair_invoices, support, confidence, lift
+    """
+    if _uses_association_index(filters):
+        rules = f"""
+            SELECT consequent, pair_invoices, support, confidence, lift, rank
+            FROM {ASSOCIATIONS_TABLE}
+            WHERE antecedent = ? AND Country IS NOT DISTINCT FROM ?
+        """
+        params = [stock_code, filters.countries[0] if filters.countries else None]
+    else:
+        # เหมือน analytics.baskets.build_associations แต่เฉพาะ antecedent ตัวเดียว บนเซลล์ที่ผ่านตัวกรอง
+        where, where_params = filters.sql()
+        rules = f"""
+            WITH baskets AS (
+                SELECT SUM(sales_invoices) AS baskets FROM {CUBE_TABLE} WHERE {where}
+            ),
+            items AS (
+                SELECT StockCode, SUM(invoices) AS invoices
+                FROM {BASKET_ITEMS_TABLE}
+                WHERE {where}
+                GROUP BY StockCode
+            ),
+            pairs AS (
+                SELECT
+                    CASE WHEN item_a = ? THEN item_b ELSE item_a END AS consequent,
+                    SUM(invoices) AS invoices
+                FROM {BASKET_PAIRS_TABLE}
+                WHERE (item_a = ? OR item_b = ?) AND {where}
+                GROUP BY consequent
+                HAVING SUM(invoices) >= {MIN_PAIR_INVOICES}
+            )
+            SELECT
+                r.consequent,
+                r.invoices::BIGINT AS pair_invoices,
+                r.invoices / b.baskets AS support,
+                r.invoices / a.invoices AS confidence,
+                (r.invoices / a.invoices) / (c.invoices / b.baskets) AS lift,
+                ROW_NUMBER() OVER (ORDER BY confidence DESC, lift DESC, r.consequent) AS rank
+            FROM pairs r
+            CROSS JOIN baskets b
+            JOIN items a ON a.StockCode = ?
+            JOIN items c ON c.StockCode = r.consequent
+            QUALIFY rank <= {TOP_ASSOCIATIONS}
+        """
+        params = [*where_params, *where_params, stock_code, stock_code, stock_code, *where_params, stock_code]
+    return engine.query(f"""
+        SELECT
+            r.consequent AS StockCode,
+            p.Description,
+            p.Category,
+            r.pair_invoices,
+            r.support,
+            r.confidence,
+            r.lift
+        FROM ({rules}) r
+        LEFT JOIN (
+            SELECT StockCode, MIN(Description) AS Description, MIN(Category) AS Category
+            FROM {DIM_PRODUCT_TABLE}
+            GROUP BY StockCode
+        ) p ON p.StockCode = r.consequent
+        ORDER BY r.rank
+    """, params)
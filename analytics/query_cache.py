@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# ---------------------------------------------------
+# Query result cache (อยู่หน้า DuckDB engine)
+# ---------------------------------------------------
+# key = (SQL ที่ normalize แล้ว, parameters, snapshot version)
+# ทุก session / ทุกหน้าใช้ cache เดียวกันผ่าน engine ระดับ process
+# เมื่อ snapshot เปลี่ยน version key เดิมจะไม่ถูกใช้อีก (engine ล้าง cache ให้ตอน sync)
+
+MAX_ENTRIES = int(os.environ.get("RETAIL_QUERY_CACHE_ENTRIES", "256"))
+MAX_BYTES = int(os.environ.get("RETAIL_QUERY_CACHE_MB", "256")) * 1024 ** 2
+
+# string literal ('...') หรือช่องว่างต่อเนื่อง
+_SQL_TOKEN = re.compile(r"('(?:[^']|'')*')|\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    ยุบช่องว่าง/ขึ้นบรรทัดใหม่ให้เหลือช่องว่างเดียว (ไม่แตะข้อความใน '...') และตัด ; ท้ายคำสั่ง
+    SQL ที่ต่างกันแค่การจัดรูปแบบจึงได้ key เดียวกัน
+    """
+    normalized = _SQL_TOKEN.sub(lambda m: m.group(1) or " ", sql).strip()
+    return normalized.rstrip(";").rstrip()
+
+
+def cache_key(sql: str, params, version) -> str:
+    return json.dumps([normalize_sql(sql), params, version], default=str)
+
+
+class QueryCache:
+    """
+    LRU cache ของผล query (DataFrame) จำกัดทั้งจำนวนรายการและขนาดรวม
+    คืนสำเนาเสมอ ผู้เรียกจึงแก้ DataFrame ที่ได้ไปได้โดยไม่กระทบ cache
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (DataFrame, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[0].copy()
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        df = df.copy()
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
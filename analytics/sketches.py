@@ -0,0 +1,60 @@
+import math
+import os
+
+# ---------------------------------------------------
+# HyperLogLog sketch สำหรับนับค่าที่ไม่ซ้ำแบบประมาณ (เช่น จำนวนลูกค้า)
+# ---------------------------------------------------
+# sketch ของแต่ละเซลล์ (Country x YearMonth) เก็บเป็นแถว (register, rank) ในตาราง aggregate
+# - merge หลายเซลล์ / หลาย partition = MAX(rank) ต่อ register (จึงอัปเดตแบบ incremental ได้)
+# - ประมาณค่าจาก register ที่ merge แล้วด้วยสูตร HyperLogLog (ใช้ linear counting เมื่อค่าน้อย)
+# ความคลาดเคลื่อนมาตรฐาน (relative standard error) = 1.04 / sqrt(จำนวน register)
+#
+# จำนวนใบเสร็จไม่ต้องใช้ sketch: รวมจากแต่ละเซลล์ได้ตรง ๆ (ดูหมายเหตุใน analytics.cube)
+
+HLL_PRECISION = int(os.environ.get("RETAIL_HLL_PRECISION", "12"))
+HLL_REGISTERS = 2 ** HLL_PRECISION
+HLL_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+
+
+def register_sql(column: str) -> str:
+    """
+    register ของค่าใน column (p bit ล่างของ hash)
+    """
+    return f"(hash({column}) & {HLL_REGISTERS - 1})::SMALLINT"
+
+
+def rank_sql(column: str) -> str:
+    """
+    rank ของค่าใน column = ตำแหน่งของบิต 1 ตัวแรกในส่วนที่เหลือของ hash (นับจากซ้าย)
+    """
+    rest = f"(hash({column}) >> {HLL_PRECISION})"
+    return f"""(CASE WHEN {rest} = 0 THEN {64 - HLL_PRECISION + 1}
+                ELSE bit_position('1'::BIT, {rest}::BIGINT::BIT) - {HLL_PRECISION} END)::TINYINT"""
+
+
+def estimate_sql(table: str, where: str = "TRUE", group_by: tuple[str, ...] = ()) -> str:
+    """
+    SELECT ที่ merge sketch ใน table (คอลัมน์ register, rank) ตาม where แล้วประมาณจำนวนค่าที่ไม่ซ้ำ
+    คืนคอลัมน์ group_by ตามด้วย estimate (ถ้าไม่มีแถวเลยจะไม่คืนแถว)
+    """
+    groups = "".join(f"{col}, " for col in group_by)
+    m = HLL_REGISTERS
+    return f"""
+        SELECT
+            {groups}
+            CASE WHEN raw <= {2.5 * m} AND zeros > 0 THEN {m} * ln({m} / zeros) ELSE raw END AS estimate
+        FROM (
+            SELECT
+                {groups}
+                {_ALPHA * m * m} / (SUM(pow(2, -rank)) + {m} - COUNT(*)) AS raw,
+                {m} - COUNT(*) AS zeros
+            FROM (
+                SELECT {groups}register, MAX(rank) AS rank
+                FROM {table}
+                WHERE {where}
+                GROUP BY {groups}register
+            )
+            {f"GROUP BY {', '.join(group_by)}" if group_by else ""}
+        )
+    """
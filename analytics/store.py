@@ -0,0 +1,343 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .dimensions import DEFAULT_REGION, country_dimension
+
+# ---------------------------------------------------
+# แหล่งข้อมูลต้นทาง (Google Sheets export เป็น CSV)
+# ---------------------------------------------------
+SOURCE_URL = os.environ.get(
+    "RETAIL_SOURCE_URL",
+    "https://docs.google.com/spreadsheets/d/12vD8wGU1HvXxpdFowsO7pgcXucI30Ei-gN2hRZEkL6s/export?format=csv",
+)
+
+# ตำแหน่ง snapshot ที่ทุก worker ใช้ร่วมกัน (Hive-partitioned Parquet ตามเดือนและภูมิภาค):
+#   data/online_retail/year_month=2011-01/region=EU Countries/part-00000.parquet   <- full ingest
+#   data/online_retail/year_month=2011-12/region=EU Countries/part-00001.parquet   <- incremental append
+#   data/online_retail/_manifest.json   <- version, watermark, รายชื่อ part และไฟล์ของแต่ละ part
+#   data/online_retail.lock             <- file lock ของการ ingest (กันหลาย process เขียนพร้อมกัน)
+#
+# reader (snapshot_files + parquet_scan) อ่านทุกไฟล์ของ snapshot (หรือเฉพาะ part ที่ append เข้ามาใหม่)
+# ภายในไฟล์เรียงตาม Country แล้ว InvoiceDate และเขียน row-group statistics (min/max)
+# DuckDB จึงข้าม row group ที่ไม่ตรงกับตัวกรองของ query ได้จาก statistics
+SNAPSHOT_DIR = Path(
+    os.environ.get("RETAIL_SNAPSHOT_DIR", Path(__file__).resolve().parent.parent / "data")
+)
+SNAPSHOT_NAME = "online_retail"
+MANIFEST_FILE = "_manifest.json"
+LAYOUT = "hive:year_month/region"
+ROW_GROUP_SIZE = 128 * 1024
+
+SOURCE_DTYPES = {
+    "InvoiceNo": "string",
+    "StockCode": "string",
+    "Description": "string",
+    "Quantity": "int64",
+    "InvoiceDate": "string",
+    "UnitPrice": "float64",
+    "CustomerID": "float64",
+    "Country": "string",
+}
+
+# ---------------------------------------------------
+# Compact schema ของตาราง transaction (บังคับใช้ทุกครั้งที่ ingest)
+# ---------------------------------------------------
+# - ข้อความที่ค่าซ้ำเยอะ -> categorical (dictionary-encoded)
+# - Quantity int32, Month int16, CustomerID nullable Int32, UnitPrice float32
+_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ("InvoiceNo", _CATEGORY),
+    ("StockCode", _CATEGORY),
+    ("Description", _CATEGORY),
+    ("Quantity", pa.int32()),
+    ("InvoiceDate", pa.timestamp("us")),
+    ("UnitPrice", pa.float32()),
+    ("CustomerID", pa.int32()),
+    ("Country", _CATEGORY),
+    ("YearMonth", _CATEGORY),
+    ("Month", pa.int16()),
+    ("MonthName", _CATEGORY),
+])
+PANDAS_DTYPES = {
+    "InvoiceNo": "category",
+    "StockCode": "category",
+    "Description": "category",
+    "Quantity": "int32",
+    "UnitPrice": "float32",
+    "CustomerID": "Int32",
+    "Country": "category",
+    "YearMonth": "category",
+    "Month": "int16",
+    "MonthName": "category",
+}
+
+LOCK_FILE = f"{SNAPSHOT_NAME}.lock"
+
+_thread_lock = threading.Lock()
+
+
+def snapshot_dir() -> Path:
+    return SNAPSHOT_DIR / SNAPSHOT_NAME
+
+
+@contextmanager
+def _ingest_lock():
+    """
+    ให้เขียน snapshot ได้ทีละราย ทั้งระหว่าง thread (threading.Lock) และระหว่าง process / worker (flock)
+    ไฟล์ lock อยู่ข้างโฟลเดอร์ snapshot ไม่ใช่ข้างใน เพราะ write_snapshot สลับทั้งโฟลเดอร์
+    """
+    with _thread_lock:
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        with open(SNAPSHOT_DIR / LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def fetch_source(url: str = SOURCE_URL, skip_rows: int = 0) -> pd.DataFrame:
+    """
+    ดาวน์โหลดข้อมูลดิบจาก Google Sheets (ใช้เฉพาะตอน ingest / refresh เท่านั้น)
+    skip_rows: จำนวนแถวข้อมูลที่ ingest ไปแล้ว (ข้ามโดยไม่ต้อง parse)
+    """
+    skiprows = range(1, skip_rows + 1) if skip_rows else None
+    return pd.read_csv(url, dtype=SOURCE_DTYPES, skiprows=skiprows)
+
+
+def prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    แปลงชนิดข้อมูลและเพิ่ม column วันที่ที่ทุกหน้าใช้ (YearMonth, Month, MonthName)
+    """
+    df = df.copy()
+    df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"]).astype("datetime64[us]")
+    df["YearMonth"] = df["InvoiceDate"].dt.to_period("M").astype(str)
+    df["Month"] = df["InvoiceDate"].dt.month
+    df["MonthName"] = df["InvoiceDate"].dt.strftime("%b")
+    return apply_schema(df)
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    แปลง DataFrame ให้เป็น compact schema (ลดหน่วยความจำต่อ worker)
+    """
+    return df[SCHEMA.names].astype(PANDAS_DTYPES)
+
+
+# ---------------------------------------------------
+# Watermark (InvoiceDate, InvoiceNo) ของแถวล่าสุดที่ ingest แล้ว
+# ---------------------------------------------------
+def compute_watermark(df: pd.DataFrame, previous: dict | None = None) -> dict | None:
+    if len(df) == 0:
+        return previous
+    last_date = df["InvoiceDate"].max()
+    last_invoice = df.loc[df["InvoiceDate"] == last_date, "InvoiceNo"].astype("string").max()
+    return {"InvoiceDate": last_date.isoformat(), "InvoiceNo": str(last_invoice)}
+
+
+def after_watermark(df: pd.DataFrame, watermark: dict | None) -> pd.DataFrame:
+    """
+    ตัดแถวที่เก่ากว่า watermark ทิ้ง (เทียบ InvoiceDate ก่อน แล้วจึงเทียบ InvoiceNo)
+    แถวของใบเสร็จเดียวกับ watermark ยังเก็บไว้ เพราะใบเสร็จหนึ่งอาจถูกเขียนลงชีตคร่อมสองรอบ
+    """
+    if not watermark or len(df) == 0:
+        return df
+    last_date = pd.Timestamp(watermark["InvoiceDate"])
+    newer = (df["InvoiceDate"] > last_date) | (
+        (df["InvoiceDate"] == last_date) & (df["InvoiceNo"].astype("string") >= watermark["InvoiceNo"])
+    )
+    return df[newer.fillna(False)]
+
+
+# ---------------------------------------------------
+# Manifest / part files
+# ---------------------------------------------------
+def _new_version(rows: int) -> str:
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{rows}"
+
+
+def _write_manifest(directory: Path, manifest: dict) -> None:
+    # เขียนไฟล์ชั่วคราวให้ครบ (fsync) แล้วค่อย rename ทับ: reader เห็นแค่ manifest เก่าหรือใหม่ทั้งไฟล์
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, directory / MANIFEST_FILE)
+
+
+def _regions(countries: pd.Series) -> pd.Series:
+    region_by_country = country_dimension().set_index("Country")["Region"]
+    return countries.astype("string").map(region_by_country).fillna(DEFAULT_REGION)
+
+
+def _write_part(df: pd.DataFrame, directory: Path, name: str) -> list[str]:
+    """
+    เขียน part หนึ่งแยกเป็นไฟล์ละ (year_month, region) คืน path ของไฟล์ (relative กับ directory)
+    """
+    files = []
+    keys = [df["YearMonth"].astype("string").fillna("unknown"), _regions(df["Country"])]
+    for (year_month, region), group in df.groupby(keys, sort=True, dropna=False, observed=True):
+        relative = f"year_month={year_month}/region={region}/{name}.parquet"
+        path = directory / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        group = group.sort_values(["Country", "InvoiceDate"], kind="stable")
+        table = pa.Table.from_pandas(group, schema=SCHEMA, preserve_index=False)
+        tmp = path.with_suffix(".tmp")
+        pq.write_table(table, tmp, compression="zstd", row_group_size=ROW_GROUP_SIZE, write_statistics=True)
+        os.replace(tmp, path)
+        files.append(relative)
+    return files
+
+
+def write_snapshot(df: pd.DataFrame, source_rows: int | None = None) -> str:
+    """
+    เขียน snapshot ใหม่ทั้งชุด (full ingest) แล้วสลับเข้าแทนชุดเดิม
+    คืนค่า version ของ snapshot ที่เขียน
+    """
+    target = snapshot_dir()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=target.parent, prefix=f".{SNAPSHOT_NAME}-"))
+
+    version = _new_version(len(df))
+    files = _write_part(df, tmp_dir, "part-00000")
+    _write_manifest(tmp_dir, {
+        "version": version,
+        "base": version,
+        "layout": LAYOUT,
+        "parts": [{"name": "part-00000", "files": files, "rows": len(df)}],
+        "source_rows": len(df) if source_rows is None else source_rows,
+        "watermark": compute_watermark(df),
+    })
+
+    old_dir = target.with_name(f".{SNAPSHOT_NAME}-old-{uuid.uuid4().hex}")
+    if target.exists():
+        os.replace(target, old_dir)
+    os.replace(tmp_dir, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return version
+
+
+def read_manifest() -> dict:
+    """
+    อ่าน manifest ของ snapshot (ถ้ายังไม่มี snapshot จะ ingest จากต้นทางหนึ่งครั้ง)
+    """
+    ensure_snapshot()
+    return _read_manifest_file()
+
+
+# ---------------------------------------------------
+# Reader
+# ---------------------------------------------------
+def snapshot_files(manifest: dict | None = None, parts: set[str] | None = None) -> list[Path]:
+    """
+    ไฟล์ของ snapshot ทุก partition
+    parts: เลือกเฉพาะ part ที่ระบุชื่อ (เช่น part ที่ append เข้ามาใหม่)
+    """
+    manifest = manifest or read_manifest()
+    return [
+        snapshot_dir() / relative
+        for part in manifest["parts"]
+        if parts is None or part["name"] in parts
+        for relative in part["files"]
+    ]
+
+
+def parquet_scan(files: list[Path]) -> str:
+    """
+    read_parquet ของไฟล์ที่เลือก (คอลัมน์ partition: year_month, region มาจาก path)
+    """
+    paths = ", ".join(f"'{path.as_posix()}'" for path in files)
+    return f"""read_parquet([{paths}], hive_partitioning = true,
+                        hive_types = {{'year_month': VARCHAR, 'region': VARCHAR}},
+                        union_by_name = true, filename = true, file_row_number = true)"""
+
+
+def ensure_snapshot() -> Path:
+    """
+    คืน path ของ snapshot ถ้ายังไม่มีจะ ingest จากต้นทางหนึ่งครั้ง
+    snapshot แบบเก่า (ไฟล์เดียวไม่แบ่ง partition) จะถูกเขียนใหม่เป็น layout ปัจจุบันหนึ่งครั้ง
+    """
+    path = snapshot_dir()
+    if _current_layout() != LAYOUT:
+        with _ingest_lock():
+            layout = _current_layout()
+            if layout is None:
+                write_snapshot(prepare(fetch_source()))
+            elif layout != LAYOUT:
+                _repartition()
+    return path
+
+
+def _read_manifest_file() -> dict:
+    with open(snapshot_dir() / MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def _current_layout() -> str | None:
+    # None = ยังไม่มี snapshot, "flat" = snapshot แบบเก่าก่อนแบ่ง partition
+    if not (snapshot_dir() / MANIFEST_FILE).exists():
+        return None
+    return _read_manifest_file().get("layout", "flat")
+
+
+def _repartition() -> None:
+    manifest = _read_manifest_file()
+    tables = [pq.read_table(snapshot_dir() / part["file"], schema=SCHEMA) for part in manifest["parts"]]
+    write_snapshot(apply_schema(pa.concat_tables(tables).to_pandas()), manifest["source_rows"])
+
+
+def snapshot_version() -> str:
+    """
+    version ปัจจุบันของ snapshot (เปลี่ยนทุกครั้งที่ refresh หรือ append)
+    """
+    return read_manifest()["version"]
+
+
+# ---------------------------------------------------
+# Refresh
+# ---------------------------------------------------
+def refresh_snapshot(url: str = SOURCE_URL) -> str:
+    """
+    ดึงข้อมูลจากต้นทางใหม่ทั้งหมดแล้วเขียนทับ snapshot เดิม (explicit full refresh)
+    """
+    with _ingest_lock():
+        return write_snapshot(prepare(fetch_source(url)))
+
+
+def append_snapshot(url: str = SOURCE_URL) -> str:
+    """
+    Incremental ingest: อ่านเฉพาะแถวต่อจากที่ ingest ไปแล้ว กรองด้วย watermark
+    แล้วเขียนเป็น part ใหม่ต่อท้าย snapshot (ไม่แตะ part เดิม)
+    คืนค่า version ล่าสุด (เท่าเดิมถ้าไม่มีแถวใหม่)
+    """
+    ensure_snapshot()
+    with _ingest_lock():
+        manifest = read_manifest()
+        raw = fetch_source(url, skip_rows=manifest["source_rows"])
+        delta = after_watermark(prepare(raw), manifest["watermark"])
+        if len(delta) == 0:
+            return manifest["version"]
+
+        name = f"part-{len(manifest['parts']):05d}"
+        files = _write_part(delta, snapshot_dir(), name)
+
+        manifest["version"] = _new_version(sum(p["rows"] for p in manifest["parts"]) + len(delta))
+        manifest["parts"].append({"name": name, "files": files, "rows": len(delta)})
+        manifest["source_rows"] += len(raw)
+        manifest["watermark"] = compute_watermark(delta, manifest["watermark"])
+        _write_manifest(snapshot_dir(), manifest)
+        return manifest["version"]
+
@@ -0,0 +1,318 @@
+"""
+Benchmark ของ query และขั้นตอน post-processing ของทั้งสองหน้า (ไม่ต้องรัน Streamlit)
+
+สร้างข้อมูลจำลองรูปแบบเดียวกับ Online Retail (UCI) ที่ขนาด 1x / 10x / 100x
+แล้ววัด latency, peak RSS และ rows/sec ของแต่ละ pipeline ออกมาเป็น JSON lines
+
+    python -m benchmarks.bench_queries --scales 1 10 --repeat 3 --output bench_output.txt
+"""
+import argparse
+import json
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+from analytics import metrics, store
+from analytics.dimensions import DEFAULT_REGION, country_dimension
+from analytics.engine import MODES, AnalyticsEngine
+from analytics.filters import Filters
+
+UCI_ROWS = 541_909
+UCI_CUSTOMERS = 4_372
+UCI_PRODUCTS = 4_070
+LINES_PER_INVOICE = 21
+
+COUNTRIES = [
+    "Germany", "France", "EIRE", "Spain", "Netherlands", "Belgium", "Switzerland", "Portugal",
+    "Australia", "Norway", "Italy", "Channel Islands", "Finland", "Cyprus", "Sweden", "Unspecified",
+    "Austria", "Denmark", "Japan", "Poland", "Israel", "USA", "Hong Kong", "Singapore", "Iceland",
+    "Canada", "Greece", "Malta", "United Arab Emirates", "European Community", "RSA", "Lebanon",
+    "Lithuania", "Brazil", "Czech Republic", "Bahrain", "Saudi Arabia",
+]
+ADJECTIVES = [
+    "WHITE", "RED", "PINK", "VINTAGE", "REGENCY", "SET OF 3", "JUMBO", "SMALL", "LARGE", "HANGING",
+    "GLASS", "WOODEN", "RETRO", "PAPER", "SPOTTY", "FELTCRAFT", "ANTIQUE", "BLUE", "GREEN", "ZINC",
+]
+NOUNS = [
+    "HEART T-LIGHT HOLDER", "METAL LANTERN", "CAKESTAND", "MUG", "LUNCH BAG", "CHRISTMAS DECORATION",
+    "CANDLE", "PARTY BUNTING", "JIGSAW", "NOTEBOOK", "GARDEN PLANTER", "TEAPOT", "PHOTO FRAME",
+    "CUSHION COVER", "KEYRING", "GIFT WRAP", "DOORSTOP", "STORAGE BOX", "WATER BOTTLE", "ALARM CLOCK",
+]
+
+
+# ---------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------
+def synthesize(scale: float, directory: Path) -> dict:
+    """
+    สร้าง snapshot จำลองขนาด scale x UCI ลงใน directory (ใช้ DuckDB สร้างโดยตรง ไม่ผ่าน pandas)
+    ระยะเวลาของข้อมูลยาวขึ้นตาม sqrt(scale) เพื่อจำลองประวัติหลายปี
+    คืน manifest ในรูปแบบเดียวกับ analytics.store
+    """
+    rows = int(UCI_ROWS * scale)
+    invoices = max(rows // LINES_PER_INVOICE, 1)
+    customers = int(UCI_CUSTOMERS * scale)
+    span_minutes = int(373 * 24 * 60 * scale ** 0.5)
+
+    con = duckdb.connect()
+    con.register("country_dimension_df", country_dimension())
+    con.execute("SELECT setseed(0.42)")
+    con.execute(f"""
+        COPY (
+            WITH inv AS (
+                SELECT
+                    invoice_id,
+                    random() < 0.017 AS cancelled,
+                    TIMESTAMP '2010-12-01 08:00:00'
+                        + to_minutes(CAST(invoice_id * {span_minutes} // {invoices} AS BIGINT)) AS InvoiceDate,
+                    CASE WHEN random() < 0.91 THEN 'United Kingdom'
+                         ELSE $countries[1 + CAST(floor(random() * {len(COUNTRIES)}) AS INTEGER)]
+                    END AS Country,
+                    CASE WHEN random() < 0.25 THEN NULL
+                         ELSE 12346 + CAST(floor(random() * {customers}) AS INTEGER)
+                    END AS CustomerID
+                FROM range({invoices}) t(invoice_id)
+            ),
+            lines AS (
+                SELECT
+                    i // {LINES_PER_INVOICE} AS invoice_id,
+                    CAST(floor({UCI_PRODUCTS} * pow(random(), 3)) AS INTEGER) AS product_id,
+                    1 + CAST(floor(random() * 12) AS INTEGER) AS qty,
+                    round(0.4 + pow(random(), 2) * 15, 2) AS price
+                FROM range({rows}) t(i)
+            )
+            SELECT
+                CASE WHEN inv.cancelled THEN 'C' ELSE '' END || CAST(536365 + inv.invoice_id AS VARCHAR) AS InvoiceNo,
+                CAST(10000 + product_id AS VARCHAR) AS StockCode,
+                $adjectives[1 + product_id % {len(ADJECTIVES)}] || ' '
+                    || $nouns[1 + (product_id // {len(ADJECTIVES)}) % {len(NOUNS)}] AS Description,
+                CAST(CASE WHEN inv.cancelled THEN -qty ELSE qty END AS INTEGER) AS Quantity,
+                inv.InvoiceDate,
+                CAST(price AS FLOAT) AS UnitPrice,
+                inv.CustomerID,
+                inv.Country,
+                strftime(inv.InvoiceDate, '%Y-%m') AS YearMonth,
+                CAST(month(inv.InvoiceDate) AS SMALLINT) AS Month,
+                strftime(inv.InvoiceDate, '%b') AS MonthName,
+                strftime(inv.InvoiceDate, '%Y-%m') AS year_month,
+                COALESCE(d.Region, '{DEFAULT_REGION}') AS region
+            FROM lines
+            JOIN inv USING (invoice_id)
+            LEFT JOIN country_dimension_df d ON inv.Country = d.Country
+            ORDER BY inv.Country, inv.invoice_id
+        ) TO '{directory.as_posix()}' (
+            FORMAT parquet, COMPRESSION zstd, PARTITION_BY (year_month, region),
+            FILENAME_PATTERN 'part-00000-{{i}}', ROW_GROUP_SIZE {store.ROW_GROUP_SIZE}
+        )
+        """,
+        {"countries": COUNTRIES, "adjectives": ADJECTIVES, "nouns": NOUNS},
+    )
+    con.close()
+
+    version = f"bench-{scale}x-{rows}"
+    files = sorted(path.relative_to(directory).as_posix() for path in directory.rglob("*.parquet"))
+    manifest = {
+        "version": version,
+        "base": version,
+        "layout": store.LAYOUT,
+        "parts": [{"name": "part-00000", "files": files, "rows": rows}],
+        "source_rows": rows,
+        "watermark": None,
+    }
+    (directory / store.MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+# ---------------------------------------------------
+# Pipelines (analytics.metrics + post-processing แบบเดียวกับในหน้า)
+# ---------------------------------------------------
+def country_demand(engine: AnalyticsEngine) -> int:
+    country_data = metrics.country_demand(engine)
+    top_countries = metrics.top_countries(engine, limit=15)
+    country_data[country_data["Country"].isin(top_countries["Country"])]
+    heatmap = country_data.pivot_table(index="Country", columns="Month", values="TotalQuantity", fill_value=0)
+    heatmap.loc[heatmap.sum(axis=1).nlargest(15).index]
+    return len(country_data)
+
+
+def region_demand(engine: AnalyticsEngine) -> int:
+    region_data = metrics.region_demand(engine)
+    region_data.pivot_table(index="Region", columns="Month", values="TotalQuantity", fill_value=0)
+    return len(region_data)
+
+
+def overview_country_value(engine: AnalyticsEngine) -> int:
+    country_data = metrics.country_value(engine)
+    country_data.head(10).copy()
+    country_data.iloc[10:]["value_by_country"].sum()
+    return len(country_data)
+
+
+def aov(engine: AnalyticsEngine) -> int:
+    aov_df = metrics.aov_by_country(engine)
+    metrics.aov_by_continent(aov_df)
+    return len(aov_df)
+
+
+def kpi(engine: AnalyticsEngine) -> int:
+    # KPI + cancellation + retention (section Key Insights)
+    record = metrics.kpi_summary(engine)
+    pd.DataFrame(list(record["retention_buckets"].items()), columns=["MonthsActive", "Customers"])
+    return 1
+
+
+def pareto(engine: AnalyticsEngine) -> int:
+    summary = metrics.pareto_summary(engine)
+    metrics.category_summary(engine, metrics.pareto_products(engine))
+    return summary["total_products"]
+
+
+def cohort(engine: AnalyticsEngine) -> int:
+    # Cohort Retention ทั้งหมด และเฉพาะ EU
+    metrics.cohort_retention(engine, Filters(regions=("EU Countries",)))
+    return len(metrics.cohort_retention(engine))
+
+
+def basket(engine: AnalyticsEngine) -> int:
+    # Market Basket: สินค้าที่มักซื้อด้วยกันของสินค้าขายดี 20 อันดับ (ทุกประเทศ และ 3 เดือนล่าสุดใน EU)
+    if not engine.basket_index_ready:
+        return 0
+    products = metrics.basket_products(engine, limit=20)
+    for stock_code in products["StockCode"]:
+        metrics.frequently_bought_together(engine, stock_code)
+    # ตัวกรองช่วงเดือน / ภูมิภาค: คำนวณกฎจาก basket_pairs ตอน query (ไม่ใช้ product_associations)
+    months = metrics.filter_options(engine)["months"]
+    filters = Filters(start_month=months[-3], regions=("EU Countries",))
+    for stock_code in metrics.basket_products(engine, filters, limit=20)["StockCode"]:
+        metrics.frequently_bought_together(engine, stock_code, filters)
+    return len(products)
+
+
+def last_quarter_eu(engine: AnalyticsEngine) -> int:
+    # ตัวกรองที่นักวิเคราะห์ใช้บ่อย: 3 เดือนล่าสุด เฉพาะ EU (เทียบกับ kpi + pareto แบบไม่กรอง)
+    months = metrics.filter_options(engine)["months"]
+    filters = Filters(start_month=months[-3], end_month=months[-1], regions=("EU Countries",))
+    metrics.kpi_summary(engine, filters)
+    summary = metrics.pareto_summary(engine, filters)
+    metrics.category_summary(engine, metrics.pareto_products(engine, filters))
+    return summary["total_products"]
+
+
+def pareto_country_quarter(engine: AnalyticsEngine) -> int:
+    # drill-down ของ Pareto: ประเทศเดียว ไตรมาสสุดท้าย (เช่น Germany Q4)
+    months = metrics.filter_options(engine)["months"]
+    filters = Filters(start_month=months[-3], end_month=months[-1], countries=("Germany",))
+    summary = metrics.pareto_summary(engine, filters)
+    metrics.category_summary(engine, metrics.pareto_products(engine, filters))
+    return summary["total_products"]
+
+
+PIPELINES = {
+    "overview_country_value": overview_country_value,
+    "country_demand": country_demand,
+    "region_demand": region_demand,
+    "aov": aov,
+    "kpi": kpi,
+    "pareto": pareto,
+    "pareto_country_quarter": pareto_country_quarter,
+    "cohort": cohort,
+    "basket": basket,
+    "last_quarter_eu": last_quarter_eu,
+}
+
+
+# ---------------------------------------------------
+# Runner
+# ---------------------------------------------------
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / 1024 ** 2
+
+
+def _peak_rss_mb() -> float:
+    # Linux รายงาน ru_maxrss เป็น KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(fn, repeat: int, setup=None) -> dict:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        "latency_s": statistics.median(timings),
+        "latency_min_s": min(timings),
+        "result_rows": result,
+        "rss_mb": round(_rss_mb(), 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def run(scales, repeat: int, pipelines, data_dir: Path | None = None, mode: str = "auto",
+        memory_limit: str | None = None):
+    """
+    รัน benchmark ทุก scale คืน record (dict) ทีละ pipeline
+    """
+    for scale in scales:
+        directory = Path(tempfile.mkdtemp(prefix=f"retail-bench-{scale}x-", dir=data_dir))
+        try:
+            synth_start = time.perf_counter()
+            manifest = synthesize(scale, directory)
+            rows = manifest["parts"][0]["rows"]
+            yield {"scale": scale, "pipeline": "synthesize", "rows": rows,
+                   "latency_s": time.perf_counter() - synth_start}
+
+            store.SNAPSHOT_DIR = directory.parent
+            store.SNAPSHOT_NAME = directory.name
+            engine = AnalyticsEngine(mode=mode, memory_limit=memory_limit)
+            record = _measure(lambda: engine.sync(manifest) or rows, 1)
+            yield {"scale": scale, "pipeline": "engine_load", "rows": rows, "out_of_core": engine.out_of_core,
+                   "rows_per_s": rows / record["latency_s"], **record}
+
+            # cold = ล้าง query cache ก่อนทุกรอบ (รัน SQL จริง), warm = ผลมาจาก query cache
+            for name in pipelines:
+                for cache, setup in (("cold", engine.query_cache.clear), ("warm", None)):
+                    record = _measure(lambda: PIPELINES[name](engine), repeat, setup)
+                    yield {"scale": scale, "pipeline": name, "cache": cache, "rows": rows,
+                           "rows_per_s": rows / record["latency_s"], **record}
+            del engine
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10], help="ขนาดข้อมูลเทียบกับ UCI (เช่น 1 10 100)")
+    parser.add_argument("--repeat", type=int, default=3, help="จำนวนรอบต่อ pipeline (รายงานค่า median)")
+    parser.add_argument("--pipelines", nargs="+", choices=sorted(PIPELINES), default=list(PIPELINES))
+    parser.add_argument("--mode", choices=MODES, default="auto", help="โหมดของ engine (in-memory / out-of-core)")
+    parser.add_argument("--memory-limit", default=None, help="memory_limit ของ DuckDB เช่น 1GB")
+    parser.add_argument("--data-dir", type=Path, default=None, help="โฟลเดอร์สำหรับข้อมูลจำลองชั่วคราว")
+    parser.add_argument("--output", type=Path, default=None, help="เขียน JSON lines ลงไฟล์ (ค่าเริ่มต้น: stdout)")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for record in run(args.scales, args.repeat, args.pipelines, args.data_dir, args.mode, args.memory_limit):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
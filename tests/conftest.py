@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics import store
+from analytics.engine import AnalyticsEngine
+
+# ---------------------------------------------------
+# ข้อมูลตัวอย่างขนาดเล็ก (รูปแบบเดียวกับ CSV ต้นทาง) และ engine ที่โหลดจาก snapshot ชั่วคราว
+# ---------------------------------------------------
+
+COUNTRIES = ["United Kingdom", "France", "Germany", "Japan", "Australia"]
+SOURCE_COLUMNS = ["InvoiceNo", "StockCode", "Description", "Quantity", "InvoiceDate", "UnitPrice", "CustomerID", "Country"]
+
+
+def sample_transactions(invoices: int = 160, seed: int = 7) -> pd.DataFrame:
+    """
+    ใบเสร็จสุ่มช่วง ธ.ค. 2010 - มี.ค. 2011 เรียงตาม InvoiceDate เหมือนชีตต้นทาง
+    มีใบเสร็จยกเลิก (C...), รายการปรับสต็อก (Quantity <= 0), แถวที่ไม่มี CustomerID / Description
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2010-12-01 08:00")
+    rows = []
+    for i in range(invoices):
+        cancelled = rng.random() < 0.12
+        customer = float(rng.integers(12000, 12060)) if rng.random() > 0.1 else None
+        country = COUNTRIES[int(rng.integers(len(COUNTRIES)))]
+        for stock in rng.choice(40, size=int(rng.integers(1, 7)), replace=False):
+            quantity = int(rng.integers(1, 24))
+            if cancelled or rng.random() < 0.04:
+                quantity = -quantity
+            rows.append({
+                "InvoiceNo": f"C{537000 + i}" if cancelled else str(537000 + i),
+                "StockCode": f"{22000 + int(stock)}",
+                "Description": None if stock == 39 else f"PRODUCT {int(stock)}",
+                "Quantity": quantity,
+                "InvoiceDate": start + pd.Timedelta(hours=14 * i),
+                "UnitPrice": round(float(rng.uniform(0.3, 12)), 2),
+                "CustomerID": customer,
+                "Country": country,
+            })
+    return pd.DataFrame(rows, columns=SOURCE_COLUMNS)
+
+
+def write_source(df: pd.DataFrame, path) -> str:
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def load_engine(monkeypatch, directory, source: str, appends: tuple[str, ...] = ()) -> AnalyticsEngine:
+    """
+    ingest source เป็น snapshot ใน directory แล้ว sync engine (โหมด memory, เปิด basket index)
+    appends: ต้นทางที่ append ต่อทีละชุด (sync หลัง append ทุกครั้ง)
+    """
+    monkeypatch.setattr(store, "SNAPSHOT_DIR", directory)
+    store.refresh_snapshot(source)
+    engine = AnalyticsEngine(mode="memory", basket_index="on", temp_directory=str(directory))
+    engine.sync(store.read_manifest())
+    for url in appends:
+        store.append_snapshot(url)
+        engine.sync(store.read_manifest())
+    return engine
+
+
+@pytest.fixture
+def transactions() -> pd.DataFrame:
+    return sample_transactions()
@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from analytics import metrics
+from analytics.bitmaps import BITMAP_CHUNK_BITS
+from analytics.filters import NO_FILTERS, Filters
+
+from conftest import load_engine, write_source
+
+# ---------------------------------------------------
+# Cohort Retention จาก bitmap ต้องเท่ากับ groupby ของ pandas (นับลูกค้าตรง ๆ)
+# ---------------------------------------------------
+
+# CustomerID คร่อมขอบ chunk (BITMAP_CHUNK_BITS) หลายช่วง รวมบิตแรกและบิตสุดท้ายของ chunk
+BOUNDARY_CUSTOMERS = [
+    chunk * BITMAP_CHUNK_BITS + offset
+    for chunk in (1, 2, 3)
+    for offset in (-2, -1, 0, 1)
+]
+
+
+@pytest.fixture
+def source(transactions) -> pd.DataFrame:
+    ids = sorted(transactions["CustomerID"].dropna().unique())
+    mapping = {old: float(new) for old, new in zip(ids, BOUNDARY_CUSTOMERS + ids[len(BOUNDARY_CUSTOMERS):])}
+    return transactions.assign(CustomerID=transactions["CustomerID"].map(mapping))
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch, source):
+    return load_engine(monkeypatch, tmp_path / "snapshot", write_source(source, tmp_path / "full.csv"))
+
+
+def expected_cohorts(df: pd.DataFrame, filters: Filters) -> pd.DataFrame:
+    keep = ~df["InvoiceNo"].str.startswith("C") & (df["Quantity"] > 0) & df["CustomerID"].notna()
+    months = df["InvoiceDate"].dt.strftime("%Y-%m")
+    if filters.start_month:
+        keep &= months >= filters.start_month
+    if filters.end_month:
+        keep &= months <= filters.end_month
+    if filters.countries:
+        keep &= df["Country"].isin(filters.countries)
+    sales = df[keep]
+
+    period = sales["InvoiceDate"].dt.to_period("M")
+    cohort = period.groupby(sales["CustomerID"]).transform("min")
+    offset = (period.dt.year - cohort.dt.year) * 12 + (period.dt.month - cohort.dt.month)
+    expected = (
+        sales.groupby([cohort.astype(str).rename("Cohort"), offset.rename("MonthOffset")])["CustomerID"]
+        .nunique()
+        .rename("Customers")
+        .reset_index()
+    )
+    return expected.astype({"MonthOffset": "int64", "Customers": "int64"})
+
+
+@pytest.mark.parametrize("filters", [
+    NO_FILTERS,
+    Filters(start_month="2011-01", end_month="2011-02"),
+    Filters(countries=("United Kingdom", "France")),
+])
+def test_cohort_retention_matches_pandas(engine, source, filters):
+    got = metrics.cohort_retention(engine, filters)
+    got = got.loc[got["Customers"] > 0, ["Cohort", "MonthOffset", "Customers"]].reset_index(drop=True)
+
+    expected = expected_cohorts(source, filters)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(got.astype({"MonthOffset": "int64", "Customers": "int64"}), expected)
+
+
+def test_boundary_customers_land_in_separate_chunks(engine):
+    chunks = engine.query("SELECT DISTINCT chunk FROM customer_bitmaps ORDER BY chunk", cache=False)["chunk"].tolist()
+
+    assert {0, 1, 2, 3} <= set(chunks)
@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from analytics import store
+from analytics.cleaning import ADJUSTMENT, CANCELLATION, SALE, STATUS_TABLES
+from analytics.cube import CLEANING_STATS_TABLE
+
+from conftest import load_engine, write_source
+
+# ---------------------------------------------------
+# RowStatus ต้องแบ่งแถวเหมือน predicate เดิม (InvoiceNo LIKE 'C%' / Quantity > 0)
+# ---------------------------------------------------
+
+KEY_COLUMNS = ["InvoiceNo", "StockCode", "Quantity"]
+
+
+def expected_split(source: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    cancelled = source["InvoiceNo"].str.startswith("C")
+    sold = ~cancelled & (source["Quantity"] > 0)
+    return {
+        SALE: source[sold],
+        CANCELLATION: source[cancelled],
+        ADJUSTMENT: source[~cancelled & ~sold],
+    }
+
+
+def sorted_keys(df: pd.DataFrame) -> pd.DataFrame:
+    return df[KEY_COLUMNS].astype({"InvoiceNo": str, "StockCode": str, "Quantity": "int64"}).sort_values(KEY_COLUMNS).reset_index(drop=True)
+
+
+def assert_split_matches_predicates(engine, source: pd.DataFrame) -> None:
+    for status, expected in expected_split(source).items():
+        assert len(expected) > 0, status
+        actual = engine.query(f"SELECT {', '.join(KEY_COLUMNS)} FROM {STATUS_TABLES[status]}", cache=False)
+        pd.testing.assert_frame_equal(sorted_keys(actual), sorted_keys(expected), obj=status)
+
+    # cleaning_stats นับแถวต่อ status ตรงกับ predicate เดิมบนตาราง transactions
+    counts = engine.query(f"""
+        SELECT
+            COUNT(*) FILTER (WHERE InvoiceNo NOT LIKE 'C%' AND Quantity > 0) AS {SALE},
+            COUNT(*) FILTER (WHERE InvoiceNo LIKE 'C%') AS {CANCELLATION},
+            COUNT(*) FILTER (WHERE InvoiceNo NOT LIKE 'C%' AND NOT Quantity > 0) AS {ADJUSTMENT}
+        FROM transactions
+    """, cache=False).iloc[0]
+    stats = engine.query(f"""
+        SELECT RowStatus::VARCHAR AS status, SUM(row_count) AS row_count
+        FROM {CLEANING_STATS_TABLE}
+        GROUP BY status
+    """, cache=False).set_index("status")["row_count"]
+    for status in STATUS_TABLES:
+        assert stats[status] == counts[status] == len(expected_split(source)[status])
+
+
+@pytest.fixture
+def source(transactions) -> pd.DataFrame:
+    # ใบเสร็จยกเลิกที่ Quantity เป็นบวก: predicate เดิมนับเป็น cancellation ไม่ใช่ sale
+    return pd.concat(
+        [transactions, transactions.iloc[[-1]].assign(InvoiceNo="C999998", Quantity=3)],
+        ignore_index=True,
+    )
+
+
+def test_status_split_after_full_load(tmp_path, monkeypatch, source):
+    engine = load_engine(monkeypatch, tmp_path / "snapshot", write_source(source, tmp_path / "full.csv"))
+
+    assert_split_matches_predicates(engine, store.fetch_source(str(tmp_path / "full.csv")))
+
+
+def test_status_split_after_append(tmp_path, monkeypatch, source):
+    head = write_source(source.iloc[: len(source) // 2], tmp_path / "head.csv")
+    full = write_source(source, tmp_path / "full.csv")
+    engine = load_engine(monkeypatch, tmp_path / "snapshot", head, appends=(full,))
+
+    assert_split_matches_predicates(engine, store.fetch_source(full))
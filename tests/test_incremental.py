@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+
+from analytics import store
+from analytics.baskets import ASSOCIATIONS_TABLE
+from analytics.categories import DIM_PRODUCT_TABLE
+from analytics.cleaning import STATUS_TABLES
+from analytics.cube import AGGREGATES, BASKET_AGGREGATES, CUSTOMER_FEATURES_TABLE
+
+from conftest import load_engine, write_source
+
+# ---------------------------------------------------
+# append ทีละส่วน (merge_aggregates) ต้องได้ผลเท่ากับ rebuild จากข้อมูลทั้งหมด
+# ---------------------------------------------------
+
+COMPARED_TABLES = [
+    *AGGREGATES,
+    CUSTOMER_FEATURES_TABLE,
+    DIM_PRODUCT_TABLE,
+    *STATUS_TABLES.values(),
+    *BASKET_AGGREGATES,
+    ASSOCIATIONS_TABLE,
+]
+
+
+def table_rows(engine, table: str) -> pd.DataFrame:
+    # list ของ CustomerID เรียงก่อนเทียบ (ลำดับใน list ขึ้นกับลำดับที่ merge)
+    columns = engine.query(f"DESCRIBE {table}", cache=False)
+    select = ", ".join(
+        f"list_sort({name}) AS {name}" if column_type.endswith("[]") else name
+        for name, column_type in zip(columns["column_name"], columns["column_type"])
+    )
+    return engine.query(f"SELECT {select} FROM {table} ORDER BY ALL", cache=False)
+
+
+def assert_same_tables(appended, rebuilt) -> None:
+    for table in COMPARED_TABLES:
+        expected = table_rows(rebuilt, table)
+        assert len(expected) > 0, table
+        pd.testing.assert_frame_equal(table_rows(appended, table), expected, obj=table)
+
+
+def split_inside_invoice(df: pd.DataFrame) -> tuple[pd.DataFrame, int]:
+    """
+    แบ่งชุดแรกกลางใบเสร็จหนึ่ง (InvoiceNo เท่ากับ watermark อยู่ทั้งสองชุด)
+    และให้ใบเสร็จถัดไปมี InvoiceDate เดียวกับ watermark
+    """
+    invoices = df["InvoiceNo"].drop_duplicates()
+    sizes = df.groupby("InvoiceNo", sort=False).size()
+    candidates = [
+        (current, following)
+        for current, following in zip(invoices.iloc[len(invoices) // 2:], invoices.iloc[len(invoices) // 2 + 1:])
+        if sizes[current] >= 2 and not current.startswith("C") and not following.startswith("C")
+    ]
+    current, following = candidates[0]
+    df = df.copy()
+    watermark_date = df.loc[df["InvoiceNo"] == current, "InvoiceDate"].iat[0]
+    df.loc[df["InvoiceNo"] == following, "InvoiceDate"] = watermark_date
+    split = int(df.index[df["InvoiceNo"] == current][0]) + 1
+    return df, split
+
+
+@pytest.fixture
+def append_case(tmp_path, transactions):
+    """
+    (ต้นทางชุดแรก, ต้นทางทั้งหมด) โดยชุดที่ append มีสินค้าที่อยู่แต่ในใบเสร็จยกเลิก
+    """
+    df, split = split_inside_invoice(transactions)
+    cancel_only = df.iloc[[-1]].assign(
+        InvoiceNo="C999999",
+        StockCode="99999",
+        Description="CANCELLED ONLY",
+        Quantity=-2,
+        InvoiceDate=df["InvoiceDate"].max() + pd.Timedelta(hours=1),
+    )
+    df = pd.concat([df, cancel_only], ignore_index=True)
+    head = write_source(df.iloc[:split], tmp_path / "head.csv")
+    full = write_source(df, tmp_path / "full.csv")
+    return head, full
+
+
+def test_append_matches_full_rebuild(tmp_path, monkeypatch, append_case):
+    head, full = append_case
+    appended = load_engine(monkeypatch, tmp_path / "appended", head, appends=(full,))
+    rebuilt = load_engine(monkeypatch, tmp_path / "rebuilt", full)
+
+    assert len(appended.query("SELECT * FROM transactions", cache=False)) == len(pd.read_csv(full))
+    assert_same_tables(appended, rebuilt)
+
+
+def test_append_in_several_steps_matches_full_rebuild(tmp_path, monkeypatch, transactions):
+    steps = [len(transactions) // 4, len(transactions) // 2, len(transactions)]
+    sources = [write_source(transactions.iloc[:rows], tmp_path / f"rows-{rows}.csv") for rows in steps]
+    appended = load_engine(monkeypatch, tmp_path / "appended", sources[0], appends=tuple(sources[1:]))
+    rebuilt = load_engine(monkeypatch, tmp_path / "rebuilt", sources[-1])
+
+    assert_same_tables(appended, rebuilt)
+
+
+def test_append_without_new_rows_keeps_version(tmp_path, monkeypatch, transactions):
+    source = write_source(transactions, tmp_path / "full.csv")
+    engine = load_engine(monkeypatch, tmp_path / "snapshot", source)
+
+    assert store.append_snapshot(source) == engine.version
+
+
+def test_after_watermark_keeps_rows_of_the_watermark_invoice():
+    date = pd.Timestamp("2011-01-10 09:00")
+    df = pd.DataFrame({
+        "InvoiceNo": ["540001", "540000", "540002", "540003", "540002", "540004"],
+        "InvoiceDate": [date - pd.Timedelta(minutes=1), date, date, date, date, date + pd.Timedelta(minutes=1)],
+    })
+    watermark = {"InvoiceDate": date.isoformat(), "InvoiceNo": "540002"}
+
+    kept = store.after_watermark(df, watermark)
+
+    assert kept["InvoiceNo"].tolist() == ["540002", "540003", "540002", "540004"]
@@ -0,0 +1,125 @@
+import pytest
+
+from analytics import insights
+from analytics.insights import InsightCache, InsightService, RateLimitError, StubClient
+
+# ---------------------------------------------------
+# InsightCache / InsightService กับ StubClient (ไม่เรียก API จริง)
+# ---------------------------------------------------
+
+
+class FakeClock:
+    """
+    นาฬิกาที่เดินเองเฉพาะเมื่อสั่ง (ใช้แทน time.time)
+    """
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(insights.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # backoff ไม่ต้องรอจริง แค่บันทึกเวลาที่จะรอ
+    delays = []
+    monkeypatch.setattr(insights.time, "sleep", delays.append)
+    return delays
+
+
+def make_service(tmp_path, client, **cache_kwargs) -> InsightService:
+    return InsightService(client, cache=InsightCache(tmp_path / "insights.sqlite", **cache_kwargs), max_workers=2)
+
+
+def test_cache_entry_expires_after_ttl(tmp_path, clock):
+    client = StubClient(reply="insight")
+    service = make_service(tmp_path, client, ttl_seconds=60)
+
+    assert service.submit("system", "prompt", "v1").result(timeout=5) == "insight"
+    clock.advance(59)
+    assert service.submit("system", "prompt", "v1").result(timeout=5) == "insight"
+    assert len(client.calls) == 1
+
+    clock.advance(2)
+    assert service.cache.get(insights.insight_key(insights.DEFAULT_MODEL, "system", "prompt", "v1")) is None
+    assert service.submit("system", "prompt", "v1").result(timeout=5) == "insight"
+    assert len(client.calls) == 2
+
+
+def test_cache_evicts_least_recently_used(tmp_path, clock):
+    cache = InsightCache(tmp_path / "insights.sqlite", max_entries=2)
+    cache.put("a", "A")
+    clock.advance(1)
+    cache.put("b", "B")
+    clock.advance(1)
+    assert cache.get("a") == "A"  # a ถูกใช้ล่าสุด -> b เก่าที่สุด
+    clock.advance(1)
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+
+
+def test_identical_prompts_share_one_request(tmp_path):
+    client = StubClient(reply="shared", delay=0.2)
+    service = make_service(tmp_path, client)
+
+    first = service.submit("system", "prompt", "v1")
+    second = service.submit("system", "prompt", "v1")
+    other = service.submit("system", "other prompt", "v1")
+
+    assert first is second
+    assert first.result(timeout=5) == "shared"
+    other.result(timeout=5)
+    assert len(client.calls) == 2
+
+    # เสร็จแล้วได้จาก cache โดยไม่เรียก client อีก
+    assert service.submit("system", "prompt", "v1").result(timeout=5) == "shared"
+    assert len(client.calls) == 2
+
+
+def test_rate_limit_retries_with_backoff(tmp_path, sleeps):
+    client = StubClient(reply="ok", rate_limited=2)
+    service = make_service(tmp_path, client)
+
+    assert service.submit("system", "prompt", "v1").result(timeout=5) == "ok"
+    assert len(client.calls) == 3
+    assert len(sleeps) == 2
+    assert 1 <= sleeps[0] <= 1.5 and 2 <= sleeps[1] <= 2.5
+
+
+def test_rate_limit_gives_up_after_max_retries(tmp_path, sleeps):
+    client = StubClient(rate_limited=10)
+    service = InsightService(client, cache=InsightCache(tmp_path / "insights.sqlite"), max_retries=2)
+
+    future = service.submit("system", "prompt", "v1")
+    assert isinstance(future.exception(timeout=5), RateLimitError)
+    assert len(client.calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_failed_request_is_not_resubmitted_until_failure_ttl(tmp_path, clock):
+    client = StubClient(rate_limited=10)
+    service = InsightService(client, cache=InsightCache(tmp_path / "insights.sqlite"), max_retries=0, failure_ttl=60)
+
+    first = service.submit("system", "prompt", "v1")
+    assert isinstance(first.exception(timeout=5), RateLimitError)
+    clock.advance(59)
+    assert service.submit("system", "prompt", "v1") is first
+    assert len(client.calls) == 1
+
+    clock.advance(2)
+    assert isinstance(service.submit("system", "prompt", "v1").exception(timeout=5), RateLimitError)
+    assert len(client.calls) == 2
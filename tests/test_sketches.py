@@ -0,0 +1,52 @@
+import duckdb
+import pytest
+
+from analytics.sketches import HLL_ERROR, estimate_sql, rank_sql, register_sql
+
+# ---------------------------------------------------
+# HyperLogLog: merge ของหลายเซลล์ต้องเท่ากับ sketch ของทั้งชุด และคลาดเคลื่อนไม่เกินขอบเขต
+# ---------------------------------------------------
+
+CELLS = 8
+
+
+def build_sketches(con, customers: int) -> int:
+    """
+    ลูกค้า 0..customers-1 กระจายลง CELLS เซลล์ (ลูกค้าคนเดียวอยู่ได้หลายเซลล์)
+    สร้าง sketch ต่อเซลล์ (cells) และ sketch ของทั้งชุดในครั้งเดียว (whole) คืนจำนวนลูกค้าจริง
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TABLE visits AS
+        SELECT range % {customers} AS CustomerID, range % {CELLS} AS cell
+        FROM range({customers * 3})
+    """)
+    sketch = f"{register_sql('CustomerID')} AS register, MAX({rank_sql('CustomerID')}) AS rank"
+    con.execute(f"CREATE OR REPLACE TABLE cells AS SELECT cell, {sketch} FROM visits GROUP BY cell, register")
+    con.execute(f"CREATE OR REPLACE TABLE whole AS SELECT {sketch} FROM visits GROUP BY register")
+    return con.execute("SELECT COUNT(DISTINCT CustomerID) FROM visits").fetchone()[0]
+
+
+@pytest.mark.parametrize("customers", [50, 3_000, 200_000])
+def test_merged_estimate_is_within_error_bound(customers):
+    con = duckdb.connect()
+    exact = build_sketches(con, customers)
+
+    merged = con.execute(estimate_sql("cells")).fetchone()[0]
+    whole = con.execute(estimate_sql("whole")).fetchone()[0]
+
+    # MAX(rank) ต่อ register: merge ทีละเซลล์ได้ sketch เดียวกับสร้างจากทั้งชุด
+    assert merged == pytest.approx(whole)
+    # 4 เท่าของ standard error (โอกาสเกินต่ำมาก) -- ค่า hash ของ DuckDB คงที่ ผลจึงไม่สุ่มระหว่างรอบ
+    assert abs(merged - exact) <= 4 * HLL_ERROR * exact
+
+
+def test_estimate_by_group_matches_each_cell():
+    con = duckdb.connect()
+    build_sketches(con, 3_000)
+
+    grouped = dict(con.execute(estimate_sql("cells", group_by=("cell",))).fetchall())
+    exact = dict(con.execute("SELECT cell, COUNT(DISTINCT CustomerID) FROM visits GROUP BY cell").fetchall())
+
+    assert grouped.keys() == exact.keys()
+    for cell, count in exact.items():
+        assert abs(grouped[cell] - count) <= 4 * HLL_ERROR * count
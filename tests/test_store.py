@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+from analytics import store
+
+# ---------------------------------------------------
+# การเขียน snapshot จากหลาย process
+# ---------------------------------------------------
+
+# process อื่นพยายาม flock แบบไม่รอ: exit code 0 = ได้ lock, ไม่ใช่ 0 = มีคนถืออยู่
+PROBE = "import fcntl, sys; fcntl.flock(open(sys.argv[1], 'a'), fcntl.LOCK_EX | fcntl.LOCK_NB)"
+
+
+def try_lock_from_other_process(path) -> bool:
+    return subprocess.run([sys.executable, "-c", PROBE, str(path)], capture_output=True).returncode == 0
+
+
+def test_ingest_lock_excludes_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "SNAPSHOT_DIR", tmp_path)
+    lock_path = tmp_path / store.LOCK_FILE
+
+    with store._ingest_lock():
+        assert not try_lock_from_other_process(lock_path)
+    assert try_lock_from_other_process(lock_path)
+
+
+def test_manifest_is_replaced_whole(tmp_path):
+    store._write_manifest(tmp_path, {"version": "v1"})
+    store._write_manifest(tmp_path, {"version": "v2"})
+
+    assert [path.name for path in tmp_path.iterdir()] == [store.MANIFEST_FILE]
+    assert (tmp_path / store.MANIFEST_FILE).read_text().count("v2") == 1
@@ -0,0 +1,179 @@
+import functools
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from analytics import metrics
+from analytics.filters import Filters
+from analytics.insights import get_insight_service
+from analytics.instrumentation import Trace, prometheus_text, timed_section, trace_scope
+
+# ---------------------------------------------------
+# Shared Streamlit components (ใช้ร่วมกันทั้งสองหน้า)
+# ---------------------------------------------------
+
+
+def traced_fragment(section_name: str | None = None, run_every=None):
+    """
+    st.fragment ที่แยก Trace ของการ rerun เฉพาะ fragment ออกจาก Trace ของการรันทั้งหน้า
+    - รันพร้อมทั้งหน้า: record ลง Trace ของหน้า (แสดงใน timing panel ท้ายหน้า)
+    - rerun เฉพาะ fragment (รวม run_every): ใช้ Trace ใหม่ของรอบนั้น (ยังเข้า log / ตัวเลขสะสม Prometheus)
+      timing panel จึงแสดงเฉพาะ record ของการรันทั้งหน้าครั้งล่าสุด ไม่ซ้ำ section และไม่ปนหลายรอบ
+    section_name: ครอบ fn ด้วย timed_section(section_name) (จับเวลาทั้ง section)
+    """
+    def decorator(fn):
+        inner = timed_section(section_name)(fn) if section_name else fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            ctx = get_script_run_ctx()
+            if ctx is not None and ctx.fragment_ids_this_run:
+                with trace_scope(f"fragment:{section_name or fn.__name__}"):
+                    return inner(*args, **kwargs)
+            return inner(*args, **kwargs)
+
+        return st.fragment(wrapper, run_every=run_every)
+    return decorator
+
+
+def render_filters(engine) -> Filters:
+    """
+    ตัวกรองในแถบข้าง (ช่วงเดือน / ภูมิภาค / ประเทศ) ใช้ key เดียวกันทั้งสองหน้า
+    ถ้าเลือกช่วงเดือนเต็มช่วงจะไม่ส่งเงื่อนไขวันที่ (ใช้ cache ชุดเดียวกับแบบไม่กรอง)
+    """
+    options = metrics.filter_options(engine)
+    months = options["months"]
+    with st.sidebar:
+        st.subheader("🔎 ตัวกรอง")
+        if len(months) > 1:
+            start, end = st.select_slider("ช่วงเดือน", options=months, value=(months[0], months[-1]), key="filter_months")
+        else:
+            start, end = months[0] if months else None, months[-1] if months else None
+        regions = st.multiselect("ภูมิภาค", options["regions"], key="filter_regions")
+        countries = st.multiselect("ประเทศ", options["countries"], key="filter_countries")
+
+    return Filters(
+        start_month=start if months and start != months[0] else None,
+        end_month=end if months and end != months[-1] else None,
+        countries=tuple(countries),
+        regions=tuple(regions),
+    )
+
+
+def render_engine_panel(engine):
+    """
+    แผงในแถบข้าง: หน่วยความจำของ DuckDB และสถิติของ query cache
+    query เฉพาะตอนที่ผู้ใช้เปิดแผงนี้อยู่
+    """
+    panel = st.sidebar.expander("💾 หน่วยความจำ", key="memory_panel", on_change="rerun")
+    if not panel.open:
+        return
+    with panel:
+        memory = engine.memory_report()
+        st.metric("DuckDB engine", f"{memory['bytes'].sum() / 1024 ** 2:,.1f} MB")
+        st.caption("โหมด: out-of-core (scan Parquet บนดิสก์)" if engine.out_of_core else "โหมด: in-memory")
+        st.dataframe(memory, hide_index=True)
+
+        cache = engine.query_cache.stats()
+        st.metric("Query cache hit rate", f"{cache['hit_rate']:.0%}")
+        st.caption(
+            f"hit {cache['hits']:,} | miss {cache['misses']:,} | evicted {cache['evictions']:,} | "
+            f"{cache['entries']:,} รายการ ({cache['bytes'] / 1024 ** 2:,.1f} MB)"
+        )
+
+
+def render_timing_panel(trace: Trace):
+    """
+    Debug panel ในแถบข้าง: เวลา / จำนวนแถว / หน่วยความจำ ของแต่ละ stage ในการรันครั้งนี้
+    พร้อมดาวน์โหลดเป็น JSON lines หรือ Prometheus text (ตัวเลขสะสมของทั้ง process)
+    เรียกไว้ท้ายหน้า เพื่อให้เห็นทุก section ของการรันครั้งนี้
+    """
+    if not st.sidebar.toggle("🛠️ Debug: เวลาแต่ละขั้นตอน", key="debug_timing"):
+        return
+    with st.sidebar:
+        st.subheader("⏱️ Timing")
+        records = trace.to_frame()
+        if records.empty:
+            st.caption("ยังไม่มีข้อมูล")
+        else:
+            summary = (
+                records.assign(section=records["section"].fillna("-"))
+                .groupby(["section", "stage"], sort=False)
+                .agg(
+                    calls=("stage", "size"),
+                    total_ms=("duration_s", lambda s: s.sum() * 1000),
+                    self_ms=("self_s", lambda s: s.sum() * 1000),
+                    rows_out=("rows_out", "sum"),
+                    memory_mb=("memory_delta_bytes", lambda s: s.sum() / 1024 ** 2),
+                )
+                .reset_index()
+            )
+            st.dataframe(summary.round(2), hide_index=True)
+        st.download_button(
+            "⬇️ JSON lines", trace.to_json_lines(), file_name=f"{trace.name}_timing.jsonl",
+            mime="application/json", key="download_timing_jsonl",
+        )
+        st.download_button(
+            "⬇️ Prometheus", prometheus_text(), file_name="metrics.prom",
+            mime="text/plain", key="download_timing_prometheus",
+        )
+
+
+def render_insight(api_key: str, system_prompt: str, prompt: str, data_version: str, waiting_text: str):
+    """
+    แสดง AI insight ของ prompt นี้
+    ถ้ายังไม่มีผล (ไม่อยู่ใน cache) จะส่งงานไปรันเบื้องหลัง แล้วแสดงข้อความที่ stream มาเรื่อย ๆ
+    หน้าเว็บส่วนอื่นจึงแสดงผลได้ทันทีโดยไม่ต้องรอ LLM
+    """
+    future = get_insight_service(api_key).submit(system_prompt, prompt, data_version)
+    if future.done():
+        _show_insight(future)
+    else:
+        _wait_for_insight(future, waiting_text)
+
+
+def _show_insight(future) -> None:
+    error = future.exception()
+    if error is not None:
+        st.error(f"❌ AI วิเคราะห์ไม่สำเร็จ: {error}")
+    else:
+        st.markdown(future.result())
+
+
+@traced_fragment()
+def insight_section(
+    api_key: str,
+    title: str,
+    label: str,
+    options: list[str],
+    key: str,
+    force: bool,
+    system_prompt: str,
+    build_prompt,
+    data_version: str,
+    waiting_text: str,
+):
+    """
+    ส่วน AI Insight ท้าย section: radio เลือกโหมด (options[1] = ให้ AI วิเคราะห์) และผลวิเคราะห์
+    เป็น fragment จึงเปลี่ยนโหมดได้โดยไม่ rerun ทั้งหน้า
+    build_prompt (ฟังก์ชันไม่มี argument) ถูกเรียกเฉพาะเมื่อต้องให้ AI วิเคราะห์ หรือ force=True
+    """
+    st.subheader(title)
+    mode = st.radio(label, options, horizontal=True, key=key)
+    if force or mode == options[1]:
+        render_insight(api_key, system_prompt, build_prompt(), data_version, waiting_text)
+
+
+@traced_fragment(run_every=0.5)
+def _wait_for_insight(future, waiting_text: str):
+    # เช็กทุกครึ่งวินาที แสดงข้อความที่ stream มาแล้ว เมื่อเสร็จ (หรือล้มเหลว) แสดงผลใน fragment นี้เลย
+    # ไม่ rerun ทั้งหน้า -- st.rerun(scope="fragment") จาก fragment ซ้อนจะ rerun ได้แค่ตัวมันเอง
+    # ไม่ใช่ insight_section ที่ครอบอยู่ รอบถัดไปที่ insight_section รัน ผลอยู่ใน cache แล้ว
+    # จึงไม่สร้าง fragment นี้อีกและ Streamlit หยุดเช็กตามเวลาให้เอง
+    if future.done():
+        _show_insight(future)
+        return
+    if future.partial:
+        st.markdown(future.partial + " ▌")
+    else:
+        st.info(f"⏳ {waiting_text}")